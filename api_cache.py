@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+
+def _canonical(obj: Any) -> Any:
+    """Convert prompts, images and generation configs into a stable JSON-serializable form."""
+    if isinstance(obj, (bytes, bytearray)):
+        return {'sha256': hashlib.sha256(obj).hexdigest()}
+    if isinstance(obj, dict):
+        return {str(key): _canonical(value) for key, value in sorted(obj.items(), key=lambda item: str(item[0]))}
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(value) for value in obj]
+    if isinstance(obj, type) and hasattr(obj, 'model_json_schema'):
+        # Pydantic response schemas, e.g. Judgement
+        return obj.model_json_schema()
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    return repr(obj)
+
+
+def make_key(model: str, prompt: str, images: Any = None, config: Any = None) -> str:
+    """
+    Build a content-addressed cache key for one API call.
+
+    Args:
+        model: Model name
+        prompt: Full prompt text
+        images: Image bytes or data URLs sent with the prompt
+        config: Generation config (output limits, response schema, ...)
+
+    Returns:
+        Hex SHA-256 digest identifying the request
+    """
+    payload = json.dumps(_canonical([model, prompt, images or [], config]), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk SQLite cache of API responses keyed by `make_key`.
+
+    Entries older than `max_age_days` are dropped, and once the cache grows past
+    `max_size_mb` the least recently used entries are evicted first.
+    """
+
+    def __init__(self, path: str, max_age_days: float = 30, max_size_mb: float = 1024,
+                 enabled: bool = True, refresh: bool = False):
+        """
+        Args:
+            path: Path to the SQLite database file
+            max_age_days: Maximum age of an entry before it is evicted
+            max_size_mb: Maximum total size of cached values
+            enabled: If False, `get` always misses and `set` is a no-op
+            refresh: If True, `get` always misses but new responses are still stored
+        """
+        self.path = path
+        self.max_age_days = max_age_days
+        self.max_size_mb = max_size_mb
+        self.enabled = enabled
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+            self._evict()
+        return self._conn
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached response.
+
+        Args:
+            key: Cache key from `make_key`
+
+        Returns:
+            The cached response text, or None on a miss
+        """
+        if not self.enabled or self.refresh:
+            return None
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute('SELECT value, created FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            now = time.time()
+            if now - created > self.max_age_days * 86400:
+                conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                conn.commit()
+                return None
+            conn.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+            conn.commit()
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        """
+        Store a response.
+
+        Args:
+            key: Cache key from `make_key`
+            value: Response text
+        """
+        if not self.enabled or not value:
+            return
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            conn.execute('INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                         (key, value, len(value.encode('utf-8')), now, now))
+            conn.commit()
+
+    def _evict(self) -> None:
+        conn = self._conn
+        conn.execute('DELETE FROM entries WHERE created < ?', (time.time() - self.max_age_days * 86400,))
+        max_size = self.max_size_mb * 1024 * 1024
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total > max_size:
+            # Walk entries from least to most recently used until enough space is freed
+            excess = total - max_size
+            stale_keys = []
+            for key, size in conn.execute('SELECT key, size FROM entries ORDER BY accessed'):
+                stale_keys.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            conn.executemany('DELETE FROM entries WHERE key = ?', stale_keys)
+        conn.commit()
+
+    def evict(self) -> None:
+        """Apply the age and size limits now."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._connect()
+            self._evict()
+
+
+def add_cache_arguments(parser) -> None:
+    """
+    Add the shared cache switches to an argument parser.
+
+    Args:
+        parser: argparse.ArgumentParser to extend
+    """
+    parser.add_argument('--no-cache', dest='no_cache', action='store_true', help='Do not read or write the response cache')
+    parser.add_argument('--refresh', action='store_true', help='Ignore cached responses but store the new ones')
+    parser.add_argument('--cache_max_age_days', type=float, default=30, help='Evict cache entries older than this')
+    parser.add_argument('--cache_max_size_mb', type=float, default=1024, help='Evict least recently used entries beyond this size')
+
+
+def configure_cache(cache: ResponseCache, args) -> None:
+    """
+    Apply parsed command-line switches from `add_cache_arguments` to a cache.
+
+    Args:
+        cache: Cache to configure
+        args: Parsed arguments
+    """
+    cache.enabled = not args.no_cache
+    cache.refresh = args.refresh
+    cache.max_age_days = args.cache_max_age_days
+    cache.max_size_mb = args.cache_max_size_mb
@@ -0,0 +1,382 @@
+import asyncio
+import random
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+from telemetry import telemetry
+
+RATE_LIMIT = 'rate_limit'
+TRANSIENT = 'transient'
+FATAL = 'fatal'
+
+TRANSIENT_ERROR_NAMES = {'APIConnectionError', 'APITimeoutError', 'ConnectError', 'ReadTimeout',
+                         'ConnectTimeout', 'RemoteProtocolError', 'ServerError'}
+
+
+class EmptyResponseError(Exception):
+    """Raised by callers when the API returned no usable text, so the call is retried."""
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    # openai.APIStatusError exposes status_code, google.genai.errors.APIError exposes code
+    for attribute in ('status_code', 'code'):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, 'response', None)
+    value = getattr(response, 'status_code', None)
+    return value if isinstance(value, int) else None
+
+
+def classify_error(error: Exception) -> str:
+    """
+    Classify an API error.
+
+    Args:
+        error: Exception raised by an SDK call
+
+    Returns:
+        RATE_LIMIT for 429s, TRANSIENT for timeouts, connection problems and
+        5xx/408/409 responses, FATAL for other 4xx responses
+    """
+    status = _status_code(error)
+    if status == 429:
+        return RATE_LIMIT
+    if status is not None:
+        if status >= 500 or status in (408, 409):
+            return TRANSIENT
+        if 400 <= status < 500:
+            return FATAL
+    if isinstance(error, (EmptyResponseError, ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return TRANSIENT
+    if type(error).__name__ in TRANSIENT_ERROR_NAMES:
+        return TRANSIENT
+    # Unknown errors keep the old behaviour of being retried
+    return TRANSIENT
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """
+    Read the server-suggested wait time from an error, if any.
+
+    Looks at the Retry-After/retry-after-ms headers (OpenAI) and at the
+    RetryInfo retryDelay detail (Gemini).
+
+    Args:
+        error: Exception raised by an SDK call
+
+    Returns:
+        Seconds to wait, or None if the server did not say
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if headers:
+        value = headers.get('retry-after-ms')
+        if value:
+            try:
+                return float(value) / 1000
+            except ValueError:
+                pass
+        value = headers.get('retry-after')
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    match = re.search(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", str(getattr(error, 'details', '') or error))
+    if match:
+        return float(match.group(1))
+    return None
+
+
+class RetryPolicy:
+    """Jittered exponential backoff settings."""
+
+    def __init__(self, max_attempts: int = 6, base_delay: float = 1.0, max_delay: float = 60.0):
+        """
+        Args:
+            max_attempts: Maximum number of attempts per call, including the first
+            base_delay: Backoff before the first retry, in seconds
+            max_delay: Upper bound of a single backoff, in seconds
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, error: Exception) -> float:
+        """
+        Compute how long to wait before the next attempt.
+
+        Uses "full jitter" so concurrent callers do not retry in lockstep, and
+        never waits less than the server's Retry-After.
+
+        Args:
+            attempt: Number of attempts made so far (1 after the first failure)
+            error: The error of the last attempt
+
+        Returns:
+            Seconds to wait
+        """
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        suggested = retry_after(error)
+        if suggested is not None:
+            backoff = max(backoff, suggested)
+        return backoff
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD concurrency gate.
+
+    The limit grows by one request per window of successful requests (additive
+    increase) and halves on a rate-limit error (multiplicative decrease), so the
+    number of requests in flight follows what the provider actually accepts. A
+    burst of 429s from requests that were already in flight is answered by a
+    single decrease: only requests started after the last decrease can trigger
+    the next one.
+
+    The gate is entered with `async with` from one event loop, or with `slot()`
+    from threads; a single gate is not shared between the two.
+    """
+
+    def __init__(self, max_concurrency: int, min_concurrency: int = 1):
+        """
+        Args:
+            max_concurrency: Upper bound and starting value of the limit
+            min_concurrency: Lower bound of the limit
+        """
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        # Number of decreases so far; a request remembers it when it starts
+        self.decreases = 0
+        self._condition = None
+        self._sync_condition = threading.Condition()
+        self._lock = threading.Lock()
+
+    @property
+    def condition(self) -> asyncio.Condition:
+        # Created lazily so the gate can be built outside a running event loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def __aenter__(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+            return self.decreases
+
+    async def __aexit__(self, *exc_info):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self) -> Iterator[int]:
+        """Blocking counterpart of `async with gate`; yields the window the request started in."""
+        with self._sync_condition:
+            self._sync_condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+            window = self.decreases
+        try:
+            yield window
+        finally:
+            with self._sync_condition:
+                self.in_flight -= 1
+                self._sync_condition.notify_all()
+
+    def on_success(self) -> None:
+        """Additive increase."""
+        with self._lock:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+    def on_rate_limit(self, window: Optional[int] = None) -> None:
+        """
+        Multiplicative decrease, at most once per window.
+
+        Args:
+            window: Value of `decreases` when the rate-limited request started, as
+                returned on entering the gate; a request that started before the
+                last decrease is ignored. None always decreases.
+        """
+        with self._lock:
+            if window is not None and window != self.decreases:
+                return
+            self.limit = max(self.min_concurrency, self.limit / 2)
+            self.decreases += 1
+
+
+def _track_attempt(record: Optional[dict], attempt: int, queued: float, started: Optional[float]) -> None:
+    # Adds one attempt's queue wait to a telemetry record and keeps the latency of the latest attempt
+    if record is None:
+        return
+    now = time.perf_counter()
+    started = now if started is None else started
+    record['attempts'] = attempt
+    record['queue_wait'] += started - queued
+    record['latency'] = now - started
+
+
+def _report(message: str) -> None:
+    # tqdm.write prints above any progress bar instead of through it
+    try:
+        from tqdm import tqdm
+    except ImportError:
+        print(message, file=sys.stderr)
+        return
+    tqdm.write(message, file=sys.stderr)
+
+
+class APICaller:
+    """
+    Shared wrapper for every generate, judge and extract API call.
+
+    Applies the rate limiter, the AIMD concurrency gate and the retry policy, and
+    gives up immediately on fatal errors.
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = None, limiter=None, policy: Optional[RetryPolicy] = None,
+                 stage: Optional[str] = None, recorder=None):
+        """
+        Args:
+            max_concurrency: Starting and maximum AIMD limit, or None to not gate requests
+            limiter: Optional rate_limiter.RateLimiter applied before each attempt
+            policy: Retry policy, RetryPolicy() by default
+            stage: Label of the calls in the telemetry log, e.g. 'generate' or 'judge'
+            recorder: telemetry.Telemetry to record calls to, the shared one by default
+        """
+        self.concurrency = AdaptiveConcurrency(max_concurrency) if max_concurrency else None
+        self.limiter = limiter
+        self.policy = policy or RetryPolicy()
+        self.stage = stage
+        self.recorder = recorder or telemetry
+
+    def _record(self, kind: Optional[str], window: Optional[int]) -> None:
+        if self.concurrency is None:
+            return
+        if kind is None:
+            self.concurrency.on_success()
+        elif kind == RATE_LIMIT:
+            self.concurrency.on_rate_limit(window)
+
+    def _failed(self, error: Exception, record: Optional[dict], attempt: int, queued: float,
+                started: Optional[float], window: Optional[int]) -> Optional[float]:
+        # Bookkeeping for a failed attempt shared by call and call_sync; returns the
+        # delay before the next attempt, or None when the error should be raised
+        kind = classify_error(error)
+        self._record(kind, window)
+        _track_attempt(record, attempt, queued, started)
+        if kind == FATAL or attempt >= self.policy.max_attempts:
+            self.recorder.end(record, kind)
+            return None
+        delay = self.policy.delay(attempt, error)
+        _report(f'Error occurred ({kind}), retrying in {delay:.1f}s: {error}')
+        return delay
+
+    def _succeeded(self, record: Optional[dict], attempt: int, queued: float, started: Optional[float],
+                   window: Optional[int]) -> None:
+        self._record(None, window)
+        _track_attempt(record, attempt, queued, started)
+        self.recorder.end(record, 'ok')
+
+    async def call(self, fn: Callable, *args, tokens: int = 0, **kwargs) -> Any:
+        """
+        Await `fn(*args, **kwargs)` with retries.
+
+        Args:
+            fn: Coroutine function making one API call
+            tokens: Estimated tokens per attempt for the rate limiter
+            *args, **kwargs: Arguments for `fn`
+
+        Returns:
+            The result of the first successful attempt
+
+        Raises:
+            The last error once it is fatal or attempts are exhausted
+        """
+        record = self.recorder.begin(self.stage)
+        attempt = 0
+        while True:
+            attempt += 1
+            queued = time.perf_counter()
+            if self.limiter is not None:
+                await self.limiter.acquire(tokens)
+            started = None
+            window = None
+            try:
+                if self.concurrency is not None:
+                    async with self.concurrency as window:
+                        started = time.perf_counter()
+                        result = await fn(*args, **kwargs)
+                else:
+                    started = time.perf_counter()
+                    result = await fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._failed(e, record, attempt, queued, started, window)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self._succeeded(record, attempt, queued, started, window)
+            return result
+
+    def call_sync(self, fn: Callable, *args, tokens: int = 0, **kwargs) -> Any:
+        """
+        Blocking counterpart of `call` for synchronous scripts and worker threads.
+
+        Applies the rate limiter, the AIMD gate and the retry policy like `call`.
+
+        Args:
+            fn: Function making one API call
+            tokens: Estimated tokens per attempt for the rate limiter
+            *args, **kwargs: Arguments for `fn`
+
+        Returns:
+            The result of the first successful attempt
+        """
+        record = self.recorder.begin(self.stage)
+        attempt = 0
+        while True:
+            attempt += 1
+            queued = time.perf_counter()
+            if self.limiter is not None:
+                self.limiter.acquire_sync(tokens)
+            started = None
+            window = None
+            try:
+                if self.concurrency is not None:
+                    with self.concurrency.slot() as window:
+                        started = time.perf_counter()
+                        result = fn(*args, **kwargs)
+                else:
+                    started = time.perf_counter()
+                    result = fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._failed(e, record, attempt, queued, started, window)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self._succeeded(record, attempt, queued, started, window)
+            return result
+
+
+def add_retry_arguments(parser) -> None:
+    """
+    Add the shared retry switches to an argument parser.
+
+    Args:
+        parser: argparse.ArgumentParser to extend
+    """
+    parser.add_argument('--max_attempts', type=int, default=6, help='Maximum attempts per API call')
+    parser.add_argument('--max_backoff', type=float, default=60, help='Maximum backoff between attempts, in seconds')
+
+
+def policy_from_args(args) -> RetryPolicy:
+    """Build a RetryPolicy from arguments added by `add_retry_arguments`."""
+    return RetryPolicy(max_attempts=args.max_attempts, max_delay=args.max_backoff)
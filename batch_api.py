@@ -0,0 +1,363 @@
+import asyncio
+import base64
+import io
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from api_retry import APICaller
+
+BATCH_STATE_DIR = 'cache/batches'
+
+OPENAI_TERMINAL_STATES = {'completed', 'failed', 'expired', 'cancelled'}
+GEMINI_TERMINAL_STATES = {'JOB_STATE_SUCCEEDED', 'JOB_STATE_FAILED', 'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED'}
+
+
+def make_custom_id(exam_id: str, index: int) -> str:
+    """Build the id that maps a batch result back to its (exam_id, row)."""
+    return f'{exam_id}:{index}'
+
+
+def parse_custom_id(custom_id: str) -> Tuple[str, int]:
+    """Inverse of `make_custom_id`."""
+    exam_id, index = custom_id.rsplit(':', 1)
+    return exam_id, int(index)
+
+
+class BatchJournal:
+    """
+    Record of a submitted batch job, so that a rerun resumes it.
+
+    A batch can run for up to 24 hours. Its id is saved together with the
+    custom ids it covers as soon as it is submitted, and a rerun with the same
+    pending requests polls that job again instead of submitting (and paying for)
+    it twice. Clear the journal once the results are stored.
+    """
+
+    def __init__(self, name: str, state_dir: str = BATCH_STATE_DIR):
+        """
+        Args:
+            name: Name of the run, e.g. 'generate_o4-mini'
+            state_dir: Directory holding the journal files
+        """
+        self.path = os.path.join(state_dir, name.replace('/', '--') + '.json')
+
+    def load(self, custom_ids: Iterable[str]) -> Optional[str]:
+        """
+        Get the id of a saved job that covers exactly these requests.
+
+        Args:
+            custom_ids: Custom ids of the pending requests
+
+        Returns:
+            The job id, or None if there is no saved job or it covers other requests
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, encoding='utf-8') as f:
+            state = json.load(f)
+        if set(state['custom_ids']) != set(custom_ids):
+            print(f'Not resuming batch {state["id"]}: the pending requests have changed')
+            return None
+        return state['id']
+
+    def save(self, job_id: str, custom_ids: Iterable[str]) -> None:
+        """Record a submitted job and the custom ids of its requests."""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'id': job_id, 'custom_ids': list(custom_ids)}, f)
+
+    def clear(self) -> None:
+        """Forget the job once its results are stored."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def openai_chat_request(custom_id: str, model: str, prompt: str, images: List[str],
+                        max_completion_tokens: int) -> Dict[str, Any]:
+    """
+    Build one OpenAI Batch line for the chat completions endpoint.
+
+    Args:
+        custom_id: Id from `make_custom_id`
+        model: Model name
+        prompt: Prompt text
+        images: Image data URLs
+        max_completion_tokens: Output token limit
+
+    Returns:
+        Batch request dictionary
+    """
+    content = [{"type": "text", "text": prompt}] + [{"type": "image_url", "image_url": {"url": image}} for image in images]
+    return {
+        'custom_id': custom_id,
+        'method': 'POST',
+        'url': '/v1/chat/completions',
+        'body': {
+            'model': model,
+            'messages': [{'role': 'user', 'content': content}],
+            'max_completion_tokens': max_completion_tokens,
+        },
+    }
+
+
+def strict_json_schema(schema_model: type) -> Dict[str, Any]:
+    """Build a strict structured-output JSON schema from a flat pydantic model."""
+    schema = schema_model.model_json_schema()
+    schema['additionalProperties'] = False
+    schema['required'] = list(schema['properties'])
+    return schema
+
+
+def openai_responses_request(custom_id: str, model: str, prompt: str, images: List[str],
+                             schema_model: type, max_output_tokens: int,
+                             reasoning_effort: str = 'medium') -> Dict[str, Any]:
+    """
+    Build one OpenAI Batch line for the responses endpoint with structured output.
+
+    Args:
+        custom_id: Id from `make_custom_id`
+        model: Model name
+        prompt: Prompt text
+        images: Image data URLs
+        schema_model: Pydantic model describing the expected output
+        max_output_tokens: Output token limit
+        reasoning_effort: Reasoning effort for reasoning models
+
+    Returns:
+        Batch request dictionary
+    """
+    return {
+        'custom_id': custom_id,
+        'method': 'POST',
+        'url': '/v1/responses',
+        'body': {
+            'model': model,
+            'reasoning': {'effort': reasoning_effort},
+            'input': [{
+                'role': 'user',
+                'content': [{'type': 'input_text', 'text': prompt}] +
+                           [{'type': 'input_image', 'image_url': image} for image in images],
+            }],
+            'max_output_tokens': max_output_tokens,
+            'text': {'format': {
+                'type': 'json_schema',
+                'name': schema_model.__name__,
+                'schema': strict_json_schema(schema_model),
+                'strict': True,
+            }},
+        },
+    }
+
+
+def to_jsonl(requests: Iterable[Dict[str, Any]]) -> bytes:
+    """Serialize batch requests into a JSONL payload."""
+    return ''.join(json.dumps(request, ensure_ascii=False) + '\n' for request in requests).encode('utf-8')
+
+
+def _response_text(body: Dict[str, Any]) -> Optional[str]:
+    if 'choices' in body:
+        return body['choices'][0]['message']['content']
+    # Responses API: concatenate the text parts of the output messages
+    texts = [part['text']
+             for item in body.get('output', []) if item.get('type') == 'message'
+             for part in item.get('content', []) if part.get('type') == 'output_text']
+    return ''.join(texts) if texts else None
+
+
+def parse_openai_output(text: str) -> Dict[str, str]:
+    """
+    Parse an OpenAI Batch output (or error) file.
+
+    Args:
+        text: JSONL content of the output file
+
+    Returns:
+        Dictionary mapping custom_id to the response text, or to an
+        'Error: ...' message for requests that failed
+    """
+    results = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get('response') or {}
+        body = response.get('body') or {}
+        if record.get('error') or response.get('status_code', 200) != 200:
+            error = record.get('error') or body.get('error')
+            results[record['custom_id']] = f'Error: {error}'
+            continue
+        result = _response_text(body)
+        results[record['custom_id']] = result if result else 'Error: Empty response'
+    return results
+
+
+async def run_openai_batch(client, requests: List[Dict[str, Any]], endpoint: str, poll_interval: float = 30,
+                           caller: Optional[APICaller] = None, journal: Optional[BatchJournal] = None) -> Dict[str, str]:
+    """
+    Submit a batch job to OpenAI, wait for it and collect the results.
+
+    Works with any OpenAI-compatible server that implements the files and
+    batches endpoints, including a local stub configured via OPENAI_BASE_URL.
+
+    Args:
+        client: AsyncOpenAI client
+        requests: Batch request dictionaries
+        endpoint: Endpoint the requests target, e.g. '/v1/chat/completions'
+        poll_interval: Seconds between status checks
+        caller: APICaller retrying the submission, status and download calls
+        journal: Where the job id is saved; a matching saved job is resumed
+
+    Returns:
+        Dictionary mapping custom_id to response text or 'Error: ...'
+    """
+    if not requests:
+        return {}
+    caller = caller or APICaller(stage='batch')
+    custom_ids = [request['custom_id'] for request in requests]
+    batch_id = journal.load(custom_ids) if journal is not None else None
+    if batch_id is not None:
+        batch = await caller.call(client.batches.retrieve, batch_id)
+        print(f'Resuming OpenAI batch {batch.id}: {batch.status}')
+    else:
+        payload = to_jsonl(requests)
+
+        async def upload():
+            # A fresh buffer per attempt, as a failed upload may have consumed it
+            return await client.files.create(file=('batch.jsonl', io.BytesIO(payload)), purpose='batch')
+
+        batch_file = await caller.call(upload)
+        batch = await caller.call(client.batches.create, input_file_id=batch_file.id, endpoint=endpoint,
+                                  completion_window='24h')
+        if journal is not None:
+            journal.save(batch.id, custom_ids)
+        print(f'Submitted OpenAI batch {batch.id} with {len(requests)} requests')
+
+    while batch.status not in OPENAI_TERMINAL_STATES:
+        await asyncio.sleep(poll_interval)
+        batch = await caller.call(client.batches.retrieve, batch.id)
+        print(f'Batch {batch.id}: {batch.status} {batch.request_counts}')
+
+    results = {}
+    for file_id in [batch.output_file_id, batch.error_file_id]:
+        if file_id:
+            content = await caller.call(client.files.content, file_id)
+            results.update(parse_openai_output(content.text))
+    for custom_id in custom_ids:
+        results.setdefault(custom_id, f'Error: Batch {batch.status} without a result')
+    return results
+
+
+def gemini_schema(schema_model: type) -> Dict[str, Any]:
+    """Build a Gemini response schema (an OpenAPI subset) from a flat pydantic model."""
+    properties = schema_model.model_json_schema()['properties']
+    return {
+        'type': 'OBJECT',
+        'properties': {name: {'type': field['type'].upper()} for name, field in properties.items()},
+        'required': list(properties),
+    }
+
+
+def gemini_request(custom_id: str, prompt: str, images: List[Tuple[bytes, str]],
+                   config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Build one line of a Gemini batch input file.
+
+    Args:
+        custom_id: Id from `make_custom_id`
+        prompt: Prompt text
+        images: (raw bytes, MIME type) pairs, sent before the prompt as in the interactive path
+        config: Generation config; a pydantic `response_schema` is converted with `gemini_schema`
+
+    Returns:
+        Keyed request dictionary
+    """
+    parts = [{'inline_data': {'mime_type': mime_type, 'data': base64.b64encode(data).decode('ascii')}}
+             for data, mime_type in images]
+    parts.append({'text': prompt})
+    request = {'contents': [{'role': 'user', 'parts': parts}]}
+    if config:
+        config = dict(config)
+        if isinstance(config.get('response_schema'), type):
+            config['response_schema'] = gemini_schema(config['response_schema'])
+        request['generation_config'] = config
+    return {'key': custom_id, 'request': request}
+
+
+def parse_gemini_output(text: str) -> Dict[str, str]:
+    """
+    Parse a Gemini batch output file.
+
+    Args:
+        text: JSONL content of the output file, one keyed response or error per line
+
+    Returns:
+        Dictionary mapping custom_id to response text or 'Error: ...'
+    """
+    results = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if record.get('error'):
+            results[record['key']] = f'Error: {record["error"]}'
+            continue
+        candidates = (record.get('response') or {}).get('candidates') or [{}]
+        parts = (candidates[0].get('content') or {}).get('parts') or []
+        result = ''.join(part.get('text', '') for part in parts if not part.get('thought'))
+        results[record['key']] = result if result else 'Error: Empty response'
+    return results
+
+
+async def run_gemini_batch(client, model: str, requests: List[Dict[str, Any]], poll_interval: float = 30,
+                           caller: Optional[APICaller] = None, journal: Optional[BatchJournal] = None) -> Dict[str, str]:
+    """
+    Submit a batch job to Gemini, wait for it and collect the results.
+
+    The requests are uploaded as a JSONL file, as image-bearing batches exceed
+    the size limit of inlined requests.
+
+    Args:
+        client: genai.Client
+        model: Model name
+        requests: Requests from `gemini_request`
+        poll_interval: Seconds between status checks
+        caller: APICaller retrying the submission, status and download calls
+        journal: Where the job name is saved; a matching saved job is resumed
+
+    Returns:
+        Dictionary mapping custom_id to response text or 'Error: ...'
+    """
+    if not requests:
+        return {}
+    caller = caller or APICaller(stage='batch')
+    custom_ids = [request['key'] for request in requests]
+    job_name = journal.load(custom_ids) if journal is not None else None
+    if job_name is not None:
+        job = await caller.call(client.aio.batches.get, name=job_name)
+        print(f'Resuming Gemini batch {job.name}: {job.state.name}')
+    else:
+        payload = to_jsonl(requests)
+
+        async def upload():
+            return await client.aio.files.upload(file=io.BytesIO(payload),
+                                                 config={'display_name': 'batch.jsonl', 'mime_type': 'jsonl'})
+
+        batch_file = await caller.call(upload)
+        job = await caller.call(client.aio.batches.create, model=model, src=batch_file.name)
+        if journal is not None:
+            journal.save(job.name, custom_ids)
+        print(f'Submitted Gemini batch {job.name} with {len(requests)} requests')
+
+    while job.state.name not in GEMINI_TERMINAL_STATES:
+        await asyncio.sleep(poll_interval)
+        job = await caller.call(client.aio.batches.get, name=job.name)
+        print(f'Batch {job.name}: {job.state.name}')
+
+    results = {}
+    if job.dest is not None and job.dest.file_name:
+        content = await caller.call(asyncio.to_thread, client.files.download, file=job.dest.file_name)
+        results = parse_gemini_output(content.decode('utf-8'))
+    for custom_id in custom_ids:
+        results.setdefault(custom_id, f'Error: Batch {job.state.name} without a result')
+    return results
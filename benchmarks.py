@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from get_results import LANGUAGES, decode_judgements, language_scores
+from image_store import ImageStore
+from manifest import SPLIT_SUFFIX
+from result_statistics import stratified_bootstrap
+from results_io import read_results, write_results
+
+DEFAULT_BASELINE_PATH = 'output/benchmark_baseline.json'
+DEFAULT_HISTORY_PATH = 'output/benchmarks.jsonl'
+
+# A benchmark is slower than its baseline when its median time exceeds the baseline by this fraction
+DEFAULT_TOLERANCE = 0.25
+
+WORDS = ('the function derivative integral probability triangle area equation value answer '
+         'an fheidhm díorthach suimeálaí dóchúlacht triantán achar cothromóid luach freagra').split()
+
+
+class Fixtures:
+    """
+    Synthetic IRLBench-shaped data: splits of exam rows with page images, long
+    responses and judgements from several models.
+    """
+
+    def __init__(self, root: str, splits: int = 24, rows: int = 40, models: int = 4, response_chars: int = 6000,
+                 image_size: Tuple[int, int] = (1200, 800), seed: int = 0):
+        """
+        Args:
+            root: Scratch directory for the image store and result files
+            splits: Number of splits, half English and half Irish versions
+            rows: Rows per split
+            models: Number of student models
+            response_chars: Approximate length of a response
+            image_size: (width, height) of a page image
+            seed: Random seed
+        """
+        from PIL import Image
+
+        self.root = root
+        rng = np.random.default_rng(seed)
+        self.split_names = [f'LC{index // 2:03d}ALP100{"EV" if index % 2 == 0 else "IV"}{SPLIT_SUFFIX}' for index in range(splits)]
+        self.models = [f'model-{index}' for index in range(models)]
+
+        # Pages are mostly white with dark word boxes, so they compress like scanned text
+        self.pages = [Image.fromarray(self._page(rng, *image_size)) for _ in range(8)]
+        store = ImageStore(os.path.join(root, 'images'))
+        self.page_hashes = [store.put_image(page) for page in self.pages]
+        self.image_store_root = store.root
+
+        self.responses = [self._text(rng, response_chars) for _ in range(rows * 4)]
+        frames = {}
+        for split in self.split_names:
+            pages = rng.integers(0, len(self.page_hashes), (rows, 3))
+            frames[split] = pd.DataFrame({
+                'problem': [self._text(rng, 600) for _ in range(rows)],
+                'answer': [self._text(rng, 800) for _ in range(rows)],
+                'problem_image_1': [self.page_hashes[i] for i in pages[:, 0]],
+                'problem_image_2': [self.page_hashes[i] if keep else None for i, keep in zip(pages[:, 1], rng.random(rows) < 0.3)],
+                'answer_image_1': [self.page_hashes[i] for i in pages[:, 2]],
+                'response': [self.responses[i] for i in rng.integers(0, len(self.responses), rows)],
+            })
+        self.frames = frames
+
+        judged = []
+        for model in self.models:
+            for split, frame in frames.items():
+                subject = split[:-len(SPLIT_SUFFIX)]
+                draws = rng.random(len(frame))
+                judgements = [json.dumps({'extracted_final_answer': '42', 'reasoning': self._text(rng, 300),
+                                          'correct': 'yes' if draw < 0.6 else 'no', 'confidence': f'{int(draw * 100)}%'})
+                              if draw > 0.02 else 'Error: Failed to get judgement' for draw in draws]
+                judged.append(pd.DataFrame({'model': model, 'judge_model': 'judge', 'subject': subject,
+                                            'language': LANGUAGES[subject[-2:]], 'row': np.arange(len(frame)),
+                                            'judgement': judgements}))
+        self.judgements = pd.concat(judged, ignore_index=True)
+
+    @staticmethod
+    def _page(rng, width: int, height: int) -> np.ndarray:
+        page = np.full((height, width), 255, dtype=np.uint8)
+        for top in range(40, height - 40, 28):
+            left = 60
+            while left < width - 120:
+                word = int(rng.integers(20, 90))
+                page[top:top + 14, left:left + word] = rng.integers(0, 80)
+                left += word + int(rng.integers(8, 16))
+        return page
+
+    @staticmethod
+    def _text(rng, chars: int) -> str:
+        words = []
+        length = 0
+        while length < chars:
+            word = WORDS[rng.integers(len(WORDS))]
+            words.append(word)
+            length += len(word) + 1
+        return ' '.join(words) + f'\nAnswer: {int(rng.integers(100))}\nConfidence: {int(rng.integers(100))}%'
+
+
+def _legacy_cells(fixtures: Fixtures) -> List[str]:
+    # Older response CSVs stored the repr of the dataset's image dict in every image cell
+    store = ImageStore(fixtures.image_store_root)
+    cells = [repr({'bytes': store.get_bytes(digest), 'path': None}) for digest in fixtures.page_hashes]
+    return cells * 8
+
+
+def _write_all(fixtures: Fixtures, fmt: str) -> None:
+    directory = os.path.join(fixtures.root, fmt)
+    os.makedirs(directory, exist_ok=True)
+    for split, frame in fixtures.frames.items():
+        write_results(frame, os.path.join(directory, split), fmt)
+
+
+def _read_all(fixtures: Fixtures, fmt: str) -> None:
+    for split in fixtures.split_names:
+        read_results(os.path.join(fixtures.root, fmt, f'{split}.{fmt}'))
+
+
+def _detect(fixtures: Fixtures) -> None:
+    from language_fidelity import LanguageDetector
+
+    LanguageDetector(enabled=False).predict(fixtures.responses)
+
+
+# name -> (setup, run, requirement): setup(fixtures) builds the input of run; a
+# benchmark is skipped when its requirement cannot be imported
+BENCHMARKS: Dict[str, Tuple[Callable[[Fixtures], Any], Callable[[Fixtures, Any], None], Optional[str]]] = {
+    # PNG encode + hash of decoded dataset images (the old convert_to_str path)
+    'image_encode': (lambda f: ImageStore(os.path.join(f.root, 'encode')),
+                     lambda f, store: [store.put_image(page) for page in f.pages], None),
+    # base64 data URLs of every image referenced by one model's requests, with a cold memo
+    'image_data_url': (lambda f: None,
+                       lambda f, _: [ImageStore(f.image_store_root).data_url(digest)
+                                     for frame in f.frames.values() for digest in frame['problem_image_1']], None),
+    # ast.literal_eval recovery of images embedded in older response CSVs
+    'legacy_image_recovery': (_legacy_cells,
+                              lambda f, cells: [ImageStore(os.path.join(f.root, 'legacy')).put_image(cell) for cell in cells], None),
+    'results_write_parquet': (lambda f: None, lambda f, _: _write_all(f, 'parquet'), 'pyarrow'),
+    'results_read_parquet': (lambda f: _write_all(f, 'parquet'), lambda f, _: _read_all(f, 'parquet'), 'pyarrow'),
+    'results_write_csv': (lambda f: None, lambda f, _: _write_all(f, 'csv'), None),
+    'results_read_csv': (lambda f: _write_all(f, 'csv'), lambda f, _: _read_all(f, 'csv'), None),
+    'decode_judgements': (lambda f: f.judgements['judgement'], lambda f, cells: decode_judgements(cells), None),
+    'subject_aggregation': (lambda f: pd.concat([f.judgements.drop(columns='judgement'),
+                                                 decode_judgements(f.judgements['judgement'])], axis=1).astype(
+                                {'model': 'category', 'judge_model': 'category', 'subject': 'category', 'language': 'category'}),
+                            lambda f, df: language_scores(df), None),
+    'bootstrap': (lambda f: decode_judgements(f.judgements['judgement']).assign(subject=f.judgements['subject']).dropna(),
+                  lambda f, df: stratified_bootstrap(df['correct'].to_numpy(), df['subject'].to_numpy(), 2000), None),
+    'language_detection': (lambda f: None, _detect, 'fasttext'),
+}
+
+
+def available(requirement: Optional[str]) -> bool:
+    if requirement is None:
+        return True
+    try:
+        __import__(requirement)
+        return True
+    except ImportError:
+        return False
+
+
+def run_benchmarks(fixtures: Fixtures, names: List[str], repeat: int = 5) -> Dict[str, Dict[str, float]]:
+    """
+    Time benchmarks.
+
+    Args:
+        fixtures: Synthetic data
+        names: Benchmarks to run (keys of BENCHMARKS)
+        repeat: Timed runs per benchmark, after one warm-up run
+
+    Returns:
+        Dictionary mapping each benchmark that ran to its 'median' and 'min' seconds
+    """
+    results = {}
+    for name in names:
+        setup, run, requirement = BENCHMARKS[name]
+        if not available(requirement):
+            print(f'{name:24s} skipped ({requirement} is not installed)')
+            continue
+        state = setup(fixtures)
+        run(fixtures, state)
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run(fixtures, state)
+            times.append(time.perf_counter() - started)
+        results[name] = {'median': statistics.median(times), 'min': min(times)}
+        print(f'{name:24s} median {results[name]["median"] * 1000:9.1f} ms   min {results[name]["min"] * 1000:9.1f} ms')
+    return results
+
+
+def regressions(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+                tolerance: float = DEFAULT_TOLERANCE) -> Dict[str, float]:
+    """
+    Find benchmarks that got slower than their baseline.
+
+    Args:
+        results: Result of `run_benchmarks`
+        baseline: Earlier result of `run_benchmarks` on the same machine
+        tolerance: Allowed slowdown as a fraction of the baseline median
+
+    Returns:
+        Dictionary mapping each regressed benchmark to its slowdown ratio
+    """
+    slower = {}
+    for name, result in results.items():
+        if name in baseline:
+            ratio = result['median'] / baseline[name]['median']
+            if ratio > 1 + tolerance:
+                slower[name] = ratio
+    return slower
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the local (non-API) hot paths on synthetic IRLBench-shaped data.")
+    parser.add_argument('--only', type=str, default=None, help=f'Comma-separated benchmarks to run (default: all of {", ".join(BENCHMARKS)})')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per benchmark')
+    parser.add_argument('--splits', type=int, default=24, help='Number of synthetic splits')
+    parser.add_argument('--rows', type=int, default=40, help='Rows per split')
+    parser.add_argument('--models', type=int, default=4, help='Number of synthetic student models')
+    parser.add_argument('--response_chars', type=int, default=6000, help='Approximate length of a synthetic response')
+    parser.add_argument('--image_size', type=str, default='1200x800', help='WIDTHxHEIGHT of a synthetic page image')
+    parser.add_argument('--baseline', type=str, default=DEFAULT_BASELINE_PATH, help='Baseline timings to compare against')
+    parser.add_argument('--save-baseline', dest='save_baseline', action='store_true', help='Store this run as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='Allowed slowdown over the baseline, e.g. 0.25 for 25%%')
+    parser.add_argument('--history', type=str, default=DEFAULT_HISTORY_PATH, help='JSONL file every run is appended to')
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.only.split(',')] if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f'Unknown benchmarks: {", ".join(unknown)}')
+    width, height = (int(value) for value in args.image_size.lower().split('x'))
+
+    with tempfile.TemporaryDirectory(prefix='irlbench-bench-') as root:
+        fixtures = Fixtures(root, args.splits, args.rows, args.models, args.response_chars, (width, height))
+        results = run_benchmarks(fixtures, names, args.repeat)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+    with open(args.history, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'time': time.time(), 'machine': platform.node(), 'python': platform.python_version(),
+                            'config': {key: getattr(args, key) for key in ('splits', 'rows', 'models', 'response_chars', 'image_size')},
+                            'results': results}) + '\n')
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f'Saved baseline to {args.baseline}')
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}; run with --save-baseline to create one')
+        return
+    with open(args.baseline, encoding='utf-8') as f:
+        slower = regressions(results, json.load(f), args.tolerance)
+    for name, ratio in slower.items():
+        print(f'REGRESSION {name}: {ratio:.2f}x the baseline median')
+    if slower:
+        sys.exit(1)
+    print(f'No regressions beyond {args.tolerance:.0%} of the baseline')
+
+
+if __name__ == "__main__":
+    main()
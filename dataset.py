@@ -0,0 +1,151 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from image_store import ImageStore, image_columns
+from manifest import SPLIT_SUFFIX, get_splits
+
+DATASET_NAME = 'ReliableAI/IRLBench'
+
+# Rows read from the memory-mapped Arrow table at a time while streaming
+ROW_BATCH_SIZE = 64
+
+
+def parse_splits(value: Optional[str], available: Optional[Sequence[str]] = None) -> List[str]:
+    """
+    Parse a comma-separated split selection.
+
+    Args:
+        value: e.g. 'LC003ALP100EV,LC003ALP100IV_problems'; the '_problems' suffix
+            is optional. None or empty selects every split.
+        available: Splits to choose from (default: the manifest's splits)
+
+    Returns:
+        Selected split names, in manifest order
+
+    Raises:
+        ValueError: If a split is not in `available`
+    """
+    available = list(available) if available is not None else get_splits()
+    if not value:
+        return available
+    selected = {name if name.endswith(SPLIT_SUFFIX) else name + SPLIT_SUFFIX
+                for name in (part.strip() for part in value.split(',')) if name}
+    unknown = selected - set(available)
+    if unknown:
+        raise ValueError(f'Unknown splits: {", ".join(sorted(unknown))}')
+    return [split for split in available if split in selected]
+
+
+class IRLBenchDataset:
+    """
+    Lazy, split-selective access to the IRLBench dataset.
+
+    Only the selected splits are loaded, on first use, and they are read straight
+    from the memory-mapped Arrow cache with image columns left as encoded bytes.
+    Rows are streamed in small batches, and a row's images are added to the image
+    store (which gives their hashes) only when that row is read, so rows a rerun
+    skips cost nothing. The pandas frame written to the result files is built
+    without the image columns; their hashes come from the rows read so far and
+    from the response records.
+    """
+
+    def __init__(self, splits: Sequence[str], images: ImageStore, name: str = DATASET_NAME):
+        """
+        Args:
+            splits: Split names to load, e.g. ['LC003ALP100EV_problems']
+            images: Store receiving the images of the rows that are read
+            name: Hugging Face dataset name
+        """
+        self.splits = list(splits)
+        self.images = images
+        self.name = name
+        self._datasets = None
+        # Image hashes of the rows read so far: {split: {index: {column: hash}}}
+        self._hashes: Dict[str, Dict[int, Dict[str, Optional[str]]]] = {}
+
+    def _load(self) -> Dict[str, Any]:
+        if self._datasets is None:
+            import datasets
+
+            loaded = datasets.load_dataset(self.name, split=self.splits)
+            self._datasets = {}
+            for split, ds in zip(self.splits, loaded):
+                # Keep the encoded bytes; PIL decoding is never needed to build a request
+                for column in image_columns(ds.column_names):
+                    ds = ds.cast_column(column, datasets.Image(decode=False))
+                self._datasets[split] = ds
+        return self._datasets
+
+    def split(self, name: str):
+        """Get a split as a memory-mapped datasets.Dataset with undecoded image columns."""
+        return self._load()[name]
+
+    def num_rows(self, name: str) -> int:
+        """Get the number of rows of a split."""
+        return self.split(name).num_rows
+
+    def rows(self, name: str, indices: Optional[Iterable[int]] = None) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """
+        Stream rows of a split.
+
+        Args:
+            name: Split name
+            indices: Row indices to read, or None for every row
+
+        Yields:
+            (index, row) with image columns replaced by ImageStore hashes (None for no image)
+        """
+        ds = self.split(name)
+        indices = list(range(ds.num_rows)) if indices is None else sorted(indices)
+        columns = image_columns(ds.column_names)
+        hashes = self._hashes.setdefault(name, {})
+        for start in range(0, len(indices), ROW_BATCH_SIZE):
+            chunk = indices[start:start + ROW_BATCH_SIZE]
+            batch = ds[chunk]
+            for offset, index in enumerate(chunk):
+                row = {column: values[offset] for column, values in batch.items()}
+                for column in columns:
+                    row[column] = self.images.put_image(row[column])
+                hashes[index] = row_images(row)
+                yield index, row
+
+    def frame(self, name: str, known: Optional[Dict[int, Dict[str, Optional[str]]]] = None):
+        """
+        Build the pandas frame of a split, with image columns replaced by hashes.
+
+        The frame is built without reading the image columns. Their hashes come
+        from `known` and from the rows read so far; only the remaining rows are
+        read (and their images hashed).
+
+        Args:
+            name: Split name
+            known: Image hashes by row index, e.g. from `ResponseStore.image_hashes`
+
+        Returns:
+            DataFrame in dataset row order
+        """
+        ds = self.split(name)
+        columns = image_columns(ds.column_names)
+        hashes = {**(known or {}), **self._hashes.get(name, {})}
+        missing = [index for index in range(ds.num_rows) if index not in hashes]
+        for index, row in self.rows(name, missing):
+            hashes[index] = row_images(row)
+        df = ds.remove_columns(columns).to_pandas()
+        for column in columns:
+            df[column] = [hashes[index].get(column) for index in range(len(df))]
+        return df[ds.column_names]
+
+
+def row_images(row: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    """Get the image hashes of a row from `IRLBenchDataset.rows`, by column."""
+    return {column: row[column] for column in image_columns(row)}
+
+
+def add_split_argument(parser) -> None:
+    """
+    Add the shared --splits switch to an argument parser.
+
+    Args:
+        parser: argparse.ArgumentParser to extend
+    """
+    parser.add_argument('--splits', type=str, default=None,
+                        help="Comma-separated splits to run, e.g. 'LC003ALP100EV,LC003ALP100IV' (default: all in the manifest)")
@@ -1,99 +1,40 @@
-from google import genai
-import time
 import os
+import sys
+import argparse
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+from api_cache import ResponseCache, make_key, add_cache_arguments, configure_cache
+from api_retry import APICaller, EmptyResponseError
+from manifest import MANIFEST_PATH, get_exams
+from page_uploads import PageUploader
+from providers import get_registry
+from telemetry import add_telemetry_arguments, configure_telemetry, record_usage, set_labels
+
 load_dotenv()
 
-client = genai.Client(api_key=os.environ.get('GEMINI_API_KEY'))
-
-# id_pairs = [[4, 12], [12, 19], [19, 26], [26, 33]] # for LC003ALP100EV
-# id_pairs = [[4, 12], [12, 19], [19, 26], [26, 30]] # for LC003ALP200EV
-# id_pairs = [[6, 13], [13, 20]] # for LC022ALP000EV, LC022ALP000IV
-# id_pairs = [[5, 13], [13, 22], [22, 33]] # for LC023ALP000EV
-# id_pairs = [[6, 14], [14, 23], [23, 35]] # for LC023ALP000IV
-# id_pairs = [[6, 13], [13, 23]] # for LC021ALP000EV
-# id_pairs = [[6, 15], [15, 23]] # for LC021ALP000IV
-
-# exam_names = ['LC022ALP000EV', 'LC022ALP000IV', 'LC023ALP000EV', 'LC023ALP000IV', 'LC021ALP000EV', 'LC021ALP000IV']
-# exam_id_pairs = [[[6, 13], [13, 20]], [[6, 13], [13, 20]], [[5, 13], [13, 22], [22, 33]], [[6, 14], [14, 23], [23, 35]], [[6, 13], [13, 23]], [[2, 10], [10, 17]]]
-# exam_names = ['LC021ALP000EV', 'LC021ALP000IV']
-# exam_id_pairs = [[[6, 13], [13, 23]], [[2, 10], [10, 17]]]
-# exam_names = ['LC219ALP038EV']
-# marking_scheme_names = ['LC219ALP000EV']
-# exam_names = ['LC219ALP038IV']
-# marking_scheme_names = ['LC219ALP000IV']
-# exam_id_pairs = [[[3, 7], [7, 10], [11, 15], [15, 21], [28, 33]]]
-# marking_scheme_id_pairs = [[[4, 9], [9, 12], [12, 17], [17, 25], [25, 32]]]
-
-# exam_names = ['LC033ALP032EV']
-# marking_scheme_names = ['LC033ALP000EV']
-# # exam_id_pairs = [[[3, 8], [42, 43], [43, 45], [45, 47], [47, 49], [49, 51]]]
-# # marking_scheme_id_pairs = [[[14, 23], [23, 31], [31, 38], [38, 46], [46, 53], [53, 59]]]
-# exam_id_pairs = [[[3, 6], [6, 8]]]
-# marking_scheme_id_pairs = [[[14, 20], [19, 23]]]
-
-# exam_names = ['LC032ALP000EV', 'LC032ALP000IV', 'LC034ALP000EV', 'LC034ALP000IV']
-# marking_scheme_names = ['LC032ALP000EV_ms', 'LC032ALP000IV_ms', 'LC034ALP000EV_ms', 'LC034ALP000IV_ms']
-# exam_id_pairs = [[[2, 4], [4, 6], [6, 8], [8, 10], [10, 11], [12, 14], [14, 16], [16, 18], [18, 19], [19, 20]], 
-#                  [[2, 4], [4, 6], [6, 8], [8, 10], [10, 11], [12, 14], [14, 16], [16, 18], [18, 19], [19, 20]],
-#                  [[3, 4], [4, 5], [5, 6], [6, 7], [7, 8], [8, 9], [9, 10], [10, 11], [11, 12], [12, 13], [13, 17], [17, 21], [21, 25], [25, 29], [29, 33], [33, 37]],
-#                  [[3, 4], [4, 5], [5, 6], [6, 7], [7, 8], [8, 9], [9, 10], [10, 11], [11, 12], [12, 13], [13, 17], [17, 21], [21, 25], [25, 29], [29, 33], [33, 37]]]
-# marking_scheme_id_pairs = [[[3, 6], [6, 10], [10, 13], [13, 16], [16, 18], [18, 22], [22, 25], [25, 28], [28, 31], [31, 34]], 
-#                            [[3, 6], [6, 10], [10, 13], [13, 16], [16, 18], [18, 22], [22, 25], [25, 28], [28, 31], [31, 34]],
-#                            [[5, 6], [6, 7], [7, 8], [8, 9], [9, 10], [10, 11], [11, 12], [12, 13], [13, 14], [14, 15], [16, 21], [21, 27], [27, 34], [34, 38], [38, 43], [43, 48]],
-#                            [[5, 6], [6, 7], [7, 8], [8, 9], [9, 10], [10, 11], [11, 12], [12, 13], [13, 14], [14, 15], [16, 21], [21, 27], [27, 34], [34, 38], [38, 43], [43, 48]]]
-
-# exam_names = ['LC034ALP000EV', 'LC034ALP000IV', 'LC014ALP000EV', 'LC014ALP000IV']
-# marking_scheme_names = ['LC034ALP000EV_ms', 'LC034ALP000IV_ms', 'LC014ALP000EV_ms', 'LC014ALP000IV_ms']
-# exam_id_pairs = [[[3, 4], [4, 5], [5, 6], [6, 7], [7, 8], [8, 9], [9, 10], [10, 11], [11, 12], [12, 13], [13, 17], [17, 21], [21, 25], [25, 29], [29, 33], [33, 37]],
-#                  [[3, 4], [4, 5], [5, 6], [6, 7], [7, 8], [8, 9], [9, 10], [10, 11], [11, 12], [12, 13], [13, 17], [17, 21], [21, 25], [25, 29], [29, 33], [33, 37]],
-#                  [[3, 6], [6, 10], [11, 12], [17, 18]],
-#                  [[3, 6], [6, 10], [11, 12], [17, 18]],]
-# marking_scheme_id_pairs = [[[5, 6], [6, 7], [7, 8], [8, 9], [9, 10], [10, 11], [11, 12], [12, 13], [13, 14], [14, 15], [16, 21], [21, 27], [27, 34], [34, 38], [38, 43], [43, 48]],
-#                            [[5, 6], [6, 7], [7, 8], [8, 9], [9, 10], [10, 11], [11, 12], [12, 13], [13, 14], [14, 15], [16, 21], [21, 27], [27, 34], [34, 38], [38, 43], [43, 48]],
-#                            [[18, 19], [19, 21], [21, 26]], 
-#                            [[18, 19], [19, 21], [21, 26]], ]
-
-exam_names = ['LC568ALP000EV', 'LC568ALP000IV', 'LC004ALP000EV', 'LC004ALP000IV', 'LC014ALP000EV', 'LC014ALP000IV']
-marking_scheme_names = ['LC568ALP000EV_ms', 'LC568ALP000IV_ms', 'LC004ALP000EV_ms', 'LC004ALP000IV_ms', 'LC014ALP000EV_ms', 'LC014ALP000IV_ms']
-exam_id_pairs = [[[3, 5], [5, 8], [8, 13], [14, 16]],
-                 [[3, 5], [5, 8], [8, 13], [14, 16]],
-                 [[2, 4], [4, 6], [6, 8]],
-                 [[2, 4], [4, 6], [6, 8]],
-                 [[3, 6], [6, 10], [11, 12], [17, 18]],
-                 [[3, 6], [6, 10], [11, 12], [17, 18]],]
-marking_scheme_id_pairs  = [[[4, 6], [5, 9], [9, 11], [11, 14]],
-                            [[4, 6], [5, 9], [9, 11], [11, 14]],
-                            [[9, 14], [14, 18], [14, 20]],
-                            [[9, 14], [14, 18], [14, 20]],
-                            [[18, 19], [19, 21], [21, 26]], 
-                            [[18, 19], [19, 21], [21, 26]], ]
-
-exam_names = ['LC034ALP000EV']
-marking_scheme_names = ['LC034ALP000EV_ms']
-exam_id_pairs = [[[33, 35], [35, 37]]]
-marking_scheme_id_pairs = [[[43, 46], [45, 48]]]
-
-for EXAM_NAME, MS_NAME, id_pairs, ms_id_pairs in zip(exam_names, marking_scheme_names, exam_id_pairs, marking_scheme_id_pairs):
-    # time.sleep(3)
-    problems = ''
-
-    for id_pair, ms_id_pair in zip(id_pairs, ms_id_pairs):
-        my_files = []
-        for i in range(id_pair[0], id_pair[1]):
-            ## format to 2 digits:
-            number = str(i).zfill(2)
-            my_file = client.files.upload(file=f"exam_images/{EXAM_NAME}/{EXAM_NAME}_page-00{number}.jpg")
-            my_files.append(my_file)
-
-        for i in range(ms_id_pair[0], ms_id_pair[1]):
-            ## format to 2 digits:
-            number = str(i).zfill(2)
-            my_file = client.files.upload(file=f"exam_images/{MS_NAME}/{MS_NAME}_page-00{number}.jpg")
-            my_files.append(my_file)
-
-        prompt = '''I will give you an exam paper and the corresponding marking scheme from the official Leaving Certificate Exam of Ireland, containing several problems written in either English or Irish. They are extracted from PDF files as images.
+MODEL = "gemini-2.0-flash"
+
+# Starting and maximum number of extraction calls and page uploads in flight
+MAX_CONCURRENCY = 16
+
+caller = APICaller(MAX_CONCURRENCY, stage='extract')
+uploader = PageUploader(MODEL, caller)
+cache = ResponseCache('cache/extraction.sqlite')
+
+def generate(files, prompt):
+    client = get_registry().resolve(MODEL).sync_client
+    response = client.models.generate_content(
+        model=MODEL,
+        contents=files + [prompt],
+    )
+    record_usage(MODEL, response)
+    if not response.text:
+        raise EmptyResponseError('Empty response')
+    return response.text
+
+PROMPT = '''I will give you an exam paper and the corresponding marking scheme from the official Leaving Certificate Exam of Ireland, containing several problems written in either English or Irish. They are extracted from PDF files as images.
 Your task is to extract each problem and the corresponding marking scheme/answer.
 
 Here are some guidelines you should follow
@@ -185,26 +126,90 @@ Answer 2: <answer to problem 2>
 
 Output:'''
 
-        trial_count = 3
-        while trial_count > 0:
-            trial_count -= 1
-            try:
-                response = client.models.generate_content(
-                    model="gemini-2.0-flash",
-                    contents=my_files + [prompt],
-                )
-            except Exception as e:
-                print('Error occurred, retrying...: ', e)
-                time.sleep(5)
-                continue
-
-            if response.text:
-                problems += response.text + '\n'
-                print(response.text)
-                break
-            else:
-                print('Empty response, retrying...')
-                time.sleep(5)
-
-    with open(f'results/{EXAM_NAME}_problems.txt', 'w') as f:
+def page_path(name, i):
+    ## format to 2 digits:
+    number = str(i).zfill(2)
+    return f"exam_images/{name}/{name}_page-00{number}.jpg"
+
+def section_pages(exam, section):
+    paths = [page_path(exam['name'], i) for i in range(*section['exam_pages'])]
+    if exam.get('marking_scheme') and section.get('marking_scheme_pages'):
+        paths += [page_path(exam['marking_scheme'], i) for i in range(*section['marking_scheme_pages'])]
+    return paths
+
+def section_key(paths):
+    # Keyed on page content rather than paths, so only sections whose pages, prompt or model changed miss
+    return make_key(MODEL, PROMPT, [uploader.page_hash(path) for path in paths])
+
+def extract_section(paths):
+    cache_key = section_key(paths)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    my_files = uploader.upload_many(paths)
+    try:
+        response_text = caller.call_sync(generate, my_files, PROMPT)
+    except Exception as e:
+        print('Failed to extract section, skipping...: ', e)
+        return None
+    print(response_text)
+    cache.set(cache_key, response_text)
+    return response_text
+
+def extract_exam(exam):
+    set_labels(exam_id=exam['name'])
+    sections = [section_pages(exam, section) for section in exam['sections']]
+    # Upload the pages of every uncached section up front; pages shared by overlapping ranges are sent once
+    pending = [paths for paths in sections if cache.get(section_key(paths)) is None]
+    uploader.upload_many([path for paths in pending for path in paths])
+    print(f'{exam["name"]}: {len(sections) - len(pending)} of {len(sections)} sections cached')
+
+    # Sections are independent, so they are prompted concurrently; map() keeps them in order.
+    # Each section runs in a copy of this thread's context so its calls carry the exam label
+    contexts = [contextvars.copy_context() for _ in sections]
+    with ThreadPoolExecutor(max_workers=max(len(sections), 1)) as executor:
+        texts = list(executor.map(lambda context, paths: context.run(extract_section, paths), contexts, sections))
+
+    failed = [section['exam_pages'] for section, text in zip(exam['sections'], texts) if text is None]
+    if failed:
+        # A partial file would look complete to later steps; extracted sections stay cached for the rerun
+        print(f'{exam["name"]}: not written, {len(failed)} of {len(sections)} sections failed (exam pages {failed})')
+        return None
+
+    problems = ''.join(text + '\n' for text in texts if text)
+    # Write to a temporary file first so an interrupted run never leaves a truncated result
+    os.makedirs('results', exist_ok=True)
+    path = f'results/{exam["name"]}_problems.txt'
+    with open(f'{path}.tmp', 'w') as f:
         f.write(problems)
+    os.replace(f'{path}.tmp', path)
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract problems and marking schemes from exam page images.")
+    parser.add_argument('--manifest', type=str, default=MANIFEST_PATH, help='Exam manifest JSON file')
+    parser.add_argument('--exams', type=str, default=None, help='Comma-separated exam names to extract (default: all exams in the manifest)')
+    parser.add_argument('--workers', type=int, default=4, help='Number of exams extracted in parallel')
+    add_cache_arguments(parser)
+    add_telemetry_arguments(parser)
+    args = parser.parse_args()
+    configure_cache(cache, args)
+    configure_telemetry(args)
+
+    names = [name.strip() for name in args.exams.split(',')] if args.exams else None
+    exams = get_exams(args.manifest, names)
+
+    # Extraction is I/O-bound (uploads and API calls), so exams run on a thread pool
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        paths = list(executor.map(extract_exam, exams))
+    for path in paths:
+        if path is not None:
+            print(f'Wrote {path}')
+    cache.evict()
+    failed = [exam['name'] for exam, path in zip(exams, paths) if path is None]
+    if failed:
+        sys.exit(f'Extraction failed for {", ".join(failed)}; rerun to retry the failed sections')
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,22 @@
-from google import genai
-from openai import OpenAI
 from pydantic import BaseModel
+from tqdm import tqdm
 import pandas as pd
-import os
-import time
+import asyncio
 from dotenv import load_dotenv
-import base64
-import ast
 import argparse
 
+from api_cache import ResponseCache, make_key, add_cache_arguments, configure_cache
+from batch_api import BatchJournal, make_custom_id, parse_custom_id, openai_responses_request, run_openai_batch, gemini_request, run_gemini_batch
+from dataset import add_split_argument, parse_splits
+from image_store import ImageStore, image_columns
+from image_variants import ImageVariants
+from manifest import get_splits
+from providers import add_provider_arguments, configure_providers, get_registry
+from api_retry import APICaller, EmptyResponseError, add_retry_arguments, policy_from_args
+from rate_limiter import RateLimiter, estimate_tokens
+from results_io import read_results, write_results, add_format_argument
+from telemetry import add_telemetry_arguments, annotate, configure_telemetry, record_usage, set_labels
+
 load_dotenv()
 
 TEMPLATE_PROMPT = '''Judge whether the following [response] to [question] is correct or not based on the suggested marking scheme [marking_scheme] below.
@@ -36,38 +44,67 @@ class Judgement(BaseModel):
     confidence: str
 
 
-# Function to encode the image
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+cache = ResponseCache('cache/judgements.sqlite')
+images = ImageStore('assets/images')
+variants = ImageVariants(images)
+
+EXAM_IDS = get_splits()
+
+JUDGE_CONFIG = {
+    'response_mime_type': 'application/json',
+    'response_schema': Judgement,
+}
+
+# Request parameters of the OpenAI responses API; the output format is always Judgement
+OPENAI_JUDGE_CONFIG = {
+    'reasoning': {'effort': 'medium'},
+    'max_output_tokens': 25_000,
+}
+
+def get_provider(model):
+    # Raises ValueError for models missing from providers.json
+    return get_registry().resolve(model).kind
 
+def judge_config(model):
+    # Everything besides the prompt and images that shapes a judgement, so changing it invalidates cached ones
+    if get_provider(model) == 'openai':
+        return {**OPENAI_JUDGE_CONFIG, 'text_format': Judgement}
+    return JUDGE_CONFIG
 
-gemini_client = genai.Client(api_key=os.environ.get('GEMINI_API_KEY'))
-openai_client = OpenAI(
-    api_key=os.environ.get('OPENAI_API_KEY'),
-)
+def judge_images(model, image_files):
+    # The judge provider's image policy; the cache key is taken over the variants actually sent
+    policy = get_registry().resolve(model).image_policy
+    return [variants.variant(image_hash, policy) for image_hash in image_files]
+
+async def generate(model, prompt, image_files, config):
+    image_files = judge_images(model, image_files)
+    cache_key = make_key(model, prompt, image_files, config)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        annotate(model=model, cached=True)
+        return cached
+
+    provider = get_registry().resolve(model)
+    if provider.kind == 'gemini':
+        from google import genai
 
-def generate(model, prompt, image_files, config):
-    if model in ['gemini-2.0-flash', 'gemini-2.5-flash-preview-04-17']:
         my_files = []
-        for file in image_files:
+        for image_hash in image_files:
             my_files.append(genai.types.Part.from_bytes(
-                data=file,
-                mime_type='image/png',
+                data=images.get_bytes(image_hash),
+                mime_type=images.mime_type(image_hash),
             ))
-        response = gemini_client.models.generate_content(
+        response = await provider.client.aio.models.generate_content(
             model=model,
             contents=my_files + [prompt],
             config=config,
         )
-        return response.text
-    elif model == 'o4-mini-2025-04-16':
-        my_files = []
-        for file in image_files:
-            my_files.append(encode_image(file))
-        response = openai_client.responses.parse(
+        record_usage(model, response)
+        result = response.text
+    elif provider.kind == 'openai':
+        my_files = [images.data_url(image_hash) for image_hash in image_files]
+        response = await provider.client.responses.parse(
             model=model,
-            reasoning={"effort": "medium"},
             input=[
                 {
                     "role": "user",
@@ -77,77 +114,192 @@ def generate(model, prompt, image_files, config):
                     [
                         {
                             "type": "input_image",
-                            "image_url": f"data:image/png;base64,{base64_image}",
+                            "image_url": image_url,
                         }
-                        for base64_image in my_files
+                        for image_url in my_files
                     ],
                 }
             ],
-            max_output_tokens=25_000,
-            text_format=Judgement,
+            **config,
         )
-        return response.output_parsed.model_dump_json()
+        record_usage(model, response)
+        result = response.output_parsed.model_dump_json()
+    else:
+        raise ValueError(f'Unknown judge model: {model}')
 
+    if not result:
+        raise EmptyResponseError(f'Empty judgement from {model}')
+    cache.set(cache_key, result)
+    return result
 
-def main():
-    parser = argparse.ArgumentParser(description="Run model judgement script.")
-    parser.add_argument('--judge_model', type=str, required=True, help='Judge model name')
-    parser.add_argument('--student_model', type=str, required=True, help='Student model name')
-    args = parser.parse_args()
 
-    JUDGE_MODEL = args.judge_model
-    STUDENT_MODEL = args.student_model
+def get_image_files(row):
+    # Cells hold image hashes; older response CSVs hold the repr of the dataset's image dict,
+    # which put_image() decodes and adds to the store
+    my_files = []
+    if 'problem_image_1' in row.keys() and row['problem_image_1'] and not pd.isna(row['problem_image_1']):
+        my_files.append(images.put_image(row['problem_image_1']))
 
-    for EXAM_ID in ['LC003ALP100EV_problems', 'LC003ALP100IV_problems', 'LC021ALP000EV_problems','LC021ALP000IV_problems','LC022ALP000EV_problems','LC022ALP000IV_problems','LC023ALP000EV_problems','LC023ALP000IV_problems','LC219ALP038EV_problems',"LC219ALP038IV_problems","LC065ALP000EV_problems","LC065ALP000IV_problems", "LC033ALP032EV_problems","LC033ALP032IV_problems",'LC032ALP000EV_problems','LC032ALP000IV_problems','LC034ALP000EV_problems','LC034ALP000IV_problems','LC014ALP000EV_problems','LC014ALP000IV_problems','LC568ALP000EV_problems','LC568ALP000IV_problems','LC004ALP000EV_problems','LC004ALP000IV_problems']:
-        FILE_NAME = f'responses/{EXAM_ID}_{STUDENT_MODEL}.csv'
-        df = pd.read_csv(FILE_NAME)
+    if 'problem_image_2' in row.keys() and row['problem_image_2'] and not pd.isna(row['problem_image_2']):
+        my_files.append(images.put_image(row['problem_image_2']))
 
-        for index, row in df.iterrows():
-            my_files = []
-            if 'problem_image_1' in row.keys() and row['problem_image_1'] and not pd.isna(row['problem_image_1']):
-                my_files.append(ast.literal_eval(row['problem_image_1'])['bytes'])
+    if 'answer_image_1' in row.keys() and row['answer_image_1'] and not pd.isna(row['answer_image_1']):
+        my_files.append(images.put_image(row['answer_image_1']))
+
+    return my_files
+
+def skip_reason(student_model, my_files):
+    if student_model == 'DeepSeek-R1-Distill-Llama-70B' and len(my_files) > 0:
+        return 'Skipped: DeepSeek-R1-Distill-Llama-70B does not support image files'
+
+def build_prompt(row):
+    return TEMPLATE_PROMPT.format(
+        question=row['problem'],
+        response=row['response'],
+        marking_scheme=row['answer']
+    )
+
+async def judge_row(judge_model, student_model, row, semaphore, caller):
+    my_files = get_image_files(row)
+
+    skipped = skip_reason(student_model, my_files)
+    if skipped:
+        return skipped
+
+    current_prompt = build_prompt(row)
 
-            if 'problem_image_2' in row.keys() and row['problem_image_2'] and not pd.isna(row['problem_image_2']):
-                my_files.append(ast.literal_eval(row['problem_image_2'])['bytes'])
+    async with semaphore:
+        try:
+            return await caller.call(generate, judge_model, current_prompt, my_files, judge_config(judge_model),
+                                     tokens=estimate_tokens(current_prompt, len(my_files)))
+        except Exception as e:
+            print('Failed to get judgement, skipping...: ', e)
+            return 'Error: Failed to get judgement'
 
-            if 'answer_image_1' in row.keys() and row['answer_image_1'] and not pd.isna(row['answer_image_1']):
-                my_files.append(ast.literal_eval(row['answer_image_1'])['bytes'])
+def load_responses(student_model, EXAM_ID):
+    df = read_results(f'responses/{EXAM_ID}_{student_model}')
+    # Replace image dicts embedded by older runs with hashes so they are not copied into the judgements
+    for column in image_columns(df.columns):
+        df[column] = df[column].map(images.put_image)
+    return df
 
-            if STUDENT_MODEL == 'DeepSeek-R1-Distill-Llama-70B' and len(my_files) > 0:
-                df.at[index, 'judgement'] = 'Skipped: DeepSeek-R1-Distill-Llama-70B does not support image files'
+async def judge_split(judge_model, student_model, EXAM_ID, semaphore, caller, progress, output_format):
+    set_labels(exam_id=EXAM_ID, student_model=student_model)
+    df = load_responses(student_model, EXAM_ID)
+    progress.total += len(df)
+    progress.refresh()
+
+    async def run_row(row):
+        judgement = await judge_row(judge_model, student_model, row, semaphore, caller)
+        progress.update(1)
+        return judgement
+
+    # gather() keeps submission order, so judgements line up with the rows of df
+    df['judgement'] = await asyncio.gather(*(run_row(row) for _, row in df.iterrows()))
+    write_results(df, f'judgements/{EXAM_ID}_{student_model}_judge_model_{judge_model}', output_format)
+
+async def run(judge_model, student_model, provider_limits, output_format='parquet', policy=None, splits=None):
+    provider = get_provider(judge_model)
+    concurrency, requests_per_minute = provider_limits[provider]
+    semaphore = asyncio.Semaphore(concurrency)
+    caller = APICaller(concurrency, RateLimiter(requests_per_minute), policy, stage='judge')
+
+    with tqdm(total=0, desc=f'Judging with {judge_model}') as progress:
+        await asyncio.gather(*(judge_split(judge_model, student_model, EXAM_ID, semaphore, caller, progress, output_format) for EXAM_ID in splits or EXAM_IDS))
+    cache.evict()
+
+async def run_batch(judge_model, student_model, poll_interval, output_format='parquet', policy=None, splits=None):
+    provider = get_provider(judge_model)
+
+    frames = {}
+    requests = []
+    cache_keys = {}
+    for EXAM_ID in splits or EXAM_IDS:
+        df = load_responses(student_model, EXAM_ID)
+        df['judgement'] = None
+        frames[EXAM_ID] = df
+        for index, row in df.iterrows():
+            my_files = get_image_files(row)
+            skipped = skip_reason(student_model, my_files)
+            if skipped:
+                df.at[index, 'judgement'] = skipped
                 continue
 
-            current_prompt = TEMPLATE_PROMPT.format(
-                question=row['problem'],
-                response=row['response'],
-                marking_scheme=row['answer']
-            )
-
-            trial_count = 3
-            while trial_count > 0:
-                trial_count -= 1
-                try:
-                    response_text = generate(JUDGE_MODEL, 
-                                            current_prompt, 
-                                            my_files, 
-                                            {
-                                                'response_mime_type': 'application/json',
-                                                'response_schema': Judgement,
-                                            })
-                except Exception as e:
-                    print('Error occurred, retrying...: ', e)
-                    time.sleep(5)
-                    continue
-
-                if response_text:
-                    df.at[index, 'judgement'] = response_text
-                    print(response_text)
-                    break
+            current_prompt = build_prompt(row)
+            my_files = judge_images(judge_model, my_files)
+            cache_key = make_key(judge_model, current_prompt, my_files, judge_config(judge_model))
+            cached = cache.get(cache_key)
+            if cached is not None:
+                df.at[index, 'judgement'] = cached
+                continue
+
+            custom_id = make_custom_id(EXAM_ID, index)
+            cache_keys[custom_id] = cache_key
+            if provider == 'openai':
+                image_urls = [images.data_url(image_hash) for image_hash in my_files]
+                requests.append(openai_responses_request(custom_id, judge_model, current_prompt, image_urls, Judgement,
+                                                         OPENAI_JUDGE_CONFIG['max_output_tokens'],
+                                                         OPENAI_JUDGE_CONFIG['reasoning']['effort']))
             else:
-                print('Failed to get response after 3 trials, skipping...')
-                df.at[index, 'judgement'] = 'Error: Failed to get judgement'
+                image_parts = [(images.get_bytes(image_hash), images.mime_type(image_hash)) for image_hash in my_files]
+                requests.append(gemini_request(custom_id, current_prompt, image_parts, JUDGE_CONFIG))
+
+    client = get_registry().resolve(judge_model).client
+    caller = APICaller(policy=policy, stage='batch')
+    journal = BatchJournal(f'judge_{student_model}_judge_model_{judge_model}')
+    if provider == 'openai':
+        results = await run_openai_batch(client, requests, '/v1/responses', poll_interval, caller, journal)
+    else:
+        results = await run_gemini_batch(client, judge_model, requests, poll_interval, caller, journal)
+
+    for custom_id, response_text in results.items():
+        EXAM_ID, index = parse_custom_id(custom_id)
+        if not response_text.startswith('Error:'):
+            try:
+                # Normalise to the same JSON layout as the interactive path
+                response_text = Judgement.model_validate_json(response_text).model_dump_json()
+                cache.set(cache_keys[custom_id], response_text)
+            except ValueError as e:
+                response_text = f'Error: Invalid judgement: {e}'
+        frames[EXAM_ID].at[index, 'judgement'] = response_text
+
+    for EXAM_ID, df in frames.items():
+        write_results(df, f'judgements/{EXAM_ID}_{student_model}_judge_model_{judge_model}', output_format)
+    journal.clear()
+    cache.evict()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run model judgement script.")
+    parser.add_argument('--judge_model', type=str, required=True, help='Judge model name')
+    parser.add_argument('--student_model', type=str, required=True, help='Student model name')
+    parser.add_argument('--gemini_concurrency', type=int, default=16, help='Maximum number of Gemini requests in flight')
+    parser.add_argument('--gemini_rpm', type=int, default=None, help='Gemini requests-per-minute budget (default: unlimited)')
+    parser.add_argument('--openai_concurrency', type=int, default=8, help='Maximum number of OpenAI requests in flight')
+    parser.add_argument('--openai_rpm', type=int, default=None, help='OpenAI requests-per-minute budget (default: unlimited)')
+    parser.add_argument('--batch', action='store_true', help="Submit all rows as one batch job to the judge provider's batch API")
+    parser.add_argument('--poll_interval', type=float, default=30, help='Seconds between batch status checks')
+    add_format_argument(parser)
+    add_cache_arguments(parser)
+    add_retry_arguments(parser)
+    add_telemetry_arguments(parser)
+    add_provider_arguments(parser)
+    add_split_argument(parser)
+    args = parser.parse_args()
+    configure_cache(cache, args)
+    configure_telemetry(args)
+    configure_providers(args, [args.judge_model])
+    splits = parse_splits(args.splits, EXAM_IDS)
 
-        df.to_csv(f'judgements/{EXAM_ID}_{STUDENT_MODEL}_judge_model_{JUDGE_MODEL}.csv', index=False)
+    provider_limits = {
+        'gemini': (args.gemini_concurrency, args.gemini_rpm),
+        'openai': (args.openai_concurrency, args.openai_rpm),
+    }
+    if args.batch:
+        asyncio.run(run_batch(args.judge_model, args.student_model, args.poll_interval, args.output_format, policy_from_args(args), splits))
+    else:
+        asyncio.run(run(args.judge_model, args.student_model, provider_limits, args.output_format, policy_from_args(args), splits))
+    print(variants.summary())
 
 if __name__ == "__main__":
     main()
@@ -1,88 +1,282 @@
 from tqdm import tqdm
-import os
 import time
-import datasets
-from io import BytesIO
-from openai import OpenAI
-import base64
+import asyncio
 from dotenv import load_dotenv
 import argparse
 
+from api_cache import ResponseCache, make_key, add_cache_arguments, configure_cache
+from batch_api import BatchJournal, make_custom_id, parse_custom_id, openai_chat_request, run_openai_batch
+from dataset import IRLBenchDataset, add_split_argument, parse_splits, row_images
+from image_store import ImageStore
+from image_variants import ImageVariants
+from manifest import get_splits
+from providers import add_provider_arguments, configure_providers, get_registry
+from api_retry import APICaller, EmptyResponseError, add_retry_arguments, policy_from_args
+from rate_limiter import RateLimiter, estimate_tokens
+from response_store import ResponseStore
+from results_io import write_results, add_format_argument
+from streaming import StreamSettings, add_stream_arguments, configure_streaming, consume_stream
+from telemetry import add_telemetry_arguments, annotate, configure_telemetry, record_token_usage, record_usage, set_labels
+
 load_dotenv()
 
-def generate(model, prompt, images):
+EXAM_IDS = get_splits()
+
+MAX_COMPLETION_TOKENS = 8192
+
+# Responses are generated through chat completions; models without an OpenAI-compatible
+# provider in providers.json are sent to this one
+GENERATION_PROVIDER = 'openai'
+
+def get_client(model):
+    return get_registry().resolve(model, fallback=GENERATION_PROVIDER, kind='openai').client
+
+def image_policy(model):
+    return get_registry().resolve(model, fallback=GENERATION_PROVIDER, kind='openai').image_policy
+
+# Streaming metadata stored with each response record and in the response files
+STREAM_FIELDS = ('truncated', 'stop_reason', 'ttft', 'tokens_per_second')
+
+def request_key(model, prompt, images):
+    return make_key(model, prompt, images, {'max_completion_tokens': MAX_COMPLETION_TOKENS})
+
+async def generate(model, prompt, images):
+    cache_key = request_key(model, prompt, images)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        annotate(model=model, cached=True)
+        return cached
+
     content = [{"type": "text", "text": prompt}] + [{"type": "image_url", "image_url": {"url": image}} for image in images]
-    chat_response = client.chat.completions.create(
+    chat_response = await get_client(model).chat.completions.create(
         model=model,
         messages=[{
             "role": "user",
             "content": content,
         }],
-        max_completion_tokens= 8192,
+        max_completion_tokens=MAX_COMPLETION_TOKENS,
     )
+    record_usage(model, chat_response)
     result = chat_response.choices[0].message.content
+    if not result:
+        raise EmptyResponseError(f'Empty response from {model}')
+    cache.set(cache_key, result)
 
     return result
 
-def convert_to_str(img):
-    if img is not None:
-        buf = BytesIO()
-        img.save(buf, format='PNG')  # or use img.format if you want to preserve original format
-        img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
+async def generate_stream(model, prompt, images):
+    # Early stopping changes the text, so streamed responses get their own cache entries
+    cache_key = make_key(model, prompt, images, {'max_completion_tokens': MAX_COMPLETION_TOKENS,
+                                                 'stream': streaming.cache_config()})
+    cached = cache.get(cache_key)
+    if cached is not None:
+        annotate(model=model, cached=True)
+        return cached, {'truncated': False}
+
+    content = [{"type": "text", "text": prompt}] + [{"type": "image_url", "image_url": {"url": image}} for image in images]
+    started = time.perf_counter()
+    stream = await get_client(model).chat.completions.create(
+        model=model,
+        messages=[{
+            "role": "user",
+            "content": content,
+        }],
+        max_completion_tokens=MAX_COMPLETION_TOKENS,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    try:
+        result, fields, usage = await consume_stream(stream, streaming, started)
+    finally:
+        # Closing the connection is what stops the provider from generating (and billing) further tokens
+        await stream.close()
+
+    if usage is not None:
+        record_token_usage(model, usage)
     else:
-        img_str = None
-    return img_str
+        # Stopped before the final usage chunk: fall back to the streamed token count and an input estimate
+        record_token_usage(model, {'prompt_tokens': estimate_tokens(prompt, len(images)),
+                                   'completion_tokens': fields['output_tokens']})
+        annotate(usage_estimated=True)
+    annotate(ttft=fields['ttft'], tokens_per_second=fields['tokens_per_second'],
+             stop_reason=fields['stop_reason'], truncated=fields['truncated'])
+
+    if not result:
+        raise EmptyResponseError(f'Empty response from {model}')
+    if fields['stop_reason'] is None:
+        # The stream ended without a finish reason, i.e. the connection dropped mid-response
+        raise EmptyResponseError(f'Response stream from {model} ended early')
+    # Partial output is stored with its truncation flag but never cached as if it were complete
+    if not fields['truncated']:
+        cache.set(cache_key, result)
+    return result, {field: fields[field] for field in STREAM_FIELDS}
+
+def build_request(row, policy=None):
+    prompt = row['problem']
+    prompt += '''
+Your response should be in the following format:
+Answer: {your answer to the above problem}
+Confidence: {your confidence score between 0% and 100% for your answer}'''
+    my_files = []
+    # Images are resized/recompressed for the provider; each variant is encoded once and cached
+    if row['problem_image_1']:
+        my_files.append(images.data_url(variants.variant(row['problem_image_1'], policy)))
 
+    if row['problem_image_2']:
+        my_files.append(images.data_url(variants.variant(row['problem_image_2'], policy)))
 
-client = OpenAI(
-    api_key=os.environ.get('OPENAI_API_KEY'),
-)
+    return prompt, my_files
+
+
+cache = ResponseCache('cache/responses.sqlite')
+images = ImageStore('assets/images')
+variants = ImageVariants(images)
+streaming = StreamSettings()
+
+async def generate_row(model, row, semaphore, caller, policy=None):
+    async with semaphore:
+        # Data URLs are only built once a slot is free, so at most `concurrency` rows are held in memory
+        prompt, my_files = build_request(row, image_policy(model) if policy is None else policy)
+        tokens = estimate_tokens(prompt, len(my_files), streaming.max_tokens or MAX_COMPLETION_TOKENS)
+        try:
+            if streaming.enabled:
+                return await caller.call(generate_stream, model, prompt, my_files, tokens=tokens)
+            return await caller.call(generate, model, prompt, my_files, tokens=tokens), {}
+        except Exception as e:
+            print('Failed to get response, skipping...: ', e)
+            return 'Error: Failed to get response', {}
+
+def open_dataset(splits=None):
+    # Nothing is read until a split is used; images are stored once by content hash as rows are read
+    return IRLBenchDataset(splits or EXAM_IDS, images)
+
+def result_frame(model, dataset, EXAM_ID, store):
+    # Rows answered in earlier runs take their image hashes from the records, so they are not read again
+    return dataset.frame(EXAM_ID, store.image_hashes(EXAM_ID, model))
+
+def compact_split(model, df, EXAM_ID, store, output_format='parquet'):
+    df = store.compact(df.copy(), EXAM_ID, model, fields=STREAM_FIELDS)
+    write_results(df, f'responses/{EXAM_ID}_{model.replace("/", "--")}', output_format)
+
+async def run_split(model, dataset, EXAM_ID, semaphore, model_semaphore, caller, progress, store, output_format):
+    done = store.completed(EXAM_ID, model)
+    progress.update(len(done))
+    pending = [index for index in range(dataset.num_rows(EXAM_ID)) if index not in done]
+    set_labels(exam_id=EXAM_ID)
+
+    async def run_row(index, row):
+        # The per-model slot is taken before the shared one, so a model at its cap never blocks the others
+        async with model_semaphore:
+            response_text, fields = await generate_row(model, row, semaphore, caller)
+        store.append(EXAM_ID, index, model, response_text, images=row_images(row), **fields)
+        progress.update(1)
+
+    # Rows that already succeeded in a previous run are skipped (and never read); failures and missing rows are retried
+    await asyncio.gather(*(run_row(index, row) for index, row in dataset.rows(EXAM_ID, pending)))
+    compact_split(model, result_frame(model, dataset, EXAM_ID, store), EXAM_ID, store, output_format)
+
+def open_store(model):
+    return ResponseStore(f'responses/{model.replace("/", "--")}_records.jsonl')
+
+async def run(models, concurrency, per_model_concurrency=None, requests_per_minute=None, tokens_per_minute=None,
+              output_format='parquet', dataset=None, policy=None):
+    if dataset is None:
+        dataset = open_dataset()
+
+    # One shared pool of request slots; each model also gets its own cap, rate budget and AIMD gate
+    semaphore = asyncio.Semaphore(concurrency)
+    jobs = []
+    for model in models:
+        store = open_store(model)
+        model_semaphore = asyncio.Semaphore(per_model_concurrency or concurrency)
+        caller = APICaller(per_model_concurrency or concurrency, RateLimiter(requests_per_minute, tokens_per_minute), policy, stage='generate')
+        jobs.extend((model, EXAM_ID, model_semaphore, caller, store) for EXAM_ID in dataset.splits)
+
+    with tqdm(total=len(models) * sum(dataset.num_rows(EXAM_ID) for EXAM_ID in dataset.splits)) as progress:
+        await asyncio.gather(*(run_split(model, dataset, EXAM_ID, semaphore, model_semaphore, caller, progress, store, output_format)
+                               for model, EXAM_ID, model_semaphore, caller, store in jobs))
+    cache.evict()
+
+async def run_batch(model, poll_interval, output_format='parquet', dataset=None, policy=None):
+    if dataset is None:
+        dataset = open_dataset()
+    store = open_store(model)
+
+    requests = []
+    cache_keys = {}
+    hashes = {}
+    for EXAM_ID in dataset.splits:
+        done = store.completed(EXAM_ID, model)
+        pending = [index for index in range(dataset.num_rows(EXAM_ID)) if index not in done]
+        for index, row in dataset.rows(EXAM_ID, pending):
+            prompt, my_files = build_request(row, image_policy(model))
+            cache_key = request_key(model, prompt, my_files)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                store.append(EXAM_ID, index, model, cached, images=row_images(row))
+                continue
+            custom_id = make_custom_id(EXAM_ID, index)
+            cache_keys[custom_id] = cache_key
+            hashes[custom_id] = row_images(row)
+            requests.append(openai_chat_request(custom_id, model, prompt, my_files, MAX_COMPLETION_TOKENS))
+
+    journal = BatchJournal(f'generate_{model}')
+    results = await run_openai_batch(get_client(model), requests, '/v1/chat/completions', poll_interval,
+                                     APICaller(policy=policy, stage='batch'), journal)
+    for custom_id, response_text in results.items():
+        EXAM_ID, index = parse_custom_id(custom_id)
+        store.append(EXAM_ID, index, model, response_text, images=hashes[custom_id])
+        if not response_text.startswith('Error:'):
+            cache.set(cache_keys[custom_id], response_text)
+    journal.clear()
+
+    for EXAM_ID in dataset.splits:
+        compact_split(model, result_frame(model, dataset, EXAM_ID, store), EXAM_ID, store, output_format)
+    cache.evict()
 
 def main():
     parser = argparse.ArgumentParser(description="Run model response generation script.")
-    parser.add_argument('--model', type=str, required=True, help='Model name to use for response generation')
+    model_group = parser.add_mutually_exclusive_group(required=True)
+    model_group.add_argument('--model', type=str, help='Model name to use for response generation')
+    model_group.add_argument('--models', type=str, help='Comma-separated model names to sweep in one process')
+    parser.add_argument('--concurrency', type=int, default=8, help='Maximum number of requests in flight')
+    parser.add_argument('--per_model_concurrency', type=int, default=None, help='Maximum number of requests in flight per model (default: --concurrency)')
+    parser.add_argument('--rpm', type=int, default=None, help='Requests-per-minute budget (default: unlimited)')
+    parser.add_argument('--tpm', type=int, default=None, help='Tokens-per-minute budget (default: unlimited)')
+    parser.add_argument('--compact', action='store_true', help='Only rebuild the response files from stored records, without calling the model')
+    parser.add_argument('--batch', action='store_true', help='Submit all pending rows as one OpenAI Batch job instead of interactive requests')
+    parser.add_argument('--poll_interval', type=float, default=30, help='Seconds between batch status checks')
+    add_format_argument(parser)
+    add_cache_arguments(parser)
+    add_retry_arguments(parser)
+    add_telemetry_arguments(parser)
+    add_stream_arguments(parser)
+    add_provider_arguments(parser)
+    add_split_argument(parser)
     args = parser.parse_args()
+    configure_cache(cache, args)
+    configure_telemetry(args)
+    configure_streaming(streaming, args)
 
-    MODEL = args.model
+    models = [args.model] if args.model else [model.strip() for model in args.models.split(',') if model.strip()]
+    configure_providers(args, models)
 
-    ds = datasets.load_dataset("ReliableAI/IRLBench")
+    # The selected splits are opened once for every model in the sweep
+    dataset = open_dataset(parse_splits(args.splits, EXAM_IDS))
 
-    for EXAM_ID in ['LC003ALP100EV_problems', 'LC003ALP100IV_problems', 'LC021ALP000EV_problems','LC021ALP000IV_problems','LC022ALP000EV_problems','LC022ALP000IV_problems','LC023ALP000EV_problems','LC023ALP000IV_problems','LC219ALP038EV_problems',"LC219ALP038IV_problems","LC065ALP000EV_problems","LC065ALP000IV_problems", "LC033ALP032EV_problems","LC033ALP032IV_problems",'LC032ALP000EV_problems','LC032ALP000IV_problems','LC034ALP000EV_problems','LC034ALP000IV_problems','LC014ALP000EV_problems','LC014ALP000IV_problems','LC568ALP000EV_problems','LC568ALP000IV_problems','LC004ALP000EV_problems','LC004ALP000IV_problems']:
-        df = ds[EXAM_ID].to_pandas()
-        for index, row in tqdm(enumerate(ds[EXAM_ID])):
-            prompt = row['problem']
-            prompt += '''
-Your response should be in the following format:
-Answer: {your answer to the above problem}
-Confidence: {your confidence score between 0% and 100% for your answer}'''
-            my_files = []
-            if row['problem_image_1']:
-                image_base64 = convert_to_str(row['problem_image_1'])
-                my_files.append(f"data:image/png;base64,{image_base64}")
-
-            if row['problem_image_2']:
-                image_base64 = convert_to_str(row['problem_image_2'])
-                my_files.append(f"data:image/png;base64,{image_base64}")
-
-            trial_count = 3
-            while trial_count > 0:
-                trial_count -= 1
-                try:
-                    response_text = generate(MODEL, prompt, my_files)
-                except Exception as e:
-                    print('Error occurred: ', e)
-                    time.sleep(5)
-                    continue
-
-                if response_text:
-                    df.at[index, 'response'] = response_text
-                    print(response_text)
-                    break
-            else:
-                print('Failed to get response after 3 trials, skipping...')
-                df.at[index, 'response'] = 'Error: Failed to get response'
-
-            df.to_csv(f'responses/{EXAM_ID}_{MODEL.replace("/", "--")}.csv', index=False)
+    if args.compact:
+        for model in models:
+            store = open_store(model)
+            for EXAM_ID in dataset.splits:
+                compact_split(model, result_frame(model, dataset, EXAM_ID, store), EXAM_ID, store, args.output_format)
+        return
+
+    if args.batch:
+        for model in models:
+            asyncio.run(run_batch(model, args.poll_interval, args.output_format, dataset, policy_from_args(args)))
+    else:
+        asyncio.run(run(models, args.concurrency, args.per_model_concurrency, args.rpm, args.tpm, args.output_format, dataset, policy_from_args(args)))
+    print(variants.summary())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,381 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from language_fidelity import get_detector, init_process
+from manifest import SPLIT_SUFFIX, get_splits, get_subject_names
+from result_statistics import bootstrap_scores, paired_language_test
+from results_io import find_results_file, read_results
+
+# Row outcomes of a judgement file; only 'ok' rows carry a verdict
+STATUSES = ['ok', 'skipped', 'error', 'invalid', 'missing']
+
+LANGUAGES = {'EV': 'English', 'IV': 'Irish'}
+
+GROUP_COLUMNS = ['model', 'judge_model', 'subject', 'language']
+
+
+def _subject_name(subject: str, subject_names: Dict[str, str]) -> str:
+    code = subject[:5]
+    return subject_names.get(code, code)
+
+
+# Subject (split name without the suffix, e.g. 'LC003ALP100EV') -> display name
+name_mappings = {split[:-len(SPLIT_SUFFIX)]: _subject_name(split, get_subject_names()) for split in get_splits()}
+
+
+def _loads(text: str) -> Any:
+    return orjson.loads(text) if orjson is not None else json.loads(text)
+
+
+def _parse_objects(cells: List[str]) -> List[Any]:
+    """
+    Parse a list of JSON documents.
+
+    The cells are joined into a single JSON array and parsed in one call; only if
+    that fails because of a malformed cell are they parsed one by one.
+    """
+    if not cells:
+        return []
+    try:
+        parsed = _loads('[' + ','.join(cells) + ']')
+        if len(parsed) == len(cells):
+            return parsed
+    except ValueError:
+        pass
+    objects = []
+    for cell in cells:
+        try:
+            objects.append(_loads(cell))
+        except ValueError:
+            objects.append(None)
+    return objects
+
+
+def decode_judgements(judgements: pd.Series) -> pd.DataFrame:
+    """
+    Decode a column of judgements into typed verdicts.
+
+    Args:
+        judgements: Judgement cells: JSON from the judge, 'Skipped: ...'/'Error: ...'
+            messages, or missing values
+
+    Returns:
+        Frame with the index of `judgements` and columns 'status' (categorical,
+        one of STATUSES), 'correct' (1.0/0.0, NaN unless status is 'ok') and
+        'confidence' (0-100, NaN when absent)
+    """
+    text = judgements.astype('string').str.strip()
+    status = np.full(len(text), 'invalid', dtype=object)
+    status[text.isna().to_numpy()] = 'missing'
+    status[text.str.startswith('Skipped', na=False).to_numpy()] = 'skipped'
+    status[text.str.startswith('Error', na=False).to_numpy()] = 'error'
+
+    candidates = text[(status == 'invalid') & text.str.startswith('{', na=False).to_numpy()]
+    parsed = _parse_objects(candidates.tolist())
+    fields = pd.DataFrame([obj if isinstance(obj, dict) else {} for obj in parsed],
+                          index=candidates.index, columns=['correct', 'confidence'])
+
+    verdict = fields['correct'].astype('string').str.strip().str.lower()
+    correct = pd.Series(np.nan, index=text.index)
+    correct[verdict.index] = np.where(verdict.isna(), np.nan, verdict.str.startswith('yes', na=False))
+    status[correct.notna().to_numpy()] = 'ok'
+
+    confidence = pd.to_numeric(
+        fields['confidence'].astype('string').str.extract(r'(\d+(?:\.\d+)?)', expand=False),
+        errors='coerce',
+    ).clip(0, 100)
+
+    return pd.DataFrame({
+        'status': pd.Categorical(status, categories=STATUSES),
+        'correct': correct.to_numpy(),
+        'confidence': confidence.reindex(text.index).to_numpy(),
+    }, index=judgements.index)
+
+
+def judgement_path(subject: str, model: str, judge_model: str, judgements_dir: str = 'judgements') -> str:
+    """Get the path of a judgement file without extension."""
+    return f'{judgements_dir}/{subject}{SPLIT_SUFFIX}_{model}_judge_model_{judge_model}'
+
+
+def response_path(subject: str, model: str, responses_dir: str = 'responses') -> str:
+    """Get the path of a response file without extension, as written by generate_response.py."""
+    return f"{responses_dir}/{subject}{SPLIT_SUFFIX}_{model.replace('/', '--')}"
+
+
+def load_judgements(subjects: Sequence[str], models: Sequence[str], judge_models: Sequence[str],
+                    judgements_dir: str = 'judgements', columns: Sequence[str] = ()) -> pd.DataFrame:
+    """
+    Load and decode the judgement files of many model x judge runs into one long frame.
+
+    Only the 'judgement' column (plus `columns`) is read from each file, and each
+    file's column is decoded in one pass. Missing files are skipped.
+
+    Args:
+        subjects: Subjects, e.g. 'LC003ALP100EV'
+        models: Student model names
+        judge_models: Judge model names
+        judgements_dir: Directory containing judgements
+        columns: Extra columns to load, e.g. ['response']
+
+    Returns:
+        Frame with categorical 'model', 'judge_model', 'subject' and 'language'
+        columns, a 'row' index within the file, the decoded judgement columns and
+        the extra columns
+    """
+    frames = []
+    for model in models:
+        for judge_model in judge_models:
+            for subject in subjects:
+                path = find_results_file(judgement_path(subject, model, judge_model, judgements_dir))
+                if path is None:
+                    continue
+                df = read_results(path, columns=['judgement', *columns])
+                decoded = decode_judgements(df['judgement'])
+                decoded.insert(0, 'row', np.arange(len(df)))
+                for column in columns:
+                    decoded[column] = df[column].to_numpy()
+                decoded['model'] = model
+                decoded['judge_model'] = judge_model
+                decoded['subject'] = subject
+                frames.append(decoded)
+
+    if not frames:
+        df = pd.DataFrame(columns=['row', 'status', 'correct', 'confidence', *columns, 'model', 'judge_model', 'subject'])
+    else:
+        df = pd.concat(frames, ignore_index=True)
+    df['language'] = df['subject'].astype('string').str[-2:].map(LANGUAGES)
+    for column in GROUP_COLUMNS:
+        df[column] = df[column].astype('category')
+    return df
+
+
+def aggregate(df: pd.DataFrame, by: Sequence[str] = GROUP_COLUMNS) -> pd.DataFrame:
+    """
+    Score decoded judgements per group.
+
+    Args:
+        df: Frame from `load_judgements`
+        by: Grouping columns
+
+    Returns:
+        Frame indexed by `by` with 'accuracy' and 'confidence' (means over 'ok'
+        rows, in percent), 'judged' (number of 'ok' rows) and one count column
+        per status
+    """
+    by = list(by)
+    scored = df[df['status'] == 'ok']
+    scores = scored.groupby(by, observed=True).agg(
+        accuracy=('correct', 'mean'),
+        confidence=('confidence', 'mean'),
+        judged=('correct', 'size'),
+    )
+    scores['accuracy'] *= 100
+    counts = df.groupby(by + ['status'], observed=True).size().unstack('status', fill_value=0)
+    counts = counts.reindex(columns=STATUSES, fill_value=0)
+    return scores.join(counts, how='outer').fillna({'judged': 0}).astype({'judged': int})
+
+
+def language_scores(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Average subject scores per model, judge and language, as reported in the paper.
+
+    Args:
+        df: Frame from `load_judgements`
+
+    Returns:
+        Frame indexed by (model, judge_model, language) with mean 'accuracy' and 'confidence'
+    """
+    subject_scores = aggregate(df)
+    return subject_scores.groupby(['model', 'judge_model', 'language'], observed=True)[['accuracy', 'confidence']].mean()
+
+
+def detect_languages(texts: pd.Series) -> pd.Series:
+    """
+    Detect the language of each response.
+
+    Args:
+        texts: Response texts
+
+    Returns:
+        Language codes (e.g. 'ga', 'en') with the index of `texts`; None for empty responses
+    """
+    return get_detector().detect(texts)['label']
+
+
+def _by_subject(values: pd.Series, subject: pd.Series) -> Dict[str, float]:
+    return (values.groupby(subject, observed=True).mean() * 100).to_dict()
+
+
+def get_results_from_judgements(subjects: Sequence[str], model: str, judge_model: str,
+                                judgements_dir: str = 'judgements') -> Tuple[Dict, Dict, Dict, Dict, Dict, Dict]:
+    """
+    Get the per-subject results of one model judged by one judge.
+
+    Args:
+        subjects: Subjects, e.g. 'LC003ALP100EV'
+        model: Student model name
+        judge_model: Judge model name
+        judgements_dir: Directory containing judgements
+
+    Returns:
+        Tuple of per-subject dictionaries:
+            results: 1/0 verdict of every judged row
+            lang_fidelity: percentage of judged Irish-version responses written in Irish
+            confidences: confidence of every judged row that reports one
+            correct_irish: percentage of correct Irish-version responses written in Irish
+            incorrect_irish: percentage of incorrect Irish-version responses written in Irish
+            both: percentage of Irish-version responses that are correct and written in Irish
+    """
+    df = load_judgements(subjects, [model], [judge_model], judgements_dir, columns=['response'])
+    df = df[df['status'] == 'ok']
+
+    results = {subject: group.astype(int).tolist()
+               for subject, group in df.groupby('subject', observed=True)['correct']}
+    confidences = {subject: group.dropna().tolist()
+                   for subject, group in df.groupby('subject', observed=True)['confidence']}
+
+    irish = df[df['language'] == 'Irish']
+    in_irish = detect_languages(irish['response']) == 'ga'
+    correct = irish['correct'] == 1
+    lang_fidelity = _by_subject(in_irish, irish['subject'])
+    correct_irish = _by_subject(in_irish[correct], irish['subject'][correct])
+    incorrect_irish = _by_subject(in_irish[~correct], irish['subject'][~correct])
+    both = _by_subject(in_irish & correct, irish['subject'])
+    return results, lang_fidelity, confidences, correct_irish, incorrect_irish, both
+
+
+def _model_language_fidelity(model: str, subjects: Sequence[str], responses_dir: str) -> Dict[str, float]:
+    fidelity = {}
+    for subject in subjects:
+        if not subject.endswith('IV'):
+            continue
+        path = find_results_file(response_path(subject, model, responses_dir))
+        if path is None:
+            continue
+        responses = read_results(path, columns=['response'])['response']
+        fidelity[subject] = float((detect_languages(responses) == 'ga').mean() * 100)
+    return fidelity
+
+
+def calculate_language_fidelity(subjects: Sequence[str], models: Sequence[str],
+                                responses_dir: str = 'responses', workers: int = 1) -> Dict[str, Dict[str, float]]:
+    """
+    Compute the percentage of responses written in Irish for the Irish-version subjects.
+
+    Labels are cached per response text (see language_fidelity.py), so rerunning
+    the analysis only classifies new responses.
+
+    Args:
+        subjects: Subjects, e.g. 'LC003ALP100IV'; English-version subjects are ignored
+        models: Student model names
+        responses_dir: Directory containing responses
+        workers: Number of processes classifying models in parallel
+
+    Returns:
+        Dictionary mapping model to {subject: percentage}
+    """
+    if workers <= 1 or len(models) <= 1:
+        return {model: _model_language_fidelity(model, subjects, responses_dir) for model in models}
+    with ProcessPoolExecutor(max_workers=min(workers, len(models)), initializer=init_process) as executor:
+        results = executor.map(_model_language_fidelity, models, [subjects] * len(models), [responses_dir] * len(models))
+        return dict(zip(models, results))
+
+
+# Scores of other Irish benchmarks, taken from their papers; not derived from IRLBench results
+BENCHMARK_MODELS: List[str] = []
+BENCHMARK_DATA: Dict[str, List[float]] = {'SIB200': [], 'Belebele': [], 'IrishQA': [], 'IrishBench': []}
+
+# {subject group: {subject: number of questions}} for the subject distribution chart
+SUBJECT_COUNT: Dict[str, Dict[str, int]] = {}
+
+
+def prepare_visualization_data(judge_model: Optional[str] = None, models: Optional[Sequence[str]] = None,
+                               warehouse_path: Optional[str] = None, judgements_dir: str = 'judgements',
+                               responses_dir: str = 'responses') -> Dict[str, Any]:
+    """
+    Collect the numbers plotted by visualize_results.py from the results warehouse.
+
+    The warehouse is brought up to date first, so new judgement files are picked up.
+
+    Args:
+        judge_model: Judge whose verdicts are plotted; may be omitted if only one judge was used
+        models: Student models to plot, or None for every model judged by `judge_model`
+        warehouse_path: Path to the warehouse database, or None for the default
+        judgements_dir: Directory containing judgements
+        responses_dir: Directory containing responses
+
+    Returns:
+        Dictionary of plot inputs; every list is ordered like the model list it belongs to
+    """
+    from results_warehouse import DEFAULT_WAREHOUSE_PATH, ResultsWarehouse
+
+    with ResultsWarehouse(warehouse_path or DEFAULT_WAREHOUSE_PATH) as warehouse:
+        warehouse.ingest(judgements_dir, responses_dir)
+        if judge_model is None:
+            judge_models = warehouse.query('SELECT DISTINCT judge_model FROM judgements')['judge_model'].tolist()
+            if len(judge_models) != 1:
+                raise ValueError(f'Pass judge_model to choose one of: {", ".join(judge_models)}')
+            judge_model = judge_models[0]
+        models = list(models or warehouse.models(judge_model))
+        scores = warehouse.subject_scores(models, [judge_model]).reset_index()
+        judged = warehouse.judgements(models, [judge_model], with_responses=True)
+        irish_responses = warehouse.query(
+            "SELECT student_model AS model, response FROM responses WHERE language = 'Irish'")
+
+    averages = scores.groupby(['model', 'language'])[['accuracy', 'confidence']].mean()
+    _, intervals = bootstrap_scores(judged)
+    intervals = intervals.droplevel('judge_model')
+    gaps = paired_language_test(judged).droplevel('judge_model')
+    scores['subject_name'] = scores['subject'].map(name_mappings).fillna(scores['subject'])
+    by_subject = scores.groupby(['subject_name', 'model'])['accuracy'].mean()
+
+    irish = judged[(judged['language'] == 'Irish') & (judged['status'] == 'ok')].copy()
+    irish['in_irish'] = detect_languages(irish['response']) == 'ga'
+    irish_responses = irish_responses[irish_responses['model'].isin(models)].copy()
+    irish_responses['in_irish'] = detect_languages(irish_responses['response']) == 'ga'
+    correct = irish[irish['correct'] == 1].groupby('model', observed=True)['in_irish'].mean() * 100
+    incorrect = irish[irish['correct'] == 0].groupby('model', observed=True)['in_irish'].mean() * 100
+    total = irish_responses.groupby('model')['in_irish'].mean() * 100
+
+    def per_model(values: pd.Series) -> List[float]:
+        return [float(values.get(model, np.nan)) for model in models]
+
+    def per_language(metric: str) -> Dict[str, List[float]]:
+        languages = averages.index.get_level_values('language')
+        return {language: per_model(averages[metric].xs(language, level='language'))
+                if language in languages else [np.nan] * len(models)
+                for language in ['English', 'Irish']}
+
+    return {
+        'models': models,
+        'results': per_language('accuracy'),
+        'confidences': per_language('confidence'),
+        # Bootstrap confidence interval of each language score, per model
+        'result_intervals': {language: [per_model(intervals[bound].xs(language, level='language'))
+                                        if language in intervals.index.get_level_values('language')
+                                        else [np.nan] * len(models) for bound in ['low', 'high']]
+                             for language in ['English', 'Irish']},
+        # Paired English - Irish test on the parallel items, per model
+        'language_gaps': {'gap': per_model(gaps['gap']), 'low': per_model(gaps['low']),
+                          'high': per_model(gaps['high']), 'p_value': per_model(gaps['p_value'])},
+        'subject_results': {subject: per_model(by_subject.xs(subject, level='subject_name'))
+                            for subject in by_subject.index.get_level_values('subject_name').unique()},
+        'language_models': models,
+        'language_data': {
+            'correct_irish': per_model(correct),
+            'incorrect_irish': per_model(incorrect),
+            'total_irish': per_model(total),
+        },
+        'benchmark_models': BENCHMARK_MODELS,
+        'benchmark_data': BENCHMARK_DATA,
+        'subject_count': SUBJECT_COUNT,
+    }
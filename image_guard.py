@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+from typing import List
+
+import pandas as pd
+from tqdm import tqdm
+
+import generate_judgement
+import generate_response
+from api_cache import add_cache_arguments, configure_cache
+from api_retry import APICaller, add_retry_arguments, policy_from_args
+from dataset import add_split_argument, parse_splits
+from image_store import image_columns
+from image_variants import ImagePolicy
+from irlbench import is_correct
+from providers import add_provider_arguments, configure_providers
+from rate_limiter import RateLimiter
+from result_statistics import mcnemar_exact
+from telemetry import add_telemetry_arguments, configure_telemetry, set_labels
+
+ARMS = ('baseline', 'candidate')
+
+
+def sample_image_rows(dataset, size: int, seed: int = 0) -> List[tuple]:
+    """
+    Draw a random sample of rows that have at least one problem image.
+
+    Args:
+        dataset: dataset.IRLBenchDataset
+        size: Number of rows to draw
+        seed: Random seed
+
+    Returns:
+        List of (exam_id, index, row)
+    """
+    candidates = []
+    for EXAM_ID in dataset.splits:
+        for index, row in dataset.rows(EXAM_ID):
+            if any(row[column] for column in image_columns(row) if column.startswith('problem_image_')):
+                candidates.append((EXAM_ID, index, row))
+    return random.Random(seed).sample(candidates, min(size, len(candidates)))
+
+
+def image_bytes(row, policy: ImagePolicy) -> int:
+    """Get the number of image bytes a generation request for `row` sends under `policy`."""
+    variants = generate_response.variants
+    return sum(len(generate_response.images.get_bytes(variants.variant(row[column], policy)))
+               for column in ('problem_image_1', 'problem_image_2') if row[column])
+
+
+async def run_guard(model: str, judge_model: str, rows: List[tuple], policies: dict, concurrency: int,
+                    judge_concurrency: int, policy=None) -> pd.DataFrame:
+    """
+    Generate and judge every sampled row once per image policy.
+
+    Only the student's images differ between the arms; the judge sees its own
+    policy's images in both.
+
+    Args:
+        model: Student model name
+        judge_model: Judge model name
+        rows: Sample from `sample_image_rows`
+        policies: {'baseline': ImagePolicy, 'candidate': ImagePolicy}
+        concurrency: Number of generation requests in flight
+        judge_concurrency: Number of judge requests in flight
+        policy: api_retry.RetryPolicy
+
+    Returns:
+        Frame with one row per (exam_id, index, arm): 'correct' (1.0/0.0, NaN
+        without a verdict) and 'image_bytes'
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    caller = APICaller(concurrency, RateLimiter(), policy, stage='generate')
+    judge_semaphore = asyncio.Semaphore(judge_concurrency)
+    judge_caller = APICaller(judge_concurrency, RateLimiter(), policy, stage='judge')
+    progress = tqdm(total=len(rows) * len(policies), desc='Image guard')
+
+    async def run_arm(EXAM_ID, index, row, arm):
+        set_labels(exam_id=EXAM_ID, image_arm=arm)
+        response_text, _ = await generate_response.generate_row(model, row, semaphore, caller, policies[arm])
+        judgement = await generate_judgement.judge_row(judge_model, model, {**row, 'response': response_text},
+                                                       judge_semaphore, judge_caller)
+        progress.update(1)
+        verdict = is_correct(judgement)
+        return {'exam_id': EXAM_ID, 'index': index, 'arm': arm,
+                'correct': float('nan') if verdict is None else float(verdict),
+                'image_bytes': image_bytes(row, policies[arm])}
+
+    results = await asyncio.gather(*(run_arm(EXAM_ID, index, row, arm)
+                                     for EXAM_ID, index, row in rows for arm in policies))
+    progress.close()
+    return pd.DataFrame(results)
+
+
+def compare_arms(results: pd.DataFrame) -> dict:
+    """
+    Compare the two arms on the rows judged in both.
+
+    Args:
+        results: Frame from `run_guard`
+
+    Returns:
+        Dictionary with 'pairs', per-arm 'accuracy' and 'image_bytes', 'agreement',
+        the discordant counts 'baseline_only' and 'candidate_only', and the exact
+        McNemar 'p_value'
+    """
+    paired = results.pivot_table(index=['exam_id', 'index'], columns='arm', values='correct').dropna()
+    baseline_only = int(((paired['baseline'] == 1) & (paired['candidate'] == 0)).sum())
+    candidate_only = int(((paired['baseline'] == 0) & (paired['candidate'] == 1)).sum())
+    sent = results.groupby('arm')['image_bytes'].sum()
+    return {
+        'pairs': len(paired),
+        'accuracy': {arm: paired[arm].mean() * 100 if len(paired) else float('nan') for arm in ARMS},
+        'image_bytes': {arm: int(sent.get(arm, 0)) for arm in ARMS},
+        'agreement': (paired['baseline'] == paired['candidate']).mean() * 100 if len(paired) else float('nan'),
+        'baseline_only': baseline_only,
+        'candidate_only': candidate_only,
+        'p_value': mcnemar_exact(baseline_only, candidate_only),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Check that an image policy does not move scores: generate and judge a sample of image rows with both policies.")
+    parser.add_argument('--model', type=str, required=True, help='Student model name')
+    parser.add_argument('--judge_model', type=str, required=True, help='Judge model name')
+    parser.add_argument('--candidate', type=str, default=None,
+                        help="Image policy under test, e.g. 'max_edge=1568,format=webp' (default: the model's provider policy)")
+    parser.add_argument('--baseline', type=str, default='original', help="Image policy to compare against (default: 'original')")
+    parser.add_argument('--sample', type=int, default=50, help='Number of image rows to sample')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the sample')
+    parser.add_argument('--concurrency', type=int, default=8, help='Maximum number of generation requests in flight')
+    parser.add_argument('--judge_concurrency', type=int, default=8, help='Maximum number of judge requests in flight')
+    parser.add_argument('--alpha', type=float, default=0.05, help='Exit non-zero if the McNemar p-value is below this')
+    parser.add_argument('--output', type=str, default='output/image_guard.csv', help='Per-row results')
+    add_split_argument(parser)
+    add_cache_arguments(parser)
+    add_retry_arguments(parser)
+    add_telemetry_arguments(parser)
+    add_provider_arguments(parser)
+    args = parser.parse_args()
+    configure_cache(generate_response.cache, args)
+    configure_cache(generate_judgement.cache, args)
+    configure_telemetry(args)
+    configure_providers(args, [args.model, args.judge_model])
+
+    policies = {
+        'baseline': ImagePolicy.from_config(args.baseline),
+        'candidate': (generate_response.image_policy(args.model) if args.candidate is None
+                      else ImagePolicy.from_config(args.candidate)),
+    }
+    if policies['candidate'].is_original:
+        parser.error(f'{args.model} has no image policy in {args.providers}; pass --candidate')
+    dataset = generate_response.open_dataset(parse_splits(args.splits, generate_response.EXAM_IDS))
+    rows = sample_image_rows(dataset, args.sample, args.seed)
+    results = asyncio.run(run_guard(args.model, args.judge_model, rows, policies, args.concurrency,
+                                    args.judge_concurrency, policy_from_args(args)))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    results.to_csv(args.output, index=False)
+    comparison = compare_arms(results)
+
+    print("\n--- Image guard ---")
+    for arm in ARMS:
+        print(f"{arm}: {policies[arm].key()}")
+        print(f"  accuracy {comparison['accuracy'][arm]:.2f}%, image bytes {comparison['image_bytes'][arm] / 1e6:.2f} MB")
+    baseline_bytes = comparison['image_bytes']['baseline']
+    if baseline_bytes:
+        print(f"Bytes saved: {1 - comparison['image_bytes']['candidate'] / baseline_bytes:.0%}")
+    print(f"Pairs: {comparison['pairs']}, agreement {comparison['agreement']:.1f}%, "
+          f"baseline only {comparison['baseline_only']}, candidate only {comparison['candidate_only']}, "
+          f"McNemar p = {comparison['p_value']:.3f}")
+    if comparison['p_value'] < args.alpha:
+        print("Scores moved: the candidate policy changes accuracy.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import ast
+import base64
+import hashlib
+import os
+from functools import lru_cache
+from io import BytesIO
+from typing import Any, List, Optional
+
+IMAGE_COLUMN_PREFIXES = ('problem_image_', 'answer_image_')
+
+
+def image_columns(columns) -> List[str]:
+    """Get the problem/answer image columns of a split or dataframe."""
+    return [column for column in columns if column.startswith(IMAGE_COLUMN_PREFIXES)]
+
+
+def sniff_mime_type(data: bytes) -> str:
+    """Detect the MIME type of encoded image bytes from their magic number."""
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if data.startswith(b'GIF8'):
+        return 'image/gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/png'
+
+
+def is_image_hash(value: Any) -> bool:
+    """Check whether a cell holds an image reference written by `ImageStore`."""
+    return isinstance(value, str) and len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
+
+class ImageStore:
+    """
+    Content-addressed store of encoded exam images.
+
+    Each image is written once to `{root}/{hash[:2]}/{hash}` under the SHA-256 of
+    its encoded bytes. Response and judgement files then carry only the hash, and
+    the raw bytes and base64 data URLs are memoized in memory for the lifetime of
+    the process, so an image is encoded at most once no matter how many models,
+    retries or judges use it.
+    """
+
+    def __init__(self, root: str = 'assets/images'):
+        """
+        Args:
+            root: Directory holding the image files
+        """
+        self.root = root
+        self.get_bytes = lru_cache(maxsize=1024)(self._read)
+        self.data_url = lru_cache(maxsize=1024)(self._data_url)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, data: bytes) -> str:
+        """
+        Store encoded image bytes.
+
+        Args:
+            data: Encoded image (PNG, JPEG, ...)
+
+        Returns:
+            SHA-256 hex digest referencing the image
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest
+
+    def put_image(self, value: Any) -> Optional[str]:
+        """
+        Store an image given in any of the forms found in the dataset or in old result files.
+
+        Args:
+            value: None, a hash, raw bytes, a PIL image, a {'bytes': ..., 'path': ...}
+                dict from the dataset, or the repr of such a dict from a CSV cell
+
+        Returns:
+            Hash referencing the image, or None if there is no image
+
+        Raises:
+            ValueError: If an image dict has neither bytes nor a path
+        """
+        if value is None or (isinstance(value, float) and value != value):
+            return None
+        if is_image_hash(value):
+            return value
+        if isinstance(value, str):
+            if not value:
+                return None
+            # Older result CSVs hold the repr of the dataset's image dict
+            value = ast.literal_eval(value)
+        if isinstance(value, dict):
+            if value.get('bytes') is None:
+                # Undecoded images stored as files by the dataset have only a path
+                if not value.get('path'):
+                    raise ValueError('Image has neither bytes nor a path')
+                with open(value['path'], 'rb') as f:
+                    return self.put(f.read())
+            value = value['bytes']
+        if isinstance(value, (bytes, bytearray)):
+            return self.put(bytes(value))
+        # A decoded PIL image
+        buf = BytesIO()
+        value.save(buf, format='PNG')
+        return self.put(buf.getvalue())
+
+    def _read(self, digest: str) -> bytes:
+        with open(self._path(digest), 'rb') as f:
+            return f.read()
+
+    def _data_url(self, digest: str) -> str:
+        data = self.get_bytes(digest)
+        return f"data:{sniff_mime_type(data)};base64,{base64.b64encode(data).decode('utf-8')}"
+
+    def mime_type(self, digest: str) -> str:
+        """Get the MIME type of a stored image."""
+        return sniff_mime_type(self.get_bytes(digest))
@@ -0,0 +1,274 @@
+import json
+import os
+import sqlite3
+import threading
+from io import BytesIO
+from typing import Any, Dict, Optional, Union
+
+from image_store import ImageStore
+
+DEFAULT_INDEX_PATH = 'cache/image_variants.sqlite'
+
+IMAGE_FORMATS = {'png': 'PNG', 'jpeg': 'JPEG', 'webp': 'WEBP'}
+
+# An image counts as line art (and may be sent as grayscale) when nearly all of its
+# pixels have less than this spread between their colour channels
+_GRAY_CHROMA = 12
+
+
+class ImagePolicy:
+    """How images are prepared before they are sent to a provider."""
+
+    def __init__(self, max_edge: Optional[int] = None, max_short_edge: Optional[int] = None,
+                 format: Optional[str] = None, quality: int = 85, grayscale: Union[bool, str] = False):
+        """
+        Args:
+            max_edge: Downscale so that the long edge is at most this many pixels
+            max_short_edge: Downscale so that the short edge is at most this many pixels
+            format: 'png', 'jpeg' or 'webp', or None to keep the original format
+            quality: JPEG/WebP quality
+            grayscale: True to always send grayscale, 'auto' for images without
+                colour (scanned text, line art), False to keep colour
+        """
+        if format is not None and format not in IMAGE_FORMATS:
+            raise ValueError(f'Unknown image format: {format}')
+        if grayscale not in (True, False, 'auto'):
+            raise ValueError(f'Invalid grayscale setting: {grayscale}')
+        self.max_edge = max_edge
+        self.max_short_edge = max_short_edge
+        self.format = format
+        self.quality = quality
+        self.grayscale = grayscale
+
+    @classmethod
+    def from_config(cls, config: Union[None, str, Dict[str, Any], 'ImagePolicy']) -> 'ImagePolicy':
+        """
+        Build a policy from a providers.json entry or a command-line spec.
+
+        Args:
+            config: None or 'original' for no changes, a dictionary of arguments,
+                or a spec like 'max_edge=1568,format=jpeg,quality=85,grayscale=auto'
+
+        Returns:
+            The policy
+        """
+        if isinstance(config, ImagePolicy):
+            return config
+        if config is None or config == 'original':
+            return cls()
+        if isinstance(config, str):
+            settings = {}
+            for part in config.split(','):
+                name, _, value = part.partition('=')
+                name = name.strip()
+                value = value.strip()
+                if name in ('max_edge', 'max_short_edge', 'quality'):
+                    settings[name] = int(value)
+                elif name == 'grayscale':
+                    settings[name] = value if value == 'auto' else value.lower() in ('1', 'true', 'yes')
+                else:
+                    settings[name] = value
+            config = settings
+        return cls(**config)
+
+    @property
+    def is_original(self) -> bool:
+        """Whether the policy leaves every image unchanged."""
+        return (self.max_edge is None and self.max_short_edge is None and self.format is None
+                and self.grayscale is False)
+
+    def key(self) -> str:
+        """Canonical description of the policy, for the variant index."""
+        if self.is_original:
+            return 'original'
+        return json.dumps({'max_edge': self.max_edge, 'max_short_edge': self.max_short_edge, 'format': self.format,
+                           'quality': self.quality, 'grayscale': self.grayscale}, sort_keys=True)
+
+    def apply(self, data: bytes) -> bytes:
+        """
+        Encode an image under this policy.
+
+        Args:
+            data: Encoded source image
+
+        Returns:
+            Encoded variant; the source bytes when the policy changes nothing, or
+            when it does not resize and the re-encoded image would not be smaller.
+            An image that is not resized is only re-encoded losslessly unless
+            the policy names a format: a JPEG or WebP source is then sent as is.
+        """
+        if self.is_original:
+            return data
+        from PIL import Image
+
+        image = Image.open(BytesIO(data))
+        source_format = (image.format or 'PNG').upper()
+        width, height = image.size
+        scale = 1.0
+        if self.max_edge:
+            scale = min(scale, self.max_edge / max(width, height))
+        if self.max_short_edge:
+            scale = min(scale, self.max_short_edge / min(width, height))
+        resized = scale < 1.0
+        if not resized and self.format is None and source_format != 'PNG':
+            # Re-encoding a lossy source would degrade it further without the policy asking for it
+            return data
+        if resized:
+            if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                # Palette and bilevel images would otherwise be resized with nearest-neighbour sampling
+                image = image.convert('RGBA' if _has_alpha(image) else 'RGB')
+            image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+
+        target = IMAGE_FORMATS[self.format] if self.format else source_format
+        if target not in IMAGE_FORMATS.values():
+            target = 'PNG'
+        alpha = _has_alpha(image) and target != 'JPEG'
+        if target == 'JPEG':
+            image = _flatten(image)
+        if self.grayscale is True or (self.grayscale == 'auto' and _is_gray(image)):
+            image = image.convert('LA' if alpha else 'L')
+        elif image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+            image = image.convert('RGBA' if alpha else 'RGB')
+
+        buf = BytesIO()
+        if target == 'PNG':
+            image.save(buf, format='PNG', optimize=True)
+        else:
+            image.save(buf, format=target, quality=self.quality)
+        encoded = buf.getvalue()
+        if not resized and len(encoded) >= len(data):
+            return data
+        return encoded
+
+
+def _has_alpha(image) -> bool:
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def _flatten(image):
+    # JPEG has no alpha channel: composite on white, as the page background is white
+    from PIL import Image
+
+    if not _has_alpha(image):
+        return image.convert('RGB')
+    rgba = image.convert('RGBA')
+    background = Image.new('RGB', rgba.size, (255, 255, 255))
+    background.paste(rgba, mask=rgba.getchannel('A'))
+    return background
+
+
+def _is_gray(image) -> bool:
+    import numpy as np
+
+    if image.mode in ('L', 'LA', '1'):
+        return True
+    sample = image.convert('RGB')
+    sample.thumbnail((256, 256))
+    pixels = np.asarray(sample, dtype=np.int16)
+    chroma = pixels.max(axis=2) - pixels.min(axis=2)
+    return float(np.percentile(chroma, 99)) < _GRAY_CHROMA
+
+
+class ImageVariants:
+    """
+    Per-policy variants of stored images.
+
+    A variant is stored in the same content-addressed ImageStore as its source,
+    so everything downstream (data URLs, Gemini parts, request cache keys) keeps
+    working on hashes. A SQLite index maps (source hash, policy) to the variant
+    and records both sizes, so each variant is encoded once across runs.
+    """
+
+    def __init__(self, images: ImageStore, index_path: str = DEFAULT_INDEX_PATH):
+        """
+        Args:
+            images: Store holding sources and variants
+            index_path: Path to the SQLite variant index
+        """
+        self.images = images
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._memo: Dict[tuple, str] = {}
+        self.original_bytes = 0
+        self.sent_bytes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.index_path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.index_path, timeout=60, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS variants (
+                source TEXT NOT NULL,
+                policy TEXT NOT NULL,
+                variant TEXT NOT NULL,
+                source_bytes INTEGER NOT NULL,
+                variant_bytes INTEGER NOT NULL,
+                PRIMARY KEY (source, policy)
+            )''')
+        return self._conn
+
+    def _lookup(self, digest: str, policy_key: str) -> Optional[tuple]:
+        with self._lock:
+            conn = self._connect()
+            return conn.execute('SELECT variant, source_bytes, variant_bytes FROM variants WHERE source = ? AND policy = ?',
+                                (digest, policy_key)).fetchone()
+
+    def _create(self, digest: str, policy: ImagePolicy, policy_key: str) -> tuple:
+        data = self.images.get_bytes(digest)
+        encoded = policy.apply(data)
+        variant = self.images.put(encoded) if encoded is not data else digest
+        entry = (variant, len(data), len(encoded))
+        with self._lock:
+            conn = self._connect()
+            conn.execute('INSERT OR REPLACE INTO variants (source, policy, variant, source_bytes, variant_bytes) '
+                         'VALUES (?, ?, ?, ?, ?)', (digest, policy_key, *entry))
+            conn.commit()
+        return entry
+
+    def variant(self, digest: Optional[str], policy: Optional[ImagePolicy]) -> Optional[str]:
+        """
+        Get the image to send for a stored image under a policy.
+
+        Args:
+            digest: Hash of the source image, or None
+            policy: Policy of the target provider, or None to send the original
+
+        Returns:
+            Hash of the variant (the source hash when nothing changes), or None
+        """
+        if digest is None or policy is None or policy.is_original:
+            return digest
+        policy_key = policy.key()
+        entry = self._memo.get((digest, policy_key))
+        if entry is None:
+            entry = self._lookup(digest, policy_key) or self._create(digest, policy, policy_key)
+            self._memo[(digest, policy_key)] = entry
+        with self._lock:
+            self.original_bytes += entry[1]
+            self.sent_bytes += entry[2]
+        return entry[0]
+
+    def summary(self) -> str:
+        """Describe the image bytes sent so far in this process and the bytes saved."""
+        if not self.original_bytes:
+            return 'Images: no resized or recompressed images sent'
+        saved = self.original_bytes - self.sent_bytes
+        return (f'Images: sent {self.sent_bytes / 1e6:.1f} MB instead of {self.original_bytes / 1e6:.1f} MB '
+                f'({saved / self.original_bytes:.0%} saved)')
+
+    def report(self):
+        """
+        Summarize the variant index per policy.
+
+        Returns:
+            pandas DataFrame indexed by policy with 'images', 'source_bytes',
+            'variant_bytes' and 'saved' (fraction) columns
+        """
+        import pandas as pd
+
+        with self._lock:
+            df = pd.read_sql_query('SELECT policy, COUNT(*) AS images, SUM(source_bytes) AS source_bytes, '
+                                   'SUM(variant_bytes) AS variant_bytes FROM variants GROUP BY policy', self._connect())
+        df['saved'] = 1 - df['variant_bytes'] / df['source_bytes']
+        return df.set_index('policy')
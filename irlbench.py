@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from tqdm import tqdm
+
+import generate_judgement
+import generate_response
+from api_cache import add_cache_arguments, configure_cache
+from api_retry import APICaller, add_retry_arguments, policy_from_args
+from dataset import add_split_argument, parse_splits, row_images
+from providers import add_provider_arguments, configure_providers
+from rate_limiter import RateLimiter
+from results_io import write_results, add_format_argument
+from streaming import add_stream_arguments, configure_streaming
+from telemetry import add_telemetry_arguments, configure_telemetry, set_labels
+
+
+def is_correct(judgement: Optional[str]) -> Optional[bool]:
+    """
+    Read the verdict of a structured judgement.
+
+    Args:
+        judgement: Judgement JSON, or a 'Skipped: ...'/'Error: ...' message
+
+    Returns:
+        True/False for a parsed verdict, or None if the row has no verdict
+    """
+    try:
+        correct = json.loads(judgement)['correct']
+    except (TypeError, ValueError, KeyError):
+        return None
+    if not isinstance(correct, str):
+        return None
+    return correct.strip().lower().startswith('yes')
+
+
+class Scoreboard:
+    """Running per-split accuracy that is updated as each judgement arrives."""
+
+    def __init__(self):
+        self.correct: Dict[str, int] = defaultdict(int)
+        self.judged: Dict[str, int] = defaultdict(int)
+
+    def add(self, exam_id: str, judgement: Optional[str]) -> None:
+        """
+        Count one judgement.
+
+        Args:
+            exam_id: Dataset split name
+            judgement: Judgement text
+        """
+        verdict = is_correct(judgement)
+        if verdict is None:
+            return
+        self.judged[exam_id] += 1
+        self.correct[exam_id] += verdict
+
+    def score(self, exam_id: str) -> float:
+        """Get the accuracy of a split in percent."""
+        return self.correct[exam_id] / self.judged[exam_id] * 100 if self.judged[exam_id] else 0.0
+
+    def language_average(self, suffix: str) -> float:
+        """
+        Average the split scores of one language, as in run_analysis.py.
+
+        Args:
+            suffix: 'EV' for English or 'IV' for Irish
+
+        Returns:
+            Mean accuracy over the splits of that language judged so far
+        """
+        scores = [self.score(exam_id) for exam_id in self.judged if exam_id.split('_')[0].endswith(suffix)]
+        return sum(scores) / len(scores) if scores else 0.0
+
+
+async def run_pipeline(model: str, judge_model: str, generate_concurrency: int, judge_concurrency: int,
+                       queue_size: int, requests_per_minute: Optional[int] = None,
+                       tokens_per_minute: Optional[int] = None, judge_requests_per_minute: Optional[int] = None,
+                       output_format: str = 'parquet', policy=None, splits: Optional[List[str]] = None) -> Scoreboard:
+    """
+    Generate, judge and score every row as a streaming pipeline.
+
+    Generation workers pull rows from a shared lazy iterator and push each
+    response onto a bounded judge queue as soon as it arrives, so judging overlaps
+    with generation. A full judge queue pauses generation, and with it the reading
+    of rows, instead of buffering without limit.
+
+    Args:
+        model: Student model name
+        judge_model: Judge model name
+        generate_concurrency: Number of generation requests in flight
+        judge_concurrency: Number of judge requests in flight
+        queue_size: Capacity of the queue between the two stages
+        requests_per_minute: Generation requests-per-minute budget
+        tokens_per_minute: Generation tokens-per-minute budget
+        judge_requests_per_minute: Judge requests-per-minute budget
+        output_format: File format for responses and judgements
+        policy: api_retry.RetryPolicy shared by both stages
+        splits: Splits to run (default: every split in the manifest)
+
+    Returns:
+        Final scoreboard
+    """
+    # Fails fast on a judge model missing from providers.json
+    generate_judgement.get_provider(judge_model)
+
+    dataset = generate_response.open_dataset(splits)
+    store = generate_response.open_store(model)
+    file_model = model.replace('/', '--')
+
+    judge_queue = asyncio.Queue(maxsize=queue_size)
+    judgements = {EXAM_ID: [None] * dataset.num_rows(EXAM_ID) for EXAM_ID in dataset.splits}
+    scoreboard = Scoreboard()
+
+    generate_semaphore = asyncio.Semaphore(generate_concurrency)
+    generate_caller = APICaller(generate_concurrency, RateLimiter(requests_per_minute, tokens_per_minute), policy, stage='generate')
+    judge_semaphore = asyncio.Semaphore(judge_concurrency)
+    judge_caller = APICaller(judge_concurrency, RateLimiter(judge_requests_per_minute), policy, stage='judge')
+
+    def pending_rows():
+        for EXAM_ID in dataset.splits:
+            records = store.records(EXAM_ID, model)
+            for index, row in dataset.rows(EXAM_ID):
+                yield EXAM_ID, index, row, records.get(index)
+
+    # One iterator shared by the generation workers, so rows are read only as workers become free
+    work = pending_rows()
+    progress = tqdm(total=sum(len(rows) for rows in judgements.values()), desc=f'{model} judged by {judge_model}')
+
+    async def generate_worker():
+        for EXAM_ID, index, row, record in work:
+            set_labels(exam_id=EXAM_ID)
+            if record is not None and record['status'] == 'ok':
+                response_text = record['response']
+            else:
+                response_text, fields = await generate_response.generate_row(model, row, generate_semaphore, generate_caller)
+                store.append(EXAM_ID, index, model, response_text, images=row_images(row), **fields)
+            row = row.copy()
+            row['response'] = response_text
+            await judge_queue.put((EXAM_ID, index, row))
+
+    async def judge_worker():
+        while True:
+            item = await judge_queue.get()
+            if item is None:
+                break
+            EXAM_ID, index, row = item
+            set_labels(exam_id=EXAM_ID, student_model=model)
+            try:
+                judgement = await generate_judgement.judge_row(judge_model, model, row, judge_semaphore, judge_caller)
+                scoreboard.add(EXAM_ID, judgement)
+            except Exception as e:
+                # A dead worker would stop draining the bounded queue and hang the generate stage
+                judgement = f'Error: {e}'
+            judgements[EXAM_ID][index] = judgement
+            progress.update(1)
+            progress.set_postfix(English=f'{scoreboard.language_average("EV"):.1f}%',
+                                 Irish=f'{scoreboard.language_average("IV"):.1f}%')
+
+    judge_tasks = [asyncio.create_task(judge_worker()) for _ in range(judge_concurrency)]
+    await asyncio.gather(*(generate_worker() for _ in range(generate_concurrency)))
+    for _ in judge_tasks:
+        await judge_queue.put(None)
+    await asyncio.gather(*judge_tasks)
+    progress.close()
+
+    for EXAM_ID in dataset.splits:
+        df = generate_response.result_frame(model, dataset, EXAM_ID, store)
+        generate_response.compact_split(model, df, EXAM_ID, store, output_format)
+        df = store.compact(df.copy(), EXAM_ID, model, fields=generate_response.STREAM_FIELDS)
+        df['judgement'] = judgements[EXAM_ID]
+        write_results(df, f'judgements/{EXAM_ID}_{file_model}_judge_model_{judge_model}', output_format)
+    generate_response.cache.evict()
+    generate_judgement.cache.evict()
+    return scoreboard
+
+
+def main() -> None:
+    """Entry point for the `irlbench` command line."""
+    parser = argparse.ArgumentParser(description="IRLBench evaluation pipeline.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Generate responses, judge them and report scores in one streaming pass')
+    run_parser.add_argument('--model', type=str, required=True, help='Model name to use for response generation')
+    run_parser.add_argument('--judge_model', type=str, required=True, help='Judge model name')
+    run_parser.add_argument('--generate_concurrency', type=int, default=8, help='Maximum number of generation requests in flight')
+    run_parser.add_argument('--judge_concurrency', type=int, default=8, help='Maximum number of judge requests in flight')
+    run_parser.add_argument('--queue_size', type=int, default=32, help='Capacity of the queue between generation and judging')
+    run_parser.add_argument('--rpm', type=int, default=None, help='Generation requests-per-minute budget (default: unlimited)')
+    run_parser.add_argument('--tpm', type=int, default=None, help='Generation tokens-per-minute budget (default: unlimited)')
+    run_parser.add_argument('--judge_rpm', type=int, default=None, help='Judge requests-per-minute budget (default: unlimited)')
+    add_format_argument(run_parser)
+    add_cache_arguments(run_parser)
+    add_retry_arguments(run_parser)
+    add_telemetry_arguments(run_parser)
+    add_provider_arguments(run_parser)
+    add_stream_arguments(run_parser)
+    add_split_argument(run_parser)
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        configure_cache(generate_response.cache, args)
+        configure_cache(generate_judgement.cache, args)
+        configure_telemetry(args)
+        configure_providers(args, [args.model, args.judge_model])
+        configure_streaming(generate_response.streaming, args)
+        splits = parse_splits(args.splits, generate_response.EXAM_IDS)
+        scoreboard = asyncio.run(run_pipeline(
+            args.model, args.judge_model, args.generate_concurrency, args.judge_concurrency, args.queue_size,
+            args.rpm, args.tpm, args.judge_rpm, args.output_format, policy_from_args(args), splits,
+        ))
+
+        print("\n--- Summary ---")
+        print(f"Model: {args.model}")
+        for EXAM_ID in splits:
+            print(f"{EXAM_ID}: {scoreboard.score(EXAM_ID):.2f}%")
+        print("\nAverage scores:")
+        print(f"English: {scoreboard.language_average('EV'):.2f}%")
+        print(f"Irish: {scoreboard.language_average('IV'):.2f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+DEFAULT_CACHE_PATH = 'cache/languages.sqlite'
+
+# fastText language identification models (176 languages); the .ftz file is the compressed one
+MODEL_URL = 'https://dl.fbaipublicfiles.com/fasttext/supervised-models/lid.176.{}'
+MODEL_DIR = 'cache'
+
+# fastText is a bag-of-ngrams classifier; long responses are split into chunks of
+# about this many characters and the chunk predictions are combined
+CHUNK_CHARS = 2000
+
+# Number of chunks sent to fastText per predict call
+BATCH_SIZE = 4096
+
+# SQLite limits the number of bound parameters per statement
+_LOOKUP_BATCH = 500
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def text_hash(text: str) -> str:
+    """Hash a response text for the label cache."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def split_chunks(text: str, chunk_chars: int = CHUNK_CHARS) -> List[str]:
+    """
+    Split a text into single-line chunks of about `chunk_chars` characters, at word boundaries.
+
+    Args:
+        text: Response text
+        chunk_chars: Target chunk length
+
+    Returns:
+        Chunks with whitespace collapsed; empty for a blank text
+    """
+    words = _WHITESPACE.sub(' ', text).strip().split(' ')
+    chunks = []
+    current = []
+    length = 0
+    for word in words:
+        if current and length + len(word) > chunk_chars:
+            chunks.append(' '.join(current))
+            current = []
+            length = 0
+        current.append(word)
+        length += len(word) + 1
+    if current and current != ['']:
+        chunks.append(' '.join(current))
+    return chunks
+
+
+def download_model(low_memory: bool = False, model_dir: str = MODEL_DIR) -> str:
+    """
+    Get the path of the fastText language identification model, downloading it on first use.
+
+    Args:
+        low_memory: Use the compressed model (lid.176.ftz) instead of lid.176.bin
+        model_dir: Directory the model is stored in
+
+    Returns:
+        Path of the model file
+    """
+    extension = 'ftz' if low_memory else 'bin'
+    path = os.path.join(model_dir, f'lid.176.{extension}')
+    if not os.path.exists(path):
+        import urllib.request
+
+        os.makedirs(model_dir, exist_ok=True)
+        # Download next to the target first so an interrupted download is never loaded; the
+        # temporary name is per process because analysis workers may all start on a cold cache
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        urllib.request.urlretrieve(MODEL_URL.format(extension), tmp_path)
+        os.replace(tmp_path, path)
+    return path
+
+
+class LanguageDetector:
+    """
+    Batched fastText language detection with a persistent per-text cache.
+
+    The fastText model is loaded once per process. Texts are deduplicated, looked
+    up in a SQLite cache keyed by their hash, and only unseen texts are chunked and
+    classified, many chunks per predict call. The label of a text is the language
+    with the highest length-weighted probability over its chunks.
+    """
+
+    def __init__(self, cache_path: str = DEFAULT_CACHE_PATH, low_memory: bool = False,
+                 chunk_chars: int = CHUNK_CHARS, batch_size: int = BATCH_SIZE, enabled: bool = True):
+        """
+        Args:
+            cache_path: Path to the SQLite label cache
+            low_memory: Use the compressed fastText model
+            chunk_chars: Target chunk length for long texts
+            batch_size: Number of chunks per predict call
+            enabled: If False, labels are neither read from nor written to the cache
+        """
+        self.cache_path = cache_path
+        self.low_memory = low_memory
+        self.chunk_chars = chunk_chars
+        self.batch_size = batch_size
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._conn = None
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            import fasttext
+
+            self._model = fasttext.load_model(download_model(self.low_memory))
+        return self._model
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+            # Several analysis processes may share the cache
+            self._conn = sqlite3.connect(self.cache_path, timeout=60, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS labels (
+                hash TEXT PRIMARY KEY,
+                label TEXT NOT NULL,
+                probability REAL NOT NULL
+            )''')
+        return self._conn
+
+    def _lookup(self, hashes: List[str]) -> Dict[str, Tuple[str, float]]:
+        if not self.enabled:
+            return {}
+        found = {}
+        with self._lock:
+            conn = self._connect()
+            for start in range(0, len(hashes), _LOOKUP_BATCH):
+                batch = hashes[start:start + _LOOKUP_BATCH]
+                placeholders = ','.join('?' * len(batch))
+                for digest, label, probability in conn.execute(
+                        f'SELECT hash, label, probability FROM labels WHERE hash IN ({placeholders})', batch):
+                    found[digest] = (label, probability)
+        return found
+
+    def _store(self, labels: Dict[str, Tuple[str, float]]) -> None:
+        if not self.enabled or not labels:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.executemany('INSERT OR REPLACE INTO labels (hash, label, probability) VALUES (?, ?, ?)',
+                             [(digest, label, probability) for digest, (label, probability) in labels.items()])
+            conn.commit()
+
+    def predict(self, texts: List[str]) -> List[Optional[Tuple[str, float]]]:
+        """
+        Classify texts without using the cache.
+
+        Args:
+            texts: Texts to classify
+
+        Returns:
+            (language code, probability) per text, or None for a blank text
+        """
+        owners = []
+        chunks = []
+        for i, text in enumerate(texts):
+            for chunk in split_chunks(text, self.chunk_chars):
+                owners.append(i)
+                chunks.append(chunk)
+
+        scores: List[Dict[str, float]] = [{} for _ in texts]
+        lengths = [0] * len(texts)
+        for start in range(0, len(chunks), self.batch_size):
+            batch = chunks[start:start + self.batch_size]
+            labels, probabilities = self.model.predict(batch, k=1)
+            for owner, chunk, label, probability in zip(owners[start:start + self.batch_size], batch, labels, probabilities):
+                language = label[0].replace('__label__', '')
+                scores[owner][language] = scores[owner].get(language, 0.0) + len(chunk) * min(float(probability[0]), 1.0)
+                lengths[owner] += len(chunk)
+
+        results = []
+        for score, length in zip(scores, lengths):
+            if not score:
+                results.append(None)
+                continue
+            language = max(score, key=score.get)
+            results.append((language, score[language] / length))
+        return results
+
+    def detect(self, texts: Iterable[Optional[str]]) -> pd.DataFrame:
+        """
+        Detect the language of each text, using and filling the cache.
+
+        Args:
+            texts: Texts (e.g. a response column); missing values are allowed
+
+        Returns:
+            Frame with 'label' (language code, None for blank or missing texts) and
+            'probability' columns, indexed like `texts` when it is a Series
+        """
+        index = texts.index if isinstance(texts, pd.Series) else None
+        texts = [text if isinstance(text, str) else '' for text in texts]
+        hashes = [text_hash(text) for text in texts]
+        unique = {digest: text for digest, text in zip(hashes, texts) if text.strip()}
+
+        labels = self._lookup(list(unique))
+        missing = [digest for digest in unique if digest not in labels]
+        if missing:
+            predicted = self.predict([unique[digest] for digest in missing])
+            new_labels = {digest: result for digest, result in zip(missing, predicted) if result is not None}
+            self._store(new_labels)
+            labels.update(new_labels)
+
+        rows = [labels.get(digest, (None, float('nan'))) for digest in hashes]
+        return pd.DataFrame(rows, columns=['label', 'probability'], index=index)
+
+
+_detector: Optional[LanguageDetector] = None
+
+
+def get_detector() -> LanguageDetector:
+    """Get the detector of this process, creating it on first use."""
+    global _detector
+    if _detector is None:
+        _detector = LanguageDetector()
+    return _detector
+
+
+def init_process(**kwargs) -> None:
+    """
+    Give a worker process its own detector.
+
+    Used as a process pool initializer, so that forked workers do not share the
+    parent's SQLite connection.
+
+    Args:
+        **kwargs: Arguments for LanguageDetector
+    """
+    global _detector
+    _detector = LanguageDetector(**kwargs)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from mock_provider import add_mock_arguments, serve, settings_from_args
+from telemetry import load_records, summarize
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Read-only inputs the scripts resolve relative to the working directory
+SHARED_PATHS = ['exams.json', 'assets']
+
+
+def prepare_workdir(workdir: str) -> None:
+    """
+    Set up a scratch working directory for the scripts under test.
+
+    Responses, judgements, caches and telemetry are written there, so a load test
+    never touches real results. The manifest and image store are linked in.
+
+    Args:
+        workdir: Scratch directory
+    """
+    os.makedirs(workdir, exist_ok=True)
+    for name in SHARED_PATHS:
+        target = os.path.join(workdir, name)
+        if not os.path.lexists(target):
+            os.symlink(os.path.join(SCRIPT_DIR, name), target)
+
+
+def run_stage(command: List[str], workdir: str, env: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Run one script to completion and measure its resource use.
+
+    Args:
+        command: Script and arguments, e.g. ['generate_response.py', '--model', 'mock']
+        workdir: Working directory
+        env: Environment of the script
+
+    Returns:
+        'returncode', 'elapsed' seconds, 'cpu_seconds' (user + system) and 'peak_rss_mb'
+    """
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(SCRIPT_DIR, command[0])] + command[1:], cwd=workdir, env=env)
+    # wait4 reports the resource use of this child alone
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        'returncode': process.returncode,
+        'elapsed': elapsed,
+        'cpu_seconds': usage.ru_utime + usage.ru_stime,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': usage.ru_maxrss / 1024,
+    }
+
+
+def stage_report(stage: str, measured: Dict[str, Any], records, server_stats: Dict[str, int]) -> Dict[str, Any]:
+    """
+    Combine process measurements, telemetry and mock server counts into one report row.
+
+    Args:
+        stage: Telemetry stage, 'generate' or 'judge'
+        measured: Result of `run_stage`
+        records: Telemetry records of this stage
+        server_stats: Mock server request counts during this stage
+
+    Returns:
+        Report dictionary
+    """
+    report = {'stage': stage, **measured, 'server': server_stats}
+    if records is None or not len(records):
+        return {**report, 'rows': 0}
+    summary = summarize(records, ['stage']).iloc[0]
+    rows = int(summary['calls'] - summary['errors'])
+    return {
+        **report,
+        'rows': rows,
+        'errors': int(summary['errors']),
+        'retries': int(summary['retries']),
+        'rows_per_s': rows / measured['elapsed'],
+        'p50_latency': summary['p50_latency'],
+        'p99_latency': summary['p99_latency'],
+        'cpu_percent': 100 * measured['cpu_seconds'] / measured['elapsed'],
+    }
+
+
+def print_report(reports: List[Dict[str, Any]]) -> None:
+    for report in reports:
+        print(f"\n[{report['stage']}] exit {report['returncode']}, {report['elapsed']:.1f}s wall")
+        if not report['rows']:
+            print('  no calls recorded')
+            continue
+        print(f"  rows: {report['rows']} ok, {report['errors']} failed, {report['retries']} retries")
+        print(f"  throughput: {report['rows_per_s']:.2f} rows/s")
+        print(f"  latency: p50 {report['p50_latency']:.3f}s, p99 {report['p99_latency']:.3f}s")
+        print(f"  client: {report['cpu_seconds']:.1f} CPU s ({report['cpu_percent']:.0f}%), peak RSS {report['peak_rss_mb']:.0f} MB")
+        print(f"  server: {report['server']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Drive generate_response.py and generate_judgement.py against a local mock provider and report throughput.")
+    parser.add_argument('--stages', type=str, default='generate,judge', help="Comma-separated stages to run: 'generate', 'judge'")
+    parser.add_argument('--model', type=str, default='mock-model', help='Student model name sent to the mock')
+    parser.add_argument('--judge_model', type=str, default='gemini-2.0-flash', help='Judge model (selects the Gemini or OpenAI path)')
+    parser.add_argument('--generate_args', type=str, default='', help="Extra arguments for generate_response.py, e.g. '--concurrency 32 --stream'")
+    parser.add_argument('--judge_args', type=str, default='', help='Extra arguments for generate_judgement.py')
+    parser.add_argument('--workdir', type=str, default=None, help='Scratch working directory (default: a new temporary directory)')
+    parser.add_argument('--report', type=str, default=None, help='Append the results as a JSON line to this file, for comparing runs')
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='irlbench-load-'))
+    prepare_workdir(workdir)
+    server = serve(settings_from_args(args))
+    env = {
+        **os.environ,
+        'OPENAI_BASE_URL': f'{server.url}/v1',
+        'GEMINI_BASE_URL': server.url,
+        'OPENAI_API_KEY': 'mock',
+        'GEMINI_API_KEY': 'mock',
+    }
+    telemetry_path = os.path.join(workdir, 'telemetry', 'calls.jsonl')
+    commands = {
+        'generate': ['generate_response.py', '--model', args.model, '--no-cache', '--telemetry_path', telemetry_path]
+                    + shlex.split(args.generate_args),
+        'judge': ['generate_judgement.py', '--judge_model', args.judge_model, '--student_model', args.model.replace('/', '--'),
+                  '--no-cache', '--telemetry_path', telemetry_path] + shlex.split(args.judge_args),
+    }
+
+    print(f'Mock provider on {server.url}, working directory {workdir}')
+    reports = []
+    try:
+        for stage in [stage.strip() for stage in args.stages.split(',') if stage.strip()]:
+            if stage not in commands:
+                raise ValueError(f'Unknown stage: {stage}')
+            before = server.snapshot()
+            started = time.time()
+            measured = run_stage(commands[stage], workdir, env)
+            after = server.snapshot()
+            records = load_records(telemetry_path) if os.path.exists(telemetry_path) else None
+            if records is not None and len(records):
+                records = records[(records['stage'] == stage) & (records['time'] >= started)]
+            reports.append(stage_report(stage, measured, records,
+                                        {key: after[key] - before.get(key, 0) for key in after if after[key] != before.get(key, 0)}))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    print_report(reports)
+    if args.report:
+        os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+        with open(args.report, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'time': time.time(), 'args': vars(args), 'stages': reports}, default=str) + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+# Next to this module, so scripts that import it work from any directory
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'exams.json')
+
+# Suffix of the dataset split names, e.g. 'LC003ALP100EV_problems'
+SPLIT_SUFFIX = '_problems'
+
+
+def load_manifest(path: str = MANIFEST_PATH) -> Dict[str, Any]:
+    """
+    Load the exam manifest.
+
+    The manifest lists the dataset splits used for evaluation and, for every exam
+    paper, its marking scheme and the page ranges of each extraction section.
+    Page ranges are half-open: [start, end) page numbers.
+
+    Args:
+        path: Path to the manifest JSON file
+
+    Returns:
+        Manifest dictionary with 'splits' and 'exams' entries
+    """
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def get_splits(path: str = MANIFEST_PATH) -> List[str]:
+    """
+    Get the dataset split names to generate and judge, e.g. 'LC003ALP100EV_problems'.
+
+    Args:
+        path: Path to the manifest JSON file
+
+    Returns:
+        List of split names
+    """
+    return load_manifest(path)['splits']
+
+
+def get_exams(path: str = MANIFEST_PATH, names: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Get the exam entries to extract.
+
+    Args:
+        path: Path to the manifest JSON file
+        names: Only return these exams, or None for all
+
+    Returns:
+        List of exam entries with 'name', 'marking_scheme' and 'sections'
+    """
+    exams = load_manifest(path)['exams']
+    if names is not None:
+        known = {exam['name'] for exam in exams}
+        unknown = [name for name in names if name not in known]
+        if unknown:
+            raise ValueError(f'Exams not in manifest: {", ".join(unknown)}')
+        exams = [exam for exam in exams if exam['name'] in names]
+    return exams
+
+
+def get_subject_names(path: str = MANIFEST_PATH) -> Dict[str, str]:
+    """
+    Get display names for subject codes, e.g. {'LC003': 'Mathematics'}.
+
+    Subjects missing from the manifest's optional 'subject_names' entry are
+    displayed by their code.
+
+    Args:
+        path: Path to the manifest JSON file
+
+    Returns:
+        Dictionary mapping subject code to display name
+    """
+    return load_manifest(path).get('subject_names', {})
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+
+import argparse
+import email.parser
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional, Tuple
+
+CANNED_RESPONSE = 'This is a mock response.\nAnswer: 42\nConfidence: 80%'
+
+_GEMINI_PATH = re.compile(r'/models/([^/:]+):generateContent$')
+_BATCH_PATH = re.compile(r'/batches/([^/]+)$')
+_FILE_CONTENT_PATH = re.compile(r'/files/([^/]+)/content$')
+
+
+def parse_latency(spec: str, rng: random.Random) -> Callable[[], float]:
+    """
+    Build a latency sampler from a spec string.
+
+    Args:
+        spec: 'fixed:S', 'uniform:LOW:HIGH', 'normal:MEAN:SD', 'lognormal:MEDIAN:SIGMA'
+            or 'exponential:MEAN', in seconds
+        rng: Random generator to draw from
+
+    Returns:
+        Function returning a non-negative delay in seconds
+    """
+    name, *values = spec.split(':')
+    try:
+        values = [float(value) for value in values]
+    except ValueError:
+        raise ValueError(f'Invalid latency spec: {spec}')
+    samplers = {
+        'fixed': (1, lambda s: s),
+        'uniform': (2, lambda low, high: rng.uniform(low, high)),
+        'normal': (2, lambda mean, sd: rng.gauss(mean, sd)),
+        'lognormal': (2, lambda median, sigma: median * rng.lognormvariate(0, sigma)),
+        'exponential': (1, lambda mean: rng.expovariate(1 / mean) if mean > 0 else 0.0),
+    }
+    if name not in samplers or len(values) != samplers[name][0]:
+        raise ValueError(f'Invalid latency spec: {spec}')
+    sampler = samplers[name][1]
+    return lambda: max(0.0, sampler(*values))
+
+
+def count_tokens(text: str) -> int:
+    """Approximate the token count of a text, as rate_limiter.estimate_tokens does."""
+    return max(1, len(text) // 4)
+
+
+class MockSettings:
+    """Behaviour of the mock provider."""
+
+    def __init__(self, latency: str = 'fixed:0', token_interval: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, retry_after: float = 1.0, output: str = 'canned',
+                 correct_rate: float = 0.5, seed: Optional[int] = None):
+        """
+        Args:
+            latency: Latency distribution of a response (see `parse_latency`); for
+                streamed responses, the time to the first token
+            token_interval: Seconds between streamed chunks
+            error_rate: Fraction of requests answered with a server error (500/503)
+            rate_limit_rate: Fraction of requests answered with a 429 and Retry-After
+            retry_after: Retry-After seconds sent with injected 429s
+            output: 'canned' for a fixed well-formed answer, 'echo' to return the prompt
+            correct_rate: Fraction of judgements that say 'yes'
+            seed: Random seed, or None for a fresh generator
+        """
+        self.rng = random.Random(seed)
+        self.latency = parse_latency(latency, self.rng)
+        self.token_interval = token_interval
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.output = output
+        self.correct_rate = correct_rate
+
+
+class MockProvider(ThreadingHTTPServer):
+    """
+    Local stand-in for the OpenAI and Gemini APIs.
+
+    Serves OpenAI chat completions (plain and streamed), OpenAI responses
+    (including structured output) and Gemini generateContent, with sampled
+    latency, injected errors and 429s, and canned or echoed outputs. The OpenAI
+    files and batches endpoints are served too: a batch is answered in full when
+    it is first retrieved, without latency or injected errors. Point the clients
+    at it with OPENAI_BASE_URL=http://HOST:PORT/v1 and
+    GEMINI_BASE_URL=http://HOST:PORT. GET /stats returns request counts.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], settings: MockSettings):
+        """
+        Args:
+            address: (host, port) to listen on; port 0 picks a free port
+            settings: Mock behaviour
+        """
+        super().__init__(address, MockHandler)
+        self.settings = settings
+        self.stats = Counter()
+        self.files: Dict[str, bytes] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self.stats[key] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        """Get a copy of the request counts."""
+        with self._lock:
+            return dict(self.stats)
+
+    def draw(self) -> float:
+        with self._lock:
+            return self.settings.rng.random()
+
+    def judgement(self) -> str:
+        correct = 'yes' if self.draw() < self.settings.correct_rate else 'no'
+        return json.dumps({'extracted_final_answer': '42', 'reasoning': 'Mock judgement.',
+                           'correct': correct, 'confidence': '80'})
+
+
+def _openai_text(content: Any) -> Tuple[str, int]:
+    # Text and number of images of an OpenAI message content
+    if isinstance(content, str):
+        return content, 0
+    texts = [part.get('text', '') for part in content if part.get('type') in ('text', 'input_text')]
+    images = sum(1 for part in content if part.get('type') in ('image_url', 'input_image'))
+    return '\n'.join(texts), images
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: MockProvider
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_bytes(self, data: bytes) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = self.path.split('?')[0].rstrip('/')
+        if path == '/stats':
+            self._send_json(200, self.server.snapshot())
+        elif _BATCH_PATH.search(path):
+            self._retrieve_batch(_BATCH_PATH.search(path).group(1))
+        elif _FILE_CONTENT_PATH.search(path) and _FILE_CONTENT_PATH.search(path).group(1) in self.server.files:
+            self._send_bytes(self.server.files[_FILE_CONTENT_PATH.search(path).group(1)])
+        else:
+            self._send_json(404, {'error': {'message': f'Unknown path {self.path}'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        path = self.path.split('?')[0]
+        if path.endswith('/files'):
+            self._upload_file(body)
+            return
+        try:
+            request = json.loads(body or b'{}')
+        except json.JSONDecodeError:
+            self._send_json(400, {'error': {'message': 'Invalid JSON body'}})
+            return
+        if path.endswith('/batches'):
+            self._create_batch(request)
+            return
+        if path.endswith('/chat/completions'):
+            endpoint = 'chat'
+        elif path.endswith('/responses'):
+            endpoint = 'responses'
+        elif _GEMINI_PATH.search(path):
+            endpoint = 'gemini'
+        else:
+            self._send_json(404, {'error': {'message': f'Unknown path {self.path}'}})
+            return
+
+        settings = self.server.settings
+        self.server.count('requests', endpoint)
+        time.sleep(settings.latency())
+        draw = self.server.draw()
+        if draw < settings.rate_limit_rate:
+            self.server.count('rate_limited')
+            self._send_error(endpoint, 429)
+            return
+        if draw < settings.rate_limit_rate + settings.error_rate:
+            self.server.count('errors')
+            self._send_error(endpoint, 503 if endpoint == 'gemini' else 500)
+            return
+
+        if endpoint == 'chat':
+            self._chat(request)
+        elif endpoint == 'responses':
+            self._responses(request)
+        else:
+            self._gemini(request, _GEMINI_PATH.search(path).group(1))
+        self.server.count('ok')
+
+    def _send_error(self, endpoint: str, status: int) -> None:
+        headers = {'Retry-After': f'{self.server.settings.retry_after:g}'} if status == 429 else {}
+        if endpoint == 'gemini':
+            body = {'error': {'code': status, 'message': 'Injected error (mock)',
+                              'status': 'RESOURCE_EXHAUSTED' if status == 429 else 'UNAVAILABLE'}}
+        else:
+            body = {'error': {'message': 'Injected error (mock)', 'param': None,
+                              'type': 'rate_limit_error' if status == 429 else 'server_error',
+                              'code': 'rate_limit_exceeded' if status == 429 else None}}
+        self._send_json(status, body, headers)
+
+    def _output(self, prompt: str) -> str:
+        return prompt if self.server.settings.output == 'echo' and prompt else CANNED_RESPONSE
+
+    def _chat_completion(self, request: Dict[str, Any]) -> Tuple[Dict[str, Any], str, Dict[str, int]]:
+        # Completion body, text and usage of a chat request
+        prompt, images = _openai_text(request['messages'][-1]['content'])
+        text = self._output(prompt)
+        usage = {'prompt_tokens': count_tokens(prompt) + 85 * images, 'completion_tokens': count_tokens(text),
+                 'total_tokens': count_tokens(prompt) + 85 * images + count_tokens(text)}
+        base = {'id': f'chatcmpl-{uuid.uuid4().hex}', 'created': int(time.time()), 'model': request.get('model', 'mock')}
+        completion = {**base, 'object': 'chat.completion', 'usage': usage, 'choices': [{
+            'index': 0, 'finish_reason': 'stop',
+            'message': {'role': 'assistant', 'content': text},
+        }]}
+        return completion, text, usage
+
+    def _chat(self, request: Dict[str, Any]) -> None:
+        completion, text, usage = self._chat_completion(request)
+        if not request.get('stream'):
+            self._send_json(200, completion)
+            return
+        base = {key: completion[key] for key in ('id', 'created', 'model')}
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        chunks = [{'index': 0, 'delta': {'role': 'assistant', 'content': piece}, 'finish_reason': None}
+                  for piece in re.findall(r'\S+\s*|\s+', text)]
+        chunks.append({'index': 0, 'delta': {}, 'finish_reason': 'stop'})
+        events = [{**base, 'object': 'chat.completion.chunk', 'choices': [choice]} for choice in chunks]
+        if (request.get('stream_options') or {}).get('include_usage'):
+            events.append({**base, 'object': 'chat.completion.chunk', 'choices': [], 'usage': usage})
+        try:
+            for event in events:
+                self.wfile.write(f'data: {json.dumps(event)}\n\n'.encode('utf-8'))
+                self.wfile.flush()
+                time.sleep(self.server.settings.token_interval)
+            self.wfile.write(b'data: [DONE]\n\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading early
+            self.server.count('closed_early')
+
+    def _responses(self, request: Dict[str, Any]) -> None:
+        self._send_json(200, self._response_body(request))
+
+    def _response_body(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        items = request.get('input')
+        prompt, images = _openai_text(items[-1]['content']) if isinstance(items, list) else (items or '', 0)
+        structured = ((request.get('text') or {}).get('format') or {}).get('type') == 'json_schema'
+        text = self.server.judgement() if structured else self._output(prompt)
+        input_tokens = count_tokens(prompt) + 85 * images
+        return {
+            'id': f'resp_{uuid.uuid4().hex}', 'object': 'response', 'created_at': int(time.time()),
+            'model': request.get('model', 'mock'), 'status': 'completed', 'parallel_tool_calls': False,
+            'tool_choice': 'auto', 'tools': [],
+            'output': [{'type': 'message', 'id': f'msg_{uuid.uuid4().hex}', 'role': 'assistant', 'status': 'completed',
+                        'content': [{'type': 'output_text', 'text': text, 'annotations': []}]}],
+            'usage': {'input_tokens': input_tokens, 'output_tokens': count_tokens(text),
+                      'total_tokens': input_tokens + count_tokens(text),
+                      'input_tokens_details': {'cached_tokens': 0}, 'output_tokens_details': {'reasoning_tokens': 0}},
+        }
+
+    def _upload_file(self, body: bytes) -> None:
+        # multipart/form-data with a 'file' part and a 'purpose' field
+        message = email.parser.BytesParser().parsebytes(
+            f'Content-Type: {self.headers.get("Content-Type")}\r\n\r\n'.encode('utf-8') + body)
+        fields = {part.get_param('name', header='content-disposition'): part for part in message.get_payload()}
+        if 'file' not in fields:
+            self._send_json(400, {'error': {'message': 'Missing file'}})
+            return
+        data = fields['file'].get_payload(decode=True)
+        file_id = f'file-{uuid.uuid4().hex}'
+        with self.server._lock:
+            self.server.files[file_id] = data
+        self.server.count('files')
+        purpose = fields['purpose'].get_payload(decode=True).decode('utf-8') if 'purpose' in fields else 'batch'
+        self._send_json(200, {'id': file_id, 'object': 'file', 'bytes': len(data), 'created_at': int(time.time()),
+                              'filename': fields['file'].get_filename() or 'upload', 'purpose': purpose,
+                              'status': 'processed'})
+
+    def _create_batch(self, request: Dict[str, Any]) -> None:
+        if request.get('input_file_id') not in self.server.files:
+            self._send_json(404, {'error': {'message': f'Unknown file {request.get("input_file_id")}'}})
+            return
+        batch = {'id': f'batch_{uuid.uuid4().hex}', 'object': 'batch', 'endpoint': request.get('endpoint'),
+                 'input_file_id': request['input_file_id'], 'completion_window': request.get('completion_window', '24h'),
+                 'created_at': int(time.time()), 'status': 'validating', 'output_file_id': None, 'error_file_id': None}
+        with self.server._lock:
+            self.server.batches[batch['id']] = batch
+        self.server.count('batches')
+        self._send_json(200, batch)
+
+    def _retrieve_batch(self, batch_id: str) -> None:
+        batch = self.server.batches.get(batch_id)
+        if batch is None:
+            self._send_json(404, {'error': {'message': f'Unknown batch {batch_id}'}})
+            return
+        if batch['status'] == 'validating':
+            self._run_batch(batch)
+        self._send_json(200, batch)
+
+    def _run_batch(self, batch: Dict[str, Any]) -> None:
+        lines = []
+        total = 0
+        for line in self.server.files[batch['input_file_id']].decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            total += 1
+            if item['url'].endswith('/chat/completions'):
+                body = self._chat_completion(item['body'])[0]
+            else:
+                body = self._response_body(item['body'])
+            lines.append(json.dumps({'id': f'batch_req_{uuid.uuid4().hex}', 'custom_id': item['custom_id'],
+                                     'response': {'status_code': 200, 'request_id': uuid.uuid4().hex, 'body': body},
+                                     'error': None}))
+        output_id = f'file-{uuid.uuid4().hex}'
+        with self.server._lock:
+            self.server.files[output_id] = ''.join(line + '\n' for line in lines).encode('utf-8')
+            batch.update(status='completed', output_file_id=output_id, completed_at=int(time.time()),
+                         request_counts={'total': total, 'completed': total, 'failed': 0})
+
+    def _gemini(self, request: Dict[str, Any], model: str) -> None:
+        parts = [part for content in request.get('contents', []) for part in content.get('parts', [])]
+        prompt = '\n'.join(part['text'] for part in parts if 'text' in part)
+        images = sum(1 for part in parts if 'inlineData' in part or 'fileData' in part)
+        config = request.get('generationConfig') or {}
+        structured = config.get('responseMimeType') == 'application/json'
+        text = self.server.judgement() if structured else self._output(prompt)
+        input_tokens = count_tokens(prompt) + 258 * images
+        self._send_json(200, {
+            'candidates': [{'content': {'role': 'model', 'parts': [{'text': text}]}, 'finishReason': 'STOP', 'index': 0}],
+            'usageMetadata': {'promptTokenCount': input_tokens, 'candidatesTokenCount': count_tokens(text),
+                              'totalTokenCount': input_tokens + count_tokens(text)},
+            'modelVersion': model,
+        })
+
+
+def serve(settings: MockSettings, host: str = '127.0.0.1', port: int = 0) -> MockProvider:
+    """
+    Start a mock provider in a background thread.
+
+    Args:
+        settings: Mock behaviour
+        host: Interface to listen on
+        port: Port to listen on; 0 picks a free port
+
+    Returns:
+        The running server; call `shutdown()` to stop it
+    """
+    server = MockProvider((host, port), settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_mock_arguments(parser) -> None:
+    """
+    Add the mock provider switches to an argument parser.
+
+    Args:
+        parser: argparse.ArgumentParser to extend
+    """
+    parser.add_argument('--latency', type=str, default='lognormal:1.0:0.5',
+                        help="Response latency distribution, e.g. 'fixed:0.5', 'uniform:0.2:2', 'lognormal:1.0:0.5', 'exponential:1'")
+    parser.add_argument('--token_interval', type=float, default=0.01, help='Seconds between streamed chunks')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='Fraction of requests failed with a 500/503')
+    parser.add_argument('--rate_limit_rate', type=float, default=0.0, help='Fraction of requests failed with a 429')
+    parser.add_argument('--retry_after', type=float, default=1.0, help='Retry-After seconds sent with injected 429s')
+    parser.add_argument('--output', type=str, choices=['canned', 'echo'], default='canned',
+                        help='Return a fixed well-formed answer or echo the prompt')
+    parser.add_argument('--correct_rate', type=float, default=0.5, help="Fraction of judgements that say 'yes'")
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for latencies and injected errors')
+
+
+def settings_from_args(args) -> MockSettings:
+    """Build mock settings from parsed command-line switches from `add_mock_arguments`."""
+    return MockSettings(args.latency, args.token_interval, args.error_rate, args.rate_limit_rate,
+                        args.retry_after, args.output, args.correct_rate, args.seed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve a local mock of the OpenAI and Gemini APIs.")
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=8321, help='Port to listen on')
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockProvider((args.host, args.port), settings_from_args(args))
+    print(f'Mock provider on {server.url}')
+    print(f'  OPENAI_BASE_URL={server.url}/v1 GEMINI_BASE_URL={server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, List
+
+from providers import get_registry
+
+if TYPE_CHECKING:
+    from google import genai
+
+# Files API uploads are deleted after 48 hours; stop reusing them an hour before that
+# (or an hour before the expiration_time reported by the API, if earlier)
+FILE_TTL_SECONDS = 47 * 3600
+
+
+def file_sha256(path: str) -> str:
+    """Hash a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PageUploader:
+    """
+    Uploads exam page images to the Gemini Files API and reuses the handles.
+
+    Pages are deduplicated by path and by content hash, uploaded concurrently,
+    and recorded in a JSON registry so that later runs reuse unexpired uploads
+    instead of sending the same page again.
+    """
+
+    def __init__(self, model: str, caller, registry_path: str = 'exam_images/uploaded_files.json', max_workers: int = 8):
+        """
+        Args:
+            model: Gemini model the pages are for; its provider's client is
+                created on the first upload
+            caller: api_retry.APICaller used for each upload
+            registry_path: JSON file recording uploaded handles across runs
+            max_workers: Number of concurrent uploads
+        """
+        self.model = model
+        self.caller = caller
+        self.registry_path = registry_path
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._hash_locks: Dict[str, threading.Lock] = {}
+        self._path_hashes: Dict[str, str] = {}
+        self._registry: Dict[str, dict] = {}
+        if os.path.exists(registry_path):
+            with open(registry_path, encoding='utf-8') as f:
+                self._registry = json.load(f)
+
+    def _save(self) -> None:
+        # Called with self._lock held
+        os.makedirs(os.path.dirname(self.registry_path) or '.', exist_ok=True)
+        tmp_path = f'{self.registry_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._registry, f, indent=2)
+        os.replace(tmp_path, self.registry_path)
+
+    def page_hash(self, path: str) -> str:
+        """
+        Get the content hash of a page, memoized per path.
+
+        Args:
+            path: Image path
+
+        Returns:
+            SHA-256 hex digest of the file
+        """
+        with self._lock:
+            if path in self._path_hashes:
+                return self._path_hashes[path]
+        digest = file_sha256(path)
+        with self._lock:
+            self._path_hashes[path] = digest
+        return digest
+
+    def _upload(self, path: str) -> 'genai.types.Part':
+        from google import genai
+
+        digest = self.page_hash(path)
+        with self._lock:
+            hash_lock = self._hash_locks.setdefault(digest, threading.Lock())
+        # Only one thread uploads a given page; the others wait and reuse its handle
+        with hash_lock:
+            with self._lock:
+                entry = self._registry.get(digest)
+            if entry is None or entry['expires'] < time.time():
+                client = get_registry().resolve(self.model).sync_client
+                my_file = self.caller.call_sync(client.files.upload, file=path)
+                expires = time.time() + FILE_TTL_SECONDS
+                if getattr(my_file, 'expiration_time', None) is not None:
+                    expires = min(expires, my_file.expiration_time.timestamp() - 3600)
+                entry = {
+                    'name': my_file.name,
+                    'uri': my_file.uri,
+                    'mime_type': my_file.mime_type,
+                    'path': path,
+                    'expires': expires,
+                }
+                with self._lock:
+                    self._registry[digest] = entry
+                    self._save()
+        return genai.types.Part.from_uri(file_uri=entry['uri'], mime_type=entry['mime_type'])
+
+    def upload_many(self, paths: List[str]) -> List['genai.types.Part']:
+        """
+        Upload pages concurrently, reusing earlier uploads.
+
+        Args:
+            paths: Image paths, possibly with duplicates
+
+        Returns:
+            File parts in the same order as `paths`
+        """
+        unique_paths = list(dict.fromkeys(paths))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            parts = dict(zip(unique_paths, executor.map(self._upload, unique_paths)))
+        return [parts[path] for path in paths]
@@ -0,0 +1,222 @@
+import importlib.util
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from image_variants import ImagePolicy
+
+PROVIDERS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'providers.json')
+
+PROVIDER_KINDS = ('openai', 'gemini')
+
+# Connections kept per OpenAI-compatible endpoint; requests beyond this wait for a free connection
+MAX_CONNECTIONS = 256
+
+
+class Provider:
+    """
+    One API endpoint and its SDK clients.
+
+    Clients are created on first use, which is also when the SDK is imported, and
+    then shared by every caller in the process. OpenAI-compatible endpoints get one
+    keep-alive connection pool (HTTP/2 when the `h2` package is installed); a
+    genai.Client keeps its own pool.
+    """
+
+    def __init__(self, name: str, kind: str, api_key: Optional[str] = None, api_key_env: Optional[str] = None,
+                 base_url: Optional[str] = None, base_url_env: Optional[str] = None,
+                 max_connections: int = MAX_CONNECTIONS, image_policy: Any = None):
+        """
+        Args:
+            name: Provider name in the registry
+            kind: 'openai' for the OpenAI API or any compatible server, 'gemini' for the Gemini API
+            api_key: API key; takes precedence over `api_key_env`
+            api_key_env: Environment variable holding the API key
+            base_url: Endpoint URL, e.g. 'http://localhost:8000/v1'; takes precedence over `base_url_env`
+            base_url_env: Environment variable holding the endpoint URL
+            max_connections: Size of the connection pool of OpenAI-compatible clients
+            image_policy: How images are resized and recompressed for this provider
+                (see image_variants.ImagePolicy.from_config); None sends originals
+        """
+        if kind not in PROVIDER_KINDS:
+            raise ValueError(f'Unknown provider kind for {name}: {kind}')
+        self.name = name
+        self.kind = kind
+        self.api_key = api_key
+        self.api_key_env = api_key_env
+        self.base_url = base_url
+        self.base_url_env = base_url_env
+        self.max_connections = max_connections
+        self.image_policy = ImagePolicy.from_config(image_policy)
+        self._lock = threading.Lock()
+        self._clients: Dict[str, Any] = {}
+
+    def _setting(self, value: Optional[str], env: Optional[str]) -> Optional[str]:
+        if value is not None:
+            return value
+        return os.environ.get(env) if env else None
+
+    def _http_client(self, asynchronous: bool):
+        import httpx
+        import openai
+
+        limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+        http2 = importlib.util.find_spec('h2') is not None
+        factory = openai.DefaultAsyncHttpxClient if asynchronous else openai.DefaultHttpxClient
+        return factory(limits=limits, http2=http2)
+
+    def _create(self, variant: str):
+        api_key = self._setting(self.api_key, self.api_key_env)
+        base_url = self._setting(self.base_url, self.base_url_env)
+        if self.kind == 'gemini':
+            from google import genai
+
+            http_options = genai.types.HttpOptions(base_url=base_url) if base_url else None
+            return genai.Client(api_key=api_key, http_options=http_options)
+
+        import openai
+
+        cls = openai.AsyncOpenAI if variant == 'async' else openai.OpenAI
+        return cls(api_key=api_key, base_url=base_url, http_client=self._http_client(variant == 'async'))
+
+    def _get(self, variant: str):
+        with self._lock:
+            if variant not in self._clients:
+                self._clients[variant] = self._create(variant)
+            return self._clients[variant]
+
+    @property
+    def client(self):
+        """The asynchronous SDK client: openai.AsyncOpenAI, or genai.Client (use `.aio`) for Gemini."""
+        return self._get('async')
+
+    @property
+    def sync_client(self):
+        """The synchronous SDK client: openai.OpenAI, or genai.Client for Gemini."""
+        return self._get('async' if self.kind == 'gemini' else 'sync')
+
+
+class ProviderRegistry:
+    """
+    Maps model names to providers.
+
+    Models are looked up by exact name, then by the longest matching name
+    prefix. Adding a model or an OpenAI-compatible endpoint is a change to
+    providers.json.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        """
+        Args:
+            config: Dictionary with 'providers' (name -> Provider arguments),
+                'models' (model -> provider name) and optional 'prefixes'
+                (model name prefix -> provider name) entries
+        """
+        self.providers = {name: Provider(name, **settings) for name, settings in config.get('providers', {}).items()}
+        self.models = dict(config.get('models', {}))
+        self.prefixes = dict(config.get('prefixes', {}))
+        for target in list(self.models.values()) + list(self.prefixes.values()):
+            if target not in self.providers:
+                raise ValueError(f'Unknown provider in model registry: {target}')
+
+    @classmethod
+    def from_file(cls, path: str = PROVIDERS_PATH) -> 'ProviderRegistry':
+        """Load a registry from a JSON config file."""
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def add_provider(self, name: str, **settings) -> Provider:
+        """
+        Register a provider, replacing any with the same name.
+
+        Args:
+            name: Provider name
+            **settings: Provider arguments
+
+        Returns:
+            The new provider
+        """
+        self.providers[name] = Provider(name, **settings)
+        return self.providers[name]
+
+    def assign(self, model: str, provider: str) -> None:
+        """Serve a model from a registered provider."""
+        if provider not in self.providers:
+            raise ValueError(f'Unknown provider: {provider}')
+        self.models[model] = provider
+
+    def resolve(self, model: str, fallback: Optional[str] = None, kind: Optional[str] = None) -> Provider:
+        """
+        Find the provider serving a model.
+
+        Args:
+            model: Model name
+            fallback: Provider for models that are not registered, or None to reject them
+            kind: Only consider providers of this kind, e.g. 'openai' for chat completions
+
+        Returns:
+            The provider
+
+        Raises:
+            ValueError: If the model is not registered and there is no fallback
+        """
+        usable = lambda name: kind is None or self.providers[name].kind == kind
+        name = self.models.get(model)
+        if name is None or not usable(name):
+            matches = [prefix for prefix in self.prefixes if model.startswith(prefix) and usable(self.prefixes[prefix])]
+            name = self.prefixes[max(matches, key=len)] if matches else None
+        if name is None:
+            name = fallback
+        if name is None:
+            raise ValueError(f'Unknown model: {model} (add it to {PROVIDERS_PATH})')
+        return self.providers[name]
+
+
+_registry: Optional[ProviderRegistry] = None
+
+
+def get_registry() -> ProviderRegistry:
+    """Get the registry of this process, loading providers.json on first use."""
+    global _registry
+    if _registry is None:
+        _registry = ProviderRegistry.from_file(PROVIDERS_PATH)
+    return _registry
+
+
+def add_provider_arguments(parser) -> None:
+    """
+    Add the shared provider switches to an argument parser.
+
+    Args:
+        parser: argparse.ArgumentParser to extend
+    """
+    parser.add_argument('--providers', type=str, default=PROVIDERS_PATH, help='Provider and model registry (JSON)')
+    parser.add_argument('--base_url', type=str, default=None,
+                        help='Serve the models of this run from this OpenAI-compatible endpoint, e.g. a local inference server')
+    parser.add_argument('--image_policy', type=str, default=None,
+                        help="Image policy for every provider, e.g. 'max_edge=1568,format=webp,quality=85,grayscale=auto' or 'original' (default: per provider in providers.json)")
+
+
+def configure_providers(args, models=()) -> ProviderRegistry:
+    """
+    Apply parsed command-line switches from `add_provider_arguments`.
+
+    Args:
+        args: Parsed arguments
+        models: Models of this run, served from --base_url when it is given
+
+    Returns:
+        The process registry
+    """
+    global _registry
+    _registry = ProviderRegistry.from_file(args.providers)
+    if args.base_url:
+        _registry.add_provider('base_url', kind='openai', base_url=args.base_url, api_key_env='OPENAI_API_KEY')
+        for model in models:
+            _registry.assign(model, 'base_url')
+    if args.image_policy:
+        policy = ImagePolicy.from_config(args.image_policy)
+        for provider in _registry.providers.values():
+            provider.image_policy = policy
+    return _registry
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+from typing import Optional
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter for requests-per-minute and tokens-per-minute budgets.
+
+    Both budgets refill continuously, so a burst of up to one minute's worth of
+    requests is allowed before callers start waiting.
+    """
+
+    def __init__(self, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None):
+        """
+        Args:
+            requests_per_minute: Maximum number of requests per minute, or None for no limit
+            tokens_per_minute: Maximum number of tokens per minute, or None for no limit
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_budget = float(requests_per_minute or 0)
+        self._token_budget = float(tokens_per_minute or 0)
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._sync_lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._request_budget = min(self.requests_per_minute,
+                                       self._request_budget + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._token_budget = min(self.tokens_per_minute,
+                                     self._token_budget + elapsed * self.tokens_per_minute / 60)
+
+    def _wait_time(self, tokens: int) -> float:
+        wait = 0.0
+        if self.requests_per_minute and self._request_budget < 1:
+            wait = max(wait, (1 - self._request_budget) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute and self._token_budget < tokens:
+            wait = max(wait, (tokens - self._token_budget) * 60 / self.tokens_per_minute)
+        return wait
+
+    async def acquire(self, tokens: int = 0) -> None:
+        """
+        Wait until one request and `tokens` tokens fit in the budget, then consume them.
+
+        Args:
+            tokens: Estimated number of tokens the request will use
+        """
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        # Holding the lock while sleeping keeps callers first-come, first-served
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            self._consume(tokens)
+
+    def acquire_sync(self, tokens: int = 0) -> None:
+        """Blocking counterpart of `acquire` for worker threads."""
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        with self._sync_lock:
+            while True:
+                self._refill()
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    break
+                time.sleep(wait)
+            self._consume(tokens)
+
+    def _consume(self, tokens: int) -> None:
+        if self.requests_per_minute:
+            self._request_budget -= 1
+        if self.tokens_per_minute:
+            self._token_budget -= tokens
+
+
+def estimate_tokens(prompt: str, num_images: int = 0, max_output_tokens: int = 0) -> int:
+    """
+    Roughly estimate the tokens a request counts against a tokens-per-minute limit.
+
+    Providers charge the output budget up front, so `max_output_tokens` is included.
+
+    Args:
+        prompt: Text prompt
+        num_images: Number of attached images
+        max_output_tokens: Maximum number of output tokens requested
+
+    Returns:
+        Estimated token count
+    """
+    return len(prompt) // 4 + num_images * 765 + max_output_tokens
@@ -0,0 +1,133 @@
+import json
+import os
+from typing import Dict, Optional, Sequence, Set, Tuple
+
+ERROR_PREFIX = 'Error:'
+
+
+def _truncate_partial_line(path: str) -> None:
+    # Drop a partially written last line from an interrupted run, so the next
+    # append starts on a line of its own instead of being glued onto it
+    with open(path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+
+
+class ResponseStore:
+    """
+    Append-only JSONL log of per-row results keyed by (exam_id, index, model).
+
+    Every finished row is appended as one line, so a crash loses at most the
+    rows still in flight. When a key appears more than once the last record wins,
+    which lets a rerun overwrite earlier failures without rewriting the file.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Path to the JSONL file; created on first append
+        """
+        self.path = path
+        self._records: Dict[Tuple[str, int, str], dict] = {}
+        if os.path.exists(path):
+            _truncate_partial_line(path)
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self._records[(record['exam_id'], record['index'], record['model'])] = record
+
+    def append(self, exam_id: str, index: int, model: str, response: Optional[str], **fields) -> None:
+        """
+        Record the result for one row.
+
+        Error messages are stored with status 'error' and responses cut off by a
+        stream budget (truncated=True) with status 'truncated'; neither counts as
+        completed, so a rerun generates them again.
+
+        Args:
+            exam_id: Dataset split name
+            index: Row index within the split
+            model: Model that produced the response
+            response: Response text, or an 'Error: ...' message on failure
+            **fields: Extra JSON-serializable fields to store with the record
+        """
+        if response is None or response.startswith(ERROR_PREFIX):
+            status = 'error'
+        elif fields.get('truncated'):
+            status = 'truncated'
+        else:
+            status = 'ok'
+        record = {'exam_id': exam_id, 'index': index, 'model': model, 'status': status, 'response': response, **fields}
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._records[(exam_id, index, model)] = record
+
+    def records(self, exam_id: str, model: str) -> Dict[int, dict]:
+        """
+        Get the latest record for every stored row of a split.
+
+        Args:
+            exam_id: Dataset split name
+            model: Model name
+
+        Returns:
+            Dictionary mapping row index to record
+        """
+        return {index: record for (e, index, m), record in self._records.items()
+                if e == exam_id and m == model}
+
+    def image_hashes(self, exam_id: str, model: str) -> Dict[int, Dict[str, Optional[str]]]:
+        """
+        Get the image hashes stored with the records of a split.
+
+        Args:
+            exam_id: Dataset split name
+            model: Model name
+
+        Returns:
+            Dictionary mapping row index to {image column: hash}, for records that have them
+        """
+        return {index: record['images'] for index, record in self.records(exam_id, model).items()
+                if record.get('images') is not None}
+
+    def completed(self, exam_id: str, model: str) -> Set[int]:
+        """
+        Get the indices of rows that already have a successful response.
+
+        Args:
+            exam_id: Dataset split name
+            model: Model name
+
+        Returns:
+            Set of row indices to skip on a rerun
+        """
+        return {index for index, record in self.records(exam_id, model).items()
+                if record['status'] == 'ok'}
+
+    def compact(self, df, exam_id: str, model: str, column: str = 'response', fields: Sequence[str] = ()):
+        """
+        Fill `column` of a split's dataframe from the stored records.
+
+        Rows without a record are left empty.
+
+        Args:
+            df: Dataframe of the split, in dataset row order
+            exam_id: Dataset split name
+            model: Model name
+            column: Column to write responses into
+            fields: Extra record fields to copy into columns of the same name,
+                for splits where at least one record has them
+
+        Returns:
+            The dataframe with `column` filled in
+        """
+        records = self.records(exam_id, model)
+        df[column] = [records[index]['response'] if index in records else None for index in range(len(df))]
+        for field in fields:
+            if any(field in record for record in records.values()):
+                df[field] = [records[index].get(field) if index in records else None for index in range(len(df))]
+        return df
@@ -0,0 +1,179 @@
+import math
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+N_RESAMPLES = 10000
+CONFIDENCE_LEVEL = 0.95
+
+# Upper bound on the number of resampled items held in memory at once
+_MAX_BLOCK_ITEMS = 1 << 22
+
+
+def stratified_bootstrap(values: np.ndarray, strata: np.ndarray, n_resamples: int = N_RESAMPLES,
+                         seed: Optional[int] = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Bootstrap the mean of every stratum, resampling items within their stratum.
+
+    All resamples are drawn as one index matrix (in blocks that bound memory) and
+    the stratum means are taken with a single reduction per block.
+
+    Args:
+        values: Item values, e.g. 1.0/0.0 verdicts
+        strata: Stratum label of each item, e.g. the subject
+        n_resamples: Number of bootstrap resamples
+        seed: Random seed, or None for a fresh generator
+
+    Returns:
+        (labels, means): the sorted stratum labels and a (n_resamples, n_strata)
+        matrix of resampled stratum means
+    """
+    values = np.asarray(values, dtype=np.float64)
+    strata = np.asarray(strata)
+    order = np.argsort(strata, kind='stable')
+    values = values[order]
+    labels, starts, sizes = np.unique(strata[order], return_index=True, return_counts=True)
+    if not len(values):
+        return labels, np.empty((n_resamples, 0))
+
+    # Each position draws uniformly from the items of its own stratum
+    position_starts = np.repeat(starts, sizes)
+    position_sizes = np.repeat(sizes, sizes)
+    rng = np.random.default_rng(seed)
+    block = max(1, _MAX_BLOCK_ITEMS // len(values))
+    means = np.empty((n_resamples, len(labels)))
+    for begin in range(0, n_resamples, block):
+        end = min(begin + block, n_resamples)
+        index = position_starts + (rng.random((end - begin, len(values))) * position_sizes).astype(np.int64)
+        means[begin:end] = np.add.reduceat(values[index], starts, axis=1) / sizes
+    return labels, means
+
+
+def percentile_interval(samples: np.ndarray, confidence: float = CONFIDENCE_LEVEL) -> Tuple[np.ndarray, np.ndarray]:
+    """Get the percentile interval of bootstrap samples along the first axis."""
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(samples, [tail, 100 - tail], axis=0)
+    return low, high
+
+
+def mcnemar_exact(only_first: int, only_second: int) -> float:
+    """
+    Two-sided exact McNemar test on the discordant pairs of a paired comparison.
+
+    Args:
+        only_first: Pairs where only the first condition is correct
+        only_second: Pairs where only the second condition is correct
+
+    Returns:
+        p-value
+    """
+    n = only_first + only_second
+    if n == 0:
+        return 1.0
+    tail = sum(math.comb(n, k) for k in range(min(only_first, only_second) + 1))
+    return min(1.0, 2 * tail / 2 ** n)
+
+
+def _judged(df: pd.DataFrame) -> pd.DataFrame:
+    df = df[df['status'] == 'ok']
+    return df.assign(correct=df['correct'].astype(np.float64))
+
+
+def bootstrap_scores(df: pd.DataFrame, n_resamples: int = N_RESAMPLES, confidence: float = CONFIDENCE_LEVEL,
+                     seed: Optional[int] = 0) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Bootstrap confidence intervals of subject and language scores.
+
+    Items are resampled within their subject. A language score is the mean of its
+    subject scores, as reported by run_analysis.py, and its interval comes from
+    the same resamples.
+
+    Args:
+        df: Decoded judgements (get_results.load_judgements or ResultsWarehouse.judgements)
+        n_resamples: Number of bootstrap resamples
+        confidence: Confidence level of the intervals
+        seed: Random seed
+
+    Returns:
+        (subject_intervals, language_intervals): frames indexed by
+        (model, judge_model, subject, language) and (model, judge_model, language),
+        with 'accuracy', 'low' and 'high' columns in percent
+    """
+    subject_rows = []
+    language_rows = []
+    for (model, judge_model), group in _judged(df).groupby(['model', 'judge_model'], observed=True):
+        subjects, means = stratified_bootstrap(group['correct'].to_numpy(), group['subject'].astype(str).to_numpy(),
+                                               n_resamples, seed)
+        by_subject = group.groupby(group['subject'].astype(str)).agg(correct=('correct', 'mean'), language=('language', 'first'))
+        observed = by_subject['correct'].reindex(subjects).to_numpy()
+        languages = by_subject['language'].astype(str).reindex(subjects).to_numpy()
+        low, high = percentile_interval(means, confidence)
+        for i, subject in enumerate(subjects):
+            subject_rows.append((model, judge_model, subject, languages[i], observed[i] * 100, low[i] * 100, high[i] * 100))
+        for language in np.unique(languages):
+            columns = languages == language
+            language_low, language_high = percentile_interval(means[:, columns].mean(axis=1), confidence)
+            language_rows.append((model, judge_model, language, observed[columns].mean() * 100,
+                                  language_low * 100, language_high * 100))
+
+    subject_intervals = pd.DataFrame(subject_rows, columns=['model', 'judge_model', 'subject', 'language', 'accuracy', 'low', 'high'])
+    language_intervals = pd.DataFrame(language_rows, columns=['model', 'judge_model', 'language', 'accuracy', 'low', 'high'])
+    return (subject_intervals.set_index(['model', 'judge_model', 'subject', 'language']),
+            language_intervals.set_index(['model', 'judge_model', 'language']))
+
+
+def pair_items(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Match the parallel English and Irish items of each exam.
+
+    Row i of an English-version split and row i of the Irish-version split of the
+    same paper are the same question.
+
+    Args:
+        df: Decoded judgements
+
+    Returns:
+        Frame with 'model', 'judge_model', 'exam', 'row', 'English' and 'Irish'
+        verdicts, for items judged in both languages
+    """
+    judged = _judged(df)
+    judged = judged.assign(exam=judged['subject'].astype(str).str[:-2], language=judged['language'].astype(str))
+    pairs = judged.pivot_table(index=['model', 'judge_model', 'exam', 'row'], columns='language',
+                               values='correct', observed=True)
+    return pairs.reindex(columns=['English', 'Irish']).dropna().reset_index()
+
+
+def paired_language_test(df: pd.DataFrame, n_resamples: int = N_RESAMPLES, confidence: float = CONFIDENCE_LEVEL,
+                         seed: Optional[int] = 0) -> pd.DataFrame:
+    """
+    Test whether English and Irish scores differ on the parallel items.
+
+    The gap is the mean over exams of the per-exam English minus Irish accuracy.
+    Its interval comes from a paired bootstrap that resamples items within each
+    exam, and the p-value from an exact McNemar test on the discordant pairs.
+
+    Args:
+        df: Decoded judgements
+        n_resamples: Number of bootstrap resamples
+        confidence: Confidence level of the interval
+        seed: Random seed
+
+    Returns:
+        Frame indexed by (model, judge_model) with 'pairs', 'English', 'Irish',
+        'gap', 'low', 'high' (percent / percentage points), 'english_only',
+        'irish_only' and 'p_value'
+    """
+    rows = []
+    for (model, judge_model), group in pair_items(df).groupby(['model', 'judge_model'], observed=True):
+        difference = (group['English'] - group['Irish']).to_numpy()
+        _, means = stratified_bootstrap(difference, group['exam'].to_numpy(), n_resamples, seed)
+        low, high = percentile_interval(means.mean(axis=1), confidence)
+        by_exam = group.groupby('exam')[['English', 'Irish']].mean()
+        english_only = int(((group['English'] == 1) & (group['Irish'] == 0)).sum())
+        irish_only = int(((group['English'] == 0) & (group['Irish'] == 1)).sum())
+        rows.append((model, judge_model, len(group), by_exam['English'].mean() * 100, by_exam['Irish'].mean() * 100,
+                     (by_exam['English'] - by_exam['Irish']).mean() * 100, low * 100, high * 100,
+                     english_only, irish_only, mcnemar_exact(english_only, irish_only)))
+    return pd.DataFrame(rows, columns=['model', 'judge_model', 'pairs', 'English', 'Irish', 'gap', 'low', 'high',
+                                       'english_only', 'irish_only', 'p_value']).set_index(['model', 'judge_model'])
@@ -0,0 +1,94 @@
+import os
+from typing import List, Optional
+
+import pandas as pd
+
+RESULT_FORMATS = ['parquet', 'csv']
+
+# Free-text columns that should always be stored as strings, even when a split is all empty
+TEXT_COLUMNS = ['problem', 'answer', 'response', 'judgement']
+
+
+def write_results(df: pd.DataFrame, base_path: str, fmt: str = 'parquet') -> str:
+    """
+    Write a response or judgement frame.
+
+    A file of the same result in the other format is removed, so a stale copy is
+    never read back in place of the new one.
+
+    Args:
+        df: Frame to write
+        base_path: Output path without extension, e.g. 'responses/{EXAM_ID}_{MODEL}'
+        fmt: 'parquet' or 'csv'
+
+    Returns:
+        Path of the written file
+    """
+    if fmt not in RESULT_FORMATS:
+        raise ValueError(f'Unknown result format: {fmt}')
+    path = f'{base_path}.{fmt}'
+    tmp_path = f'{path}.tmp'
+    if fmt == 'parquet':
+        df = df.copy()
+        for column in TEXT_COLUMNS:
+            if column in df.columns:
+                df[column] = df[column].astype('string')
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    for other in RESULT_FORMATS:
+        if other != fmt and os.path.exists(f'{base_path}.{other}'):
+            os.remove(f'{base_path}.{other}')
+    return path
+
+
+def find_results_file(base_path: str) -> Optional[str]:
+    """
+    Locate a result file.
+
+    If both formats exist, e.g. after switching --output_format, the most recently
+    written file wins; Parquet wins a tie.
+
+    Args:
+        base_path: Path without extension
+
+    Returns:
+        Path of the existing file, or None if there is none
+    """
+    paths = [f'{base_path}.{fmt}' for fmt in RESULT_FORMATS if os.path.exists(f'{base_path}.{fmt}')]
+    if not paths:
+        return None
+    return max(paths, key=os.path.getmtime)
+
+
+def read_results(path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Read a response or judgement file written as Parquet or CSV.
+
+    Args:
+        path: Path with or without extension; without one, see find_results_file
+        columns: Only load these columns (e.g. ['judgement']), or None for all
+
+    Returns:
+        The loaded frame
+    """
+    if not path.endswith(tuple(f'.{fmt}' for fmt in RESULT_FORMATS)):
+        found = find_results_file(path)
+        if found is None:
+            raise FileNotFoundError(f'No Parquet or CSV results found for {path}')
+        path = found
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, usecols=columns)
+
+
+def add_format_argument(parser) -> None:
+    """
+    Add the shared --output_format switch to an argument parser.
+
+    Args:
+        parser: argparse.ArgumentParser to extend
+    """
+    parser.add_argument('--output_format', choices=RESULT_FORMATS, default='parquet',
+                        help='File format for the written results')
@@ -0,0 +1,289 @@
+import glob
+import hashlib
+import os
+import sqlite3
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from get_results import LANGUAGES, decode_judgements
+from manifest import SPLIT_SUFFIX
+from results_io import RESULT_FORMATS, find_results_file, read_results
+
+DEFAULT_WAREHOUSE_PATH = 'cache/results.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    student_model TEXT NOT NULL,
+    judge_model TEXT,
+    exam_id TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS responses (
+    file TEXT NOT NULL,
+    student_model TEXT NOT NULL,
+    exam_id TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    language TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    response TEXT
+);
+CREATE INDEX IF NOT EXISTS responses_key ON responses (student_model, exam_id, subject, language, row);
+CREATE INDEX IF NOT EXISTS responses_file ON responses (file);
+CREATE TABLE IF NOT EXISTS judgements (
+    file TEXT NOT NULL,
+    student_model TEXT NOT NULL,
+    judge_model TEXT NOT NULL,
+    exam_id TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    language TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    correct REAL,
+    confidence REAL
+);
+CREATE INDEX IF NOT EXISTS judgements_key ON judgements (student_model, judge_model, exam_id, subject, language);
+CREATE INDEX IF NOT EXISTS judgements_file ON judgements (file);
+'''
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_result_name(path: str) -> Optional[Tuple[str, str, Optional[str]]]:
+    """
+    Read the split, student model and judge model from a result file name.
+
+    Args:
+        path: 'responses/{EXAM_ID}_{MODEL}.parquet' or
+            'judgements/{EXAM_ID}_{MODEL}_judge_model_{JUDGE_MODEL}.parquet'
+
+    Returns:
+        (exam_id, student_model, judge_model or None), or None for other files
+    """
+    name, _ = os.path.splitext(os.path.basename(path))
+    subject, sep, rest = name.partition(SPLIT_SUFFIX + '_')
+    if not sep or not subject:
+        return None
+    model, sep, judge_model = rest.rpartition('_judge_model_')
+    if not sep:
+        # Kept as in the file name ('org--model'), which is also how generate_judgement.py names the student
+        return subject + SPLIT_SUFFIX, rest, None
+    return subject + SPLIT_SUFFIX, model, judge_model
+
+
+def _in_clause(column: str, values: Optional[Sequence[str]]) -> Tuple[str, List[str]]:
+    if not values:
+        return '', []
+    return f' AND {column} IN ({",".join("?" * len(values))})', list(values)
+
+
+class ResultsWarehouse:
+    """
+    Local SQLite database of every response and judgement file.
+
+    `ingest` loads the result directories incrementally: files whose size and
+    mtime are unchanged are skipped, and files that were touched but still have
+    the same content hash are not reloaded. Judgements are stored decoded (see
+    get_results.decode_judgements), indexed on (student_model, judge_model,
+    exam_id, subject, language), so analyses and plots query one table instead
+    of re-reading every file.
+    """
+
+    def __init__(self, path: str = DEFAULT_WAREHOUSE_PATH):
+        """
+        Args:
+            path: Path to the SQLite database file
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _result_files(self, directory: str) -> List[str]:
+        # One file per result; when both formats exist, find_results_file picks the newer one
+        base_paths = {os.path.splitext(path)[0] for fmt in RESULT_FORMATS
+                      for path in glob.glob(os.path.join(directory, f'*{SPLIT_SUFFIX}_*.{fmt}'))}
+        return sorted(find_results_file(base_path) for base_path in base_paths)
+
+    def ingest(self, judgements_dir: str = 'judgements', responses_dir: str = 'responses') -> Dict[str, int]:
+        """
+        Load new and changed result files, and drop the rows of deleted ones.
+
+        Args:
+            judgements_dir: Directory containing judgements
+            responses_dir: Directory containing responses
+
+        Returns:
+            Counts of 'loaded', 'unchanged' and 'removed' files
+        """
+        counts = {'loaded': 0, 'unchanged': 0, 'removed': 0}
+        known = {path: (mtime, size, sha256) for path, mtime, size, sha256
+                 in self.conn.execute('SELECT path, mtime, size, sha256 FROM files')}
+        seen = set()
+
+        for kind, directory in (('judgement', judgements_dir), ('response', responses_dir)):
+            for path in self._result_files(directory):
+                parsed = parse_result_name(path)
+                if parsed is None or (parsed[2] is None) != (kind == 'response'):
+                    continue
+                seen.add(path)
+                stat = os.stat(path)
+                previous = known.get(path)
+                if previous is not None and previous[:2] == (stat.st_mtime, stat.st_size):
+                    counts['unchanged'] += 1
+                    continue
+                sha256 = _file_sha256(path)
+                if previous is not None and previous[2] == sha256:
+                    self.conn.execute('UPDATE files SET mtime = ?, size = ? WHERE path = ?',
+                                      (stat.st_mtime, stat.st_size, path))
+                    counts['unchanged'] += 1
+                    continue
+                self._load(path, kind, *parsed, stat.st_mtime, stat.st_size, sha256)
+                counts['loaded'] += 1
+
+        for path in set(known) - seen:
+            self._delete(path)
+            counts['removed'] += 1
+        self.conn.commit()
+        return counts
+
+    def _delete(self, path: str) -> None:
+        self.conn.execute('DELETE FROM responses WHERE file = ?', (path,))
+        self.conn.execute('DELETE FROM judgements WHERE file = ?', (path,))
+        self.conn.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def _load(self, path: str, kind: str, exam_id: str, student_model: str, judge_model: Optional[str],
+              mtime: float, size: int, sha256: str) -> None:
+        self._delete(path)
+        subject = exam_id[:-len(SPLIT_SUFFIX)]
+        language = LANGUAGES.get(subject[-2:], subject[-2:])
+        if kind == 'judgement':
+            df = decode_judgements(read_results(path, columns=['judgement'])['judgement'])
+            df['row'] = np.arange(len(df))
+            self.conn.executemany(
+                'INSERT INTO judgements (file, student_model, judge_model, exam_id, subject, language, row, status, correct, confidence) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(path, student_model, judge_model, exam_id, subject, language, int(row), status,
+                  None if pd.isna(correct) else float(correct), None if pd.isna(confidence) else float(confidence))
+                 for row, status, correct, confidence in zip(df['row'], df['status'].astype(str), df['correct'], df['confidence'])],
+            )
+        else:
+            responses = read_results(path, columns=['response'])['response']
+            self.conn.executemany(
+                'INSERT INTO responses (file, student_model, exam_id, subject, language, row, response) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(path, student_model, exam_id, subject, language, row, None if pd.isna(response) else str(response))
+                 for row, response in enumerate(responses)],
+            )
+        self.conn.execute('INSERT INTO files (path, kind, student_model, judge_model, exam_id, mtime, size, sha256) '
+                          'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                          (path, kind, student_model, judge_model, exam_id, mtime, size, sha256))
+
+    def query(self, sql: str, params: Sequence = ()) -> pd.DataFrame:
+        """Run a SQL query against the warehouse and return the result as a frame."""
+        return pd.read_sql_query(sql, self.conn, params=list(params))
+
+    def models(self, judge_model: Optional[str] = None) -> List[str]:
+        """List the student models with judgements, optionally only those judged by `judge_model`."""
+        where, params = _in_clause('judge_model', [judge_model] if judge_model else None)
+        return self.query(f'SELECT DISTINCT student_model FROM judgements WHERE 1 = 1{where} ORDER BY student_model',
+                          params)['student_model'].tolist()
+
+    def judgements(self, models: Optional[Sequence[str]] = None, judge_models: Optional[Sequence[str]] = None,
+                   subjects: Optional[Sequence[str]] = None, with_responses: bool = False) -> pd.DataFrame:
+        """
+        Get decoded judgements in the layout of get_results.load_judgements.
+
+        Args:
+            models: Student models to include, or None for all
+            judge_models: Judge models to include, or None for all
+            subjects: Subjects to include (e.g. 'LC003ALP100EV'), or None for all
+            with_responses: Also return the judged 'response' text
+
+        Returns:
+            Frame with 'model', 'judge_model', 'subject', 'language', 'row',
+            'status', 'correct' and 'confidence' columns
+        """
+        sql = ('SELECT j.student_model AS model, j.judge_model, j.subject, j.language, j.row, j.status, j.correct, j.confidence'
+               + (', r.response' if with_responses else '') + ' FROM judgements j')
+        if with_responses:
+            sql += (' LEFT JOIN responses r ON r.student_model = j.student_model AND r.exam_id = j.exam_id'
+                    ' AND r.row = j.row')
+        sql += ' WHERE 1 = 1'
+        params = []
+        for column, values in (('j.student_model', models), ('j.judge_model', judge_models), ('j.subject', subjects)):
+            clause, values = _in_clause(column, values)
+            sql += clause
+            params += values
+        df = self.query(sql, params)
+        for column in ['model', 'judge_model', 'subject', 'language']:
+            df[column] = df[column].astype('category')
+        df['status'] = df['status'].astype('category')
+        return df
+
+    def subject_scores(self, models: Optional[Sequence[str]] = None,
+                       judge_models: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """
+        Score every (model, judge, subject, language) in a single query.
+
+        Args:
+            models: Student models to include, or None for all
+            judge_models: Judge models to include, or None for all
+
+        Returns:
+            Frame indexed by (model, judge_model, subject, language) with
+            'accuracy', 'confidence' (percent), 'judged' and per-status counts
+        """
+        sql = '''SELECT student_model AS model, judge_model, subject, language,
+                        AVG(correct) * 100 AS accuracy,
+                        AVG(CASE WHEN status = 'ok' THEN confidence END) AS confidence,
+                        SUM(status = 'ok') AS judged,
+                        SUM(status = 'skipped') AS skipped,
+                        SUM(status = 'error') AS error,
+                        SUM(status = 'invalid') AS invalid,
+                        SUM(status = 'missing') AS missing
+                 FROM judgements WHERE 1 = 1'''
+        params = []
+        for column, values in (('student_model', models), ('judge_model', judge_models)):
+            clause, values = _in_clause(column, values)
+            sql += clause
+            params += values
+        sql += ' GROUP BY student_model, judge_model, subject, language'
+        return self.query(sql, params).set_index(['model', 'judge_model', 'subject', 'language'])
+
+    def comparison_table(self, judge_model: str, language: Optional[str] = None,
+                         metric: str = 'accuracy') -> pd.DataFrame:
+        """
+        Compare models side by side.
+
+        Args:
+            judge_model: Judge model
+            language: 'English' or 'Irish', or None for both
+            metric: Column of `subject_scores` to compare
+
+        Returns:
+            Frame with one row per subject (and language) and one column per model
+        """
+        scores = self.subject_scores(judge_models=[judge_model]).reset_index()
+        if language is not None:
+            scores = scores[scores['language'] == language]
+        return scores.pivot_table(index=['subject', 'language'], columns='model', values=metric)
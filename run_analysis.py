@@ -3,78 +3,93 @@
 import os
 import argparse
 from get_results import (
-    get_results_from_judgements, 
-    calculate_language_fidelity, 
+    calculate_language_fidelity,
     name_mappings
 )
+from result_statistics import N_RESAMPLES, bootstrap_scores, paired_language_test
+from results_warehouse import DEFAULT_WAREHOUSE_PATH, ResultsWarehouse
 
 def main() -> None:
     """Main function to run analysis and generate visualizations."""
     parser = argparse.ArgumentParser(description="Run analysis on Leaving Certificate results.")
-    parser.add_argument("--model", default="gemini-2.0-flash", help="Model to analyze")
-    parser.add_argument("--judge-model", default="gemini-2.5-flash-preview-04-17", help="Judge model")
+    parser.add_argument("--model", default="gemini-2.0-flash", help="Model to analyze (comma-separated for several)")
+    parser.add_argument("--judge-model", default="gemini-2.5-flash-preview-04-17", help="Judge model (comma-separated for several)")
     parser.add_argument("--judgements-dir", default="judgements", help="Directory containing judgements")
     parser.add_argument("--responses-dir", default="responses", help="Directory containing responses")
     parser.add_argument("--output-dir", default="output", help="Directory to save outputs")
+    parser.add_argument("--warehouse", default=DEFAULT_WAREHOUSE_PATH, help="Results database, updated from the result directories")
+    parser.add_argument("--resamples", type=int, default=N_RESAMPLES, help="Bootstrap resamples for confidence intervals")
+    parser.add_argument("--workers", type=int, default=1, help="Processes used for language detection across models")
     
     args = parser.parse_args()
+    models = args.model.split(',')
+    judge_models = args.judge_model.split(',')
     
     # Create output directory if it doesn't exist
     os.makedirs(args.output_dir, exist_ok=True)
     
-    print(f"Analyzing model: {args.model}")
+    print(f"Analyzing models: {', '.join(models)}")
 
     # Get list of subjects
     subjects = list(name_mappings.keys())
 
-    # Get results from judgements
+    # Load new and changed result files, then score everything in one query
     print(f"Getting results from judgements for {len(subjects)} subjects...")
-    results, lang_fidelity, confidences, correct_irish, incorrect_irish, both = get_results_from_judgements(
-        subjects=subjects,
-        model=args.model,
-        judge_model=args.judge_model,
-        judgements_dir=args.judgements_dir
-    )
+    with ResultsWarehouse(args.warehouse) as warehouse:
+        counts = warehouse.ingest(args.judgements_dir, args.responses_dir)
+        print(f"Loaded {counts['loaded']} new or changed result files ({counts['unchanged']} unchanged)")
+        subject_scores = warehouse.subject_scores(models, judge_models)
+        judgements = warehouse.judgements(models, judge_models, subjects)
+    subject_scores = subject_scores[subject_scores.index.get_level_values('subject').isin(subjects)]
+    averages = subject_scores.groupby(level=['model', 'judge_model', 'language'])[['accuracy', 'confidence']].mean()
+
+    # Bootstrap confidence intervals and the paired English-Irish test
+    subject_intervals, language_intervals = bootstrap_scores(judgements, n_resamples=args.resamples)
+    language_gaps = paired_language_test(judgements, n_resamples=args.resamples)
+    subject_scores = subject_scores.join(subject_intervals[['low', 'high']])
+    averages = averages.join(language_intervals[['low', 'high']])
+    subject_scores.to_csv(os.path.join(args.output_dir, 'subject_scores.csv'))
+    averages.to_csv(os.path.join(args.output_dir, 'language_scores.csv'))
+    language_gaps.to_csv(os.path.join(args.output_dir, 'language_gaps.csv'))
     
     # Calculate language fidelity
     print("Calculating language fidelity...")
     language_fidelity = calculate_language_fidelity(
         subjects=subjects,
-        models=[args.model],
-        responses_dir=args.responses_dir
+        models=models,
+        responses_dir=args.responses_dir,
+        workers=args.workers
     )
     
     # Display summary
-    print("\n--- Summary ---")
-    print(f"Model: {args.model}")
-    
-    english_subjects = [s for s in subjects if s.endswith('EV')]
-    irish_subjects = [s for s in subjects if s.endswith('IV')]
-    
-    english_score = 0
-    english_count = 0
-    irish_score = 0
-    irish_count = 0
-    
-    for subject in english_subjects:
-        if subject in results and len(results[subject]) > 0:
-            score = sum(results[subject]) / len(results[subject]) * 100
-            english_score += score
-            english_count += 1
-            print(f"{name_mappings[subject]}: {score:.2f}%")
-    
-    print("\n")
-    
-    for subject in irish_subjects:
-        if subject in results and len(results[subject]) > 0:
-            score = sum(results[subject]) / len(results[subject]) * 100
-            irish_score += score
-            irish_count += 1
-            print(f"{name_mappings[subject]}: {score:.2f}%")
+    for (model, judge_model), scores in subject_scores.groupby(level=['model', 'judge_model']):
+        print("\n--- Summary ---")
+        print(f"Model: {model} (judged by {judge_model})")
+        
+        for language in ['English', 'Irish']:
+            if language not in scores.index.get_level_values('language'):
+                continue
+            for (_, _, subject, _), row in scores.xs(language, level='language', drop_level=False).iterrows():
+                print(f"{name_mappings[subject]} ({subject}): {row['accuracy']:.2f}% [{row['low']:.2f}, {row['high']:.2f}]")
+            print("\n")
+        
+        print("Average scores:")
+        for language in ['English', 'Irish']:
+            key = (model, judge_model, language)
+            if key in averages.index:
+                print(f"{language}: {averages.loc[key, 'accuracy']:.2f}% [{averages.loc[key, 'low']:.2f}, {averages.loc[key, 'high']:.2f}]")
+            else:
+                print(f"{language}: {0:.2f}%")
+        
+        if (model, judge_model) in language_gaps.index:
+            gap = language_gaps.loc[(model, judge_model)]
+            print(f"English - Irish on {int(gap['pairs'])} parallel items: {gap['gap']:.2f} points "
+                  f"[{gap['low']:.2f}, {gap['high']:.2f}], McNemar p = {gap['p_value']:.4f}")
     
-    print("\nAverage scores:")
-    print(f"English: {english_score/english_count if english_count else 0:.2f}%")
-    print(f"Irish: {irish_score/irish_count if irish_count else 0:.2f}%")
+    print("\nLanguage fidelity (Irish-version responses written in Irish):")
+    for model, fidelity in language_fidelity.items():
+        average = sum(fidelity.values()) / len(fidelity) if fidelity else 0
+        print(f"{model}: {average:.2f}%")
 
 if __name__ == "__main__":
     main()
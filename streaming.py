@@ -0,0 +1,130 @@
+import asyncio
+import re
+import time
+from typing import Any, Dict, Optional, Tuple
+
+# The response format asked for by generate_response.build_request is complete
+# once a percentage follows 'Confidence:' after an 'Answer:' line
+FORMAT_COMPLETE = re.compile(r'^\W*Answer\W*:.*^\W*Confidence\W*:\W*\d+(?:\.\d+)?\s*%', re.S | re.M | re.I)
+
+# Stop reasons that mean the response was cut short
+TRUNCATED_REASONS = {'max_tokens', 'max_seconds', 'length'}
+
+
+class StreamSettings:
+    """Streaming switches for response generation."""
+
+    def __init__(self, enabled: bool = False, max_tokens: Optional[int] = None, max_seconds: Optional[float] = None,
+                 stop_on_format: bool = True):
+        """
+        Args:
+            enabled: Stream responses instead of waiting for the full completion
+            max_tokens: Stop after this many streamed output tokens
+            max_seconds: Stop once the request has run this long
+            stop_on_format: Stop as soon as the Answer/Confidence lines are complete
+        """
+        self.enabled = enabled
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+        self.stop_on_format = stop_on_format
+
+    def cache_config(self) -> Dict[str, Any]:
+        """Settings that change the returned text, for the response cache key."""
+        return {'stop_on_format': self.stop_on_format}
+
+
+async def consume_stream(stream, settings: StreamSettings, started: float) -> Tuple[str, Dict[str, Any], Any]:
+    """
+    Read a chat-completions stream incrementally and stop early when allowed.
+
+    Output tokens are counted as content chunks while streaming, which is what
+    the budget applies to; the exact count from the final usage chunk is
+    returned when the stream runs to its end.
+
+    Args:
+        stream: openai AsyncStream of chat completion chunks
+        settings: Stop rules
+        started: time.perf_counter() value when the request was sent
+
+    Returns:
+        (text, fields, usage): the streamed text; 'ttft' (seconds to the first
+        token), 'tokens_per_second', 'output_tokens', 'stop_reason' and
+        'truncated'; and the usage object if the stream reported one
+    """
+    parts = []
+    tokens = 0
+    first_token = None
+    stop_reason = None
+    usage = None
+    iterator = stream.__aiter__()
+    while True:
+        timeout = None
+        if settings.max_seconds is not None:
+            timeout = settings.max_seconds - (time.perf_counter() - started)
+            if timeout <= 0:
+                stop_reason = 'max_seconds'
+                break
+        try:
+            chunk = await asyncio.wait_for(iterator.__anext__(), timeout)
+        except StopAsyncIteration:
+            break
+        except asyncio.TimeoutError:
+            stop_reason = 'max_seconds'
+            break
+        if getattr(chunk, 'usage', None) is not None:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        if choice.delta is not None and choice.delta.content:
+            if first_token is None:
+                first_token = time.perf_counter()
+            parts.append(choice.delta.content)
+            tokens += 1
+        if choice.finish_reason is not None:
+            stop_reason = choice.finish_reason
+            continue
+        if settings.max_tokens is not None and tokens >= settings.max_tokens:
+            stop_reason = 'max_tokens'
+            break
+        # The format can only become complete on a chunk carrying the final '%', so the
+        # text is only joined and searched then rather than once per chunk
+        if settings.stop_on_format and choice.delta is not None and choice.delta.content \
+                and '%' in choice.delta.content and FORMAT_COMPLETE.search(''.join(parts)):
+            stop_reason = 'format'
+            break
+
+    finished = time.perf_counter()
+    if usage is not None and getattr(usage, 'completion_tokens', None):
+        tokens = usage.completion_tokens
+    generating = finished - first_token if first_token is not None else 0
+    fields = {
+        'ttft': first_token - started if first_token is not None else None,
+        'tokens_per_second': tokens / generating if generating > 0 else None,
+        'output_tokens': tokens,
+        'stop_reason': stop_reason,
+        'truncated': stop_reason in TRUNCATED_REASONS,
+    }
+    return ''.join(parts), fields, usage
+
+
+def add_stream_arguments(parser) -> None:
+    """
+    Add the streaming switches to an argument parser.
+
+    Args:
+        parser: argparse.ArgumentParser to extend
+    """
+    parser.add_argument('--stream', action='store_true', help='Stream responses and record time-to-first-token')
+    parser.add_argument('--max_stream_tokens', type=int, default=None, help='With --stream, stop after this many output tokens')
+    parser.add_argument('--max_stream_seconds', type=float, default=None, help='With --stream, stop a request after this many seconds')
+    parser.add_argument('--no-stop-on-format', dest='stop_on_format', action='store_false',
+                        help='With --stream, keep reading after the Answer/Confidence lines are complete')
+
+
+def configure_streaming(settings: StreamSettings, args) -> None:
+    """Apply parsed command-line switches from `add_stream_arguments`."""
+    settings.enabled = args.stream
+    settings.max_tokens = args.max_stream_tokens
+    settings.max_seconds = args.max_stream_seconds
+    settings.stop_on_format = args.stop_on_format
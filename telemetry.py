@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextvars
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+DEFAULT_TELEMETRY_PATH = 'telemetry/calls.jsonl'
+
+# List prices in USD per million (input, output) tokens. Reasoning/thinking tokens
+# are billed as output. Edit to match your account; unknown models get no cost.
+PRICES = {
+    'gpt-4.1': (2.00, 8.00),
+    'gpt-4.1-mini': (0.40, 1.60),
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4o-mini': (0.15, 0.60),
+    'o4-mini': (1.10, 4.40),
+    'gemini-2.0-flash': (0.10, 0.40),
+    'gemini-2.5-flash': (0.30, 2.50),
+    'gemini-2.5-pro': (1.25, 10.00),
+}
+
+# The record of the API call in progress and the labels (e.g. exam_id) of the current task
+_current_call: contextvars.ContextVar = contextvars.ContextVar('telemetry_call', default=None)
+_labels: contextvars.ContextVar = contextvars.ContextVar('telemetry_labels', default={})
+
+
+def price_for(model: str) -> Optional[tuple]:
+    """
+    Look up the token prices of a model.
+
+    Dated snapshots (e.g. 'o4-mini-2025-04-16') and previews use the price of the
+    longest matching prefix.
+
+    Args:
+        model: Model name
+
+    Returns:
+        (input, output) USD per million tokens, or None if unknown
+    """
+    matches = [name for name in PRICES if model == name or model.startswith(name + '-')]
+    return PRICES[max(matches, key=len)] if matches else None
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> Optional[float]:
+    """Estimate the cost of a call in USD, or None for models without a price."""
+    price = price_for(model)
+    if price is None:
+        return None
+    return (input_tokens * price[0] + output_tokens * price[1]) / 1_000_000
+
+
+def set_labels(**labels) -> None:
+    """
+    Attach labels (e.g. exam_id) to every call made from the current task and the tasks it starts.
+
+    Args:
+        **labels: JSON-serializable values
+    """
+    _labels.set({**_labels.get(), **labels})
+
+
+def annotate(**fields) -> None:
+    """Add fields to the record of the API call in progress, if any."""
+    record = _current_call.get()
+    if record is not None:
+        record.update(fields)
+
+
+def _usage_counts(usage: Any) -> Dict[str, int]:
+    if usage is None:
+        return {}
+    get = (lambda name: usage.get(name)) if isinstance(usage, dict) else (lambda name: getattr(usage, name, None))
+    # Chat completions
+    if get('prompt_tokens') is not None:
+        details = get('completion_tokens_details')
+        reasoning = getattr(details, 'reasoning_tokens', None) if details is not None else None
+        return {'input_tokens': get('prompt_tokens') or 0, 'output_tokens': get('completion_tokens') or 0,
+                'reasoning_tokens': reasoning or 0}
+    # Responses API
+    if get('input_tokens') is not None:
+        details = get('output_tokens_details')
+        reasoning = getattr(details, 'reasoning_tokens', None) if details is not None else None
+        return {'input_tokens': get('input_tokens') or 0, 'output_tokens': get('output_tokens') or 0,
+                'reasoning_tokens': reasoning or 0}
+    # Gemini usage_metadata; thinking tokens are reported separately from the candidates
+    if get('prompt_token_count') is not None:
+        thoughts = get('thoughts_token_count') or 0
+        return {'input_tokens': get('prompt_token_count') or 0,
+                'output_tokens': (get('candidates_token_count') or 0) + thoughts,
+                'reasoning_tokens': thoughts}
+    return {}
+
+
+def record_usage(model: str, response: Any) -> None:
+    """
+    Record the model, token usage and estimated cost of an SDK response on the call in progress.
+
+    Understands OpenAI chat completions and responses (`usage`) and Gemini
+    (`usage_metadata`). Output tokens include reasoning tokens.
+
+    Args:
+        model: Model name
+        response: SDK response object
+    """
+    record_token_usage(model, getattr(response, 'usage', None) or getattr(response, 'usage_metadata', None))
+
+
+def record_token_usage(model: str, usage: Any) -> None:
+    """
+    Record the model, token usage and estimated cost of a call from a usage object.
+
+    Args:
+        model: Model name
+        usage: OpenAI `usage` or Gemini `usage_metadata`, e.g. from the last chunk of a stream
+    """
+    counts = _usage_counts(usage)
+    annotate(model=model, **counts)
+    if counts:
+        annotate(cost=estimate_cost(model, counts['input_tokens'], counts['output_tokens']))
+
+
+class Telemetry:
+    """
+    Structured per-call log.
+
+    Every call made through api_retry.APICaller appends one JSON line with its
+    stage, model, labels, wall time, queue wait (rate limiter and concurrency
+    gate), latency of the final attempt, number of attempts, token usage,
+    estimated cost and status.
+    """
+
+    def __init__(self, path: str = DEFAULT_TELEMETRY_PATH, enabled: bool = True):
+        """
+        Args:
+            path: JSONL file to append records to
+            enabled: If False, nothing is recorded
+        """
+        self.path = path
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._file = None
+
+    def begin(self, stage: Optional[str]) -> Optional[Dict[str, Any]]:
+        """
+        Start the record of one call and make it the call in progress.
+
+        Args:
+            stage: 'generate', 'judge', 'extract', ...
+
+        Returns:
+            The record to fill in, or None when telemetry is disabled
+        """
+        if not self.enabled:
+            return None
+        record = {'time': time.time(), 'stage': stage, **_labels.get(),
+                  'attempts': 0, 'queue_wait': 0.0, 'latency': None, 'cached': False}
+        _current_call.set(record)
+        return record
+
+    def end(self, record: Optional[Dict[str, Any]], status: str) -> None:
+        """
+        Finish and write a record.
+
+        Args:
+            record: Record from `begin`
+            status: 'ok', or the error class of the final attempt
+        """
+        if record is None:
+            return
+        _current_call.set(None)
+        record['wall_time'] = time.time() - record['time']
+        record['status'] = status
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(line + '\n')
+            self._file.flush()
+
+
+telemetry = Telemetry()
+
+
+def add_telemetry_arguments(parser) -> None:
+    """
+    Add the shared telemetry switches to an argument parser.
+
+    Args:
+        parser: argparse.ArgumentParser to extend
+    """
+    parser.add_argument('--telemetry_path', type=str, default=DEFAULT_TELEMETRY_PATH, help='JSONL file for per-call telemetry')
+    parser.add_argument('--no-telemetry', dest='no_telemetry', action='store_true', help='Do not record per-call telemetry')
+
+
+def configure_telemetry(args) -> None:
+    """Apply parsed command-line switches from `add_telemetry_arguments`."""
+    telemetry.path = args.telemetry_path
+    telemetry.enabled = not args.no_telemetry
+
+
+def load_records(path: str = DEFAULT_TELEMETRY_PATH):
+    """Load telemetry records into a pandas DataFrame."""
+    import pandas as pd
+
+    with open(path, encoding='utf-8') as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+
+def summarize(records, by: List[str]):
+    """
+    Summarize telemetry records.
+
+    Latency percentiles and throughput only count calls that reached the API;
+    cache hits are counted separately.
+
+    Args:
+        records: Frame from `load_records`
+        by: Grouping columns, e.g. ['stage', 'model'] or ['model', 'exam_id']
+
+    Returns:
+        Frame with call counts, latency percentiles, mean queue wait, retries,
+        token totals, output tokens per second and total cost per group
+    """
+    import pandas as pd
+
+    records = records.copy()
+    for column in by + ['input_tokens', 'output_tokens', 'reasoning_tokens', 'cost']:
+        if column not in records.columns:
+            records[column] = None
+    records[by] = records[by].fillna('-')
+    api = records[~records['cached'].astype(bool)]
+
+    def group_summary(group):
+        latency = group['latency'].dropna()
+        ok = group[group['status'] == 'ok']
+        output = ok['output_tokens'].fillna(0).sum()
+        return pd.Series({
+            'calls': len(group),
+            'errors': int((group['status'] != 'ok').sum()),
+            'retries': int((group['attempts'] - 1).clip(lower=0).sum()),
+            'p50_latency': latency.quantile(0.5) if len(latency) else None,
+            'p95_latency': latency.quantile(0.95) if len(latency) else None,
+            'p99_latency': latency.quantile(0.99) if len(latency) else None,
+            'mean_queue_wait': group['queue_wait'].mean(),
+            'input_tokens': int(ok['input_tokens'].fillna(0).sum()),
+            'output_tokens': int(output),
+            'reasoning_tokens': int(ok['reasoning_tokens'].fillna(0).sum()),
+            'output_tokens_per_s': output / ok['latency'].sum() if ok['latency'].sum() else None,
+            'cost': ok['cost'].sum(min_count=1),
+        })
+
+    if len(api):
+        summary = api.groupby(by).apply(group_summary)
+    else:
+        # groupby().apply() on an empty frame returns the record columns instead of the summary
+        index = pd.MultiIndex.from_tuples([], names=by) if len(by) > 1 else pd.Index([], name=by[0])
+        summary = pd.DataFrame(columns=group_summary(api).index, index=index)
+    cached = records[records['cached'].astype(bool)].groupby(by).size().rename('cache_hits')
+    summary = summary.join(cached, how='outer')
+    # Groups with only cache hits make no API calls; the outer join left their counts empty
+    counts = ['calls', 'errors', 'retries', 'input_tokens', 'output_tokens', 'reasoning_tokens', 'cache_hits']
+    return summary.fillna({column: 0 for column in counts}).astype({column: int for column in counts})
+
+
+def main() -> None:
+    """Print a telemetry summary report."""
+    parser = argparse.ArgumentParser(description="Summarize per-call API telemetry.")
+    parser.add_argument('--path', type=str, default=DEFAULT_TELEMETRY_PATH, help='Telemetry JSONL file')
+    parser.add_argument('--by', type=str, default='stage,model', help='Comma-separated grouping columns, e.g. model,exam_id')
+    parser.add_argument('--since', type=float, default=None, help='Only include calls made in the last N hours')
+    args = parser.parse_args()
+
+    import pandas as pd
+
+    records = load_records(args.path)
+    if args.since is not None:
+        records = records[records['time'] >= time.time() - args.since * 3600]
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200):
+        print(summarize(records, args.by.split(',')))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import asyncio
+import base64
+import json
+import os
+
+import pytest
+
+from api_retry import APICaller
+from batch_api import (BatchJournal, gemini_request, make_custom_id, openai_chat_request, parse_custom_id,
+                       parse_gemini_output, parse_openai_output, run_openai_batch, to_jsonl)
+from telemetry import Telemetry
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def test_custom_id_round_trip():
+    assert parse_custom_id(make_custom_id('LC003ALP100EV_problems', 12)) == ('LC003ALP100EV_problems', 12)
+
+
+def test_to_jsonl_writes_one_request_per_line():
+    requests = [openai_chat_request(make_custom_id('LC003ALP100IV_problems', index), 'o4-mini', 'Réitigh é.',
+                                    ['data:image/png;base64,AAAA'], 1000) for index in range(3)]
+    payload = to_jsonl(requests)
+    assert payload.endswith(b'\n')
+    lines = payload.decode('utf-8').splitlines()
+    assert [json.loads(line) for line in lines] == requests
+    # Non-ASCII text is kept as UTF-8 rather than escaped
+    assert 'Réitigh' in lines[0]
+
+
+def test_parse_openai_output():
+    results = parse_openai_output(read_fixture('openai_batch_output.jsonl'))
+    assert results['LC003ALP100EV_problems:0'] == 'Answer: 42\nConfidence: 80%'
+    assert results['LC003ALP100EV_problems:1'] == '{"correct": "yes"}'
+    assert results['LC003ALP100EV_problems:2'].startswith('Error:')
+    assert 'Invalid image' in results['LC003ALP100EV_problems:2']
+    assert 'batch_expired' in results['LC003ALP100IV_problems:0']
+    assert results['LC003ALP100IV_problems:1'] == 'Error: Empty response'
+
+
+def test_parse_gemini_output():
+    results = parse_gemini_output(read_fixture('gemini_batch_output.jsonl'))
+    # Thought parts are dropped and the remaining text parts are joined
+    assert results['LC003ALP100EV_problems:0'] == '{"correct": "yes", "confidence": "90"}'
+    assert results['LC003ALP100EV_problems:1'].startswith('Error:')
+    assert results['LC003ALP100IV_problems:0'] == 'Error: Empty response'
+
+
+def test_gemini_request_is_json_serializable():
+    pydantic = pytest.importorskip('pydantic')
+
+    class Judgement(pydantic.BaseModel):
+        correct: str
+        confidence: str
+
+    config = {'response_mime_type': 'application/json', 'response_schema': Judgement}
+    request = gemini_request('LC003ALP100EV_problems:0', 'Judge this.', [(b'\x89PNG', 'image/png')], config)
+    line = json.loads(to_jsonl([request]))
+    assert line['key'] == 'LC003ALP100EV_problems:0'
+    image, text = line['request']['contents'][0]['parts']
+    assert base64.b64decode(image['inline_data']['data']) == b'\x89PNG'
+    assert text == {'text': 'Judge this.'}
+    schema = line['request']['generation_config']['response_schema']
+    assert schema == {'type': 'OBJECT', 'properties': {'correct': {'type': 'STRING'}, 'confidence': {'type': 'STRING'}},
+                      'required': ['correct', 'confidence']}
+    # The caller's config is not modified
+    assert config['response_schema'] is Judgement
+
+
+def test_journal_resumes_only_the_same_requests(tmp_path):
+    journal = BatchJournal('generate_org/model', str(tmp_path))
+    assert journal.load(['a:0']) is None
+    journal.save('batch_1', ['a:0', 'a:1'])
+    assert journal.load(['a:1', 'a:0']) == 'batch_1'
+    assert journal.load(['a:0']) is None
+    journal.clear()
+    assert journal.load(['a:0', 'a:1']) is None
+
+
+@pytest.fixture
+def mock_server():
+    from mock_provider import MockSettings, serve
+
+    server = serve(MockSettings(seed=0))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_run_openai_batch_against_mock_server(mock_server, tmp_path):
+    openai = pytest.importorskip('openai')
+    client = openai.AsyncOpenAI(api_key='test', base_url=f'{mock_server.url}/v1')
+    caller = APICaller(stage='batch', recorder=Telemetry(enabled=False))
+    requests = [openai_chat_request(make_custom_id('LC003ALP100EV_problems', index), 'mock', f'Question {index}',
+                                    [], 1000) for index in range(3)]
+    journal = BatchJournal('generate_mock', str(tmp_path))
+
+    results = asyncio.run(run_openai_batch(client, requests, '/v1/chat/completions', 0, caller, journal))
+    assert set(results) == {request['custom_id'] for request in requests}
+    assert all(text.startswith('This is a mock response.') for text in results.values())
+    assert mock_server.snapshot()['batches'] == 1
+
+    # Until the journal is cleared, a rerun with the same requests resumes the saved batch
+    assert asyncio.run(run_openai_batch(client, requests, '/v1/chat/completions', 0, caller, journal)) == results
+    assert mock_server.snapshot()['batches'] == 1
+
+    journal.clear()
+    asyncio.run(run_openai_batch(client, requests, '/v1/chat/completions', 0, caller, journal))
+    assert mock_server.snapshot()['batches'] == 2
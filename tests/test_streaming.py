@@ -0,0 +1,71 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from streaming import FORMAT_COMPLETE, StreamSettings, consume_stream
+
+
+@pytest.mark.parametrize('text', [
+    'Answer: 42\nConfidence: 85%',
+    'Working...\n**Answer:** 42\n**Confidence:** 85%',
+    '**Answer**: 42\n**Confidence**: 85 %',
+    'Answer: x = 2\n\nConfidence: *90.5%*',
+])
+def test_format_complete(text):
+    assert FORMAT_COMPLETE.search(text)
+
+
+@pytest.mark.parametrize('text', [
+    'Answer: 42\nConfidence: ',
+    '**Answer:** 42\n**Confidence:** 8',
+    '**Confidence:** 85%',
+    'Answer: 42\nConfidence: high, about 85%',
+])
+def test_format_incomplete(text):
+    assert not FORMAT_COMPLETE.search(text)
+
+
+class FakeStream:
+    """Async iterator of chat completion chunks, one per text piece."""
+
+    def __init__(self, pieces):
+        self.pieces = list(pieces)
+        self.read = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.read == len(self.pieces):
+            raise StopAsyncIteration
+        piece = self.pieces[self.read]
+        self.read += 1
+        delta = SimpleNamespace(content=piece)
+        return SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=delta, finish_reason=None)])
+
+
+def test_stop_on_bold_format():
+    stream = FakeStream(['**Answer:** 42\n', '**Confidence:** ', '85', '%', '\nMore text', ' that is never read'])
+    text, fields, _ = asyncio.run(consume_stream(stream, StreamSettings(enabled=True), time.perf_counter()))
+    assert text == '**Answer:** 42\n**Confidence:** 85%'
+    assert fields['stop_reason'] == 'format'
+    assert not fields['truncated']
+    assert stream.read == 4
+
+
+def test_format_search_waits_for_percent(monkeypatch):
+    searched = []
+    pattern = FORMAT_COMPLETE
+
+    class CountingPattern:
+        def search(self, text):
+            searched.append(text)
+            return pattern.search(text)
+
+    monkeypatch.setattr('streaming.FORMAT_COMPLETE', CountingPattern())
+    pieces = ['Working'] + [' step'] * 200 + ['\nAnswer: 42\n', 'Confidence: 90', '%']
+    text, fields, _ = asyncio.run(consume_stream(FakeStream(pieces), StreamSettings(enabled=True), time.perf_counter()))
+    assert fields['stop_reason'] == 'format'
+    assert searched == [text]
@@ -1,19 +1,60 @@
-import matplotlib.pyplot as plt
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
 import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
-from typing import Dict, List, Tuple, Optional, Any
+from typing import Dict, List, Tuple, Optional, Any, Sequence
 
 # Import the data processing functions
 from get_results import prepare_visualization_data, name_mappings
 
-def plot_language_comparison(data: Dict[str, Any]) -> None:
+# pyplot is imported inside the plot functions, so that --headless can select the
+# Agg backend before pyplot loads and picks an interactive one
+
+# Records the input hash of every rendered figure, so unchanged figures are skipped
+RENDER_HASHES_FILE = '.render_hashes.json'
+
+def save_figure(fig, name: str, output_dir: str = 'output', formats: Sequence[str] = ('png',),
+                dpi: int = 300, show: bool = True) -> None:
+    """
+    Save a matplotlib figure in every requested format, then show or close it.
+    
+    Args:
+        fig: Figure to save
+        name: File name without extension
+        output_dir: Directory to save the figure in
+        formats: File formats, e.g. ('png', 'pdf', 'svg')
+        dpi: Resolution of raster formats
+        show: Display the figure; otherwise it is closed to free memory
+    """
+    import matplotlib.pyplot as plt
+
+    os.makedirs(output_dir, exist_ok=True)
+    for fmt in formats:
+        fig.savefig(os.path.join(output_dir, f'{name}.{fmt}'), dpi=dpi, bbox_inches='tight')
+    if show:
+        plt.show()
+    else:
+        plt.close(fig)
+
+def plot_language_comparison(data: Dict[str, Any], output_dir: str = 'output', formats: Sequence[str] = ('png',),
+                             dpi: int = 300, show: bool = True) -> None:
     """
     Plot comparison of model performance between English and Irish.
     
     Args:
         data: Dictionary containing results data
+        output_dir: Directory to save the figure in
+        formats: File formats to save, e.g. ('png', 'pdf')
+        dpi: Resolution of raster formats
+        show: Display the figure after saving it
     """
+    import matplotlib.pyplot as plt
+
     # Set a more appealing style
     plt.style.use('seaborn-v0_8-whitegrid')
     
@@ -30,10 +71,19 @@ def plot_language_comparison(data: Dict[str, Any]) -> None:
     
     # Plot with improved styling
     fig, ax = plt.subplots(figsize=(10, 7))
+    # Bootstrap confidence intervals as error bars, when available
+    intervals = data.get('result_intervals')
+    errors = {}
+    if intervals:
+        for language in ['English', 'Irish']:
+            low, high = np.asarray(intervals[language])
+            errors[language] = [np.asarray(results[language]) - low, high - np.asarray(results[language])]
     bars1 = ax.bar(x - width/2, results['English'], width, label='English', 
-                   color=colors[0], edgecolor='white', linewidth=1)
+                   color=colors[0], edgecolor='white', linewidth=1,
+                   yerr=errors.get('English'), capsize=4, error_kw={'elinewidth': 1})
     bars2 = ax.bar(x + width/2, results['Irish'], width, label='Irish', 
-                   color=colors[1], edgecolor='white', linewidth=1)
+                   color=colors[1], edgecolor='white', linewidth=1,
+                   yerr=errors.get('Irish'), capsize=4, error_kw={'elinewidth': 1})
     
     # Improved styling for labels and title
     ax.set_ylabel('Score', fontsize=14, fontweight='bold')
@@ -60,17 +110,34 @@ def plot_language_comparison(data: Dict[str, Any]) -> None:
                         ha='center', va='bottom',
                         fontsize=12, fontweight='bold')
     
+    # Mark models whose paired English-Irish gap is significant
+    gaps = data.get('language_gaps')
+    if gaps:
+        for i, p_value in enumerate(gaps['p_value']):
+            if p_value < 0.05:
+                top = max(bars1[i].get_height(), bars2[i].get_height())
+                if errors:
+                    top = max(top, intervals['English'][1][i], intervals['Irish'][1][i])
+                ax.annotate('*' if p_value >= 0.01 else '**', xy=(x[i], top), xytext=(0, 14),
+                            textcoords="offset points", ha='center', fontsize=16, fontweight='bold')
+    
     plt.tight_layout()
-    plt.savefig('output/language_comparison.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    save_figure(plt.gcf(), 'language_comparison', output_dir, formats, dpi, show)
 
-def plot_results_vs_confidence(data: Dict[str, Any]) -> None:
+def plot_results_vs_confidence(data: Dict[str, Any], output_dir: str = 'output', formats: Sequence[str] = ('png',),
+                               dpi: int = 300, show: bool = True) -> None:
     """
     Plot model performance: results vs. confidence with arrows.
     
     Args:
         data: Dictionary containing results and confidence data
+        output_dir: Directory to save the figure in
+        formats: File formats to save, e.g. ('png', 'pdf')
+        dpi: Resolution of raster formats
+        show: Display the figure after saving it
     """
+    import matplotlib.pyplot as plt
+
     # Extract data
     models = data['models']
     results = data['results']
@@ -130,16 +197,22 @@ def plot_results_vs_confidence(data: Dict[str, Any]) -> None:
     plt.ylim([80, 100])
     
     plt.tight_layout()
-    plt.savefig('output/results_vs_confidence.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    save_figure(plt.gcf(), 'results_vs_confidence', output_dir, formats, dpi, show)
 
-def plot_radar_chart(data: Dict[str, Any]) -> None:
+def plot_radar_chart(data: Dict[str, Any], output_dir: str = 'output', formats: Sequence[str] = ('png',),
+                     dpi: int = 300, show: bool = True) -> None:
     """
     Create a radar chart showing model performance across subject areas.
     
     Args:
         data: Dictionary containing subject results data
+        output_dir: Directory to save the figure in
+        formats: File formats to save, e.g. ('png', 'pdf')
+        dpi: Resolution of raster formats
+        show: Display the figure after saving it
     """
+    import matplotlib.pyplot as plt
+
     # Extract data
     models = data['models']
     subject_results = data['subject_results']
@@ -197,16 +270,22 @@ def plot_radar_chart(data: Dict[str, Any]) -> None:
     ax.grid(color='gray', linestyle='--', linewidth=0.5, alpha=0.7)
     
     plt.tight_layout()
-    plt.savefig('output/radar_chart.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    save_figure(plt.gcf(), 'radar_chart', output_dir, formats, dpi, show)
 
-def plot_language_fidelity(data: Dict[str, Any]) -> None:
+def plot_language_fidelity(data: Dict[str, Any], output_dir: str = 'output', formats: Sequence[str] = ('png',),
+                           dpi: int = 300, show: bool = True) -> None:
     """
     Plot language fidelity statistics for Irish responses.
     
     Args:
         data: Dictionary containing language data
+        output_dir: Directory to save the figure in
+        formats: File formats to save, e.g. ('png', 'pdf')
+        dpi: Resolution of raster formats
+        show: Display the figure after saving it
     """
+    import matplotlib.pyplot as plt
+
     # Extract data
     models = data['language_models']
     language_data = data['language_data']
@@ -260,16 +339,22 @@ def plot_language_fidelity(data: Dict[str, Any]) -> None:
                         fontsize=12, fontweight='bold')
     
     plt.tight_layout()
-    plt.savefig('output/language_fidelity.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    save_figure(plt.gcf(), 'language_fidelity', output_dir, formats, dpi, show)
 
-def plot_benchmark_comparison(data: Dict[str, Any]) -> None:
+def plot_benchmark_comparison(data: Dict[str, Any], output_dir: str = 'output', formats: Sequence[str] = ('png',),
+                              dpi: int = 300, show: bool = True) -> None:
     """
     Plot performance comparison across different Irish benchmarks.
     
     Args:
         data: Dictionary containing benchmark data
+        output_dir: Directory to save the figure in
+        formats: File formats to save, e.g. ('png', 'pdf')
+        dpi: Resolution of raster formats
+        show: Display the figure after saving it
     """
+    import matplotlib.pyplot as plt
+
     # Extract data
     models = data['benchmark_models']
     benchmark_data = data['benchmark_data']
@@ -327,15 +412,19 @@ def plot_benchmark_comparison(data: Dict[str, Any]) -> None:
                         fontsize=12, fontweight='bold')
     
     plt.tight_layout()
-    plt.savefig('output/benchmark_comparison.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    save_figure(plt.gcf(), 'benchmark_comparison', output_dir, formats, dpi, show)
 
-def plot_subject_distribution(data: Dict[str, Any]) -> None:
+def plot_subject_distribution(data: Dict[str, Any], output_dir: str = 'output', formats: Sequence[str] = ('png',),
+                              dpi: int = 300, show: bool = True) -> None:
     """
     Create a sunburst chart of the subject distribution.
     
     Args:
         data: Dictionary containing subject count data
+        output_dir: Directory to save the figure in
+        formats: Unused; the chart is always written as interactive HTML
+        dpi: Unused
+        show: Display the figure after saving it
     """
     subject_count = data['subject_count']
     
@@ -385,19 +474,139 @@ def plot_subject_distribution(data: Dict[str, Any]) -> None:
     ))
     
     fig.update_layout(margin=dict(t=0, l=0, r=0, b=0))
-    fig.write_html('subject_distribution.html')
-    fig.show()
+    os.makedirs(output_dir, exist_ok=True)
+    fig.write_html(os.path.join(output_dir, 'subject_distribution.html'))
+    if show:
+        fig.show()
 
-if __name__ == "__main__":
-    # Get data for visualization
-    data = prepare_visualization_data()
+# Plot function and the data entries it reads, so a figure is only redrawn when its own inputs change
+PLOTS = {
+    'language_comparison': (plot_language_comparison, ['models', 'results', 'result_intervals', 'language_gaps']),
+    'results_vs_confidence': (plot_results_vs_confidence, ['models', 'results', 'confidences']),
+    'radar_chart': (plot_radar_chart, ['models', 'subject_results']),
+    'language_fidelity': (plot_language_fidelity, ['language_models', 'language_data']),
+    'benchmark_comparison': (plot_benchmark_comparison, ['benchmark_models', 'benchmark_data']),
+    'subject_distribution': (plot_subject_distribution, ['subject_count']),
+}
+
+# benchmark_comparison and subject_distribution plot hand-entered numbers (BENCHMARK_DATA and SUBJECT_COUNT in
+# get_results.py) that are not shipped with the repository, so they are only drawn when asked for with --plots
+DEFAULT_PLOTS = ['language_comparison', 'results_vs_confidence', 'radar_chart', 'language_fidelity']
+
+def figure_hash(name: str, data: Dict[str, Any], formats: Sequence[str], dpi: int) -> str:
+    """
+    Hash the inputs of one figure.
     
-    # Generate all plots
-    plot_language_comparison(data)
-    plot_results_vs_confidence(data)
-    plot_radar_chart(data)
-    plot_language_fidelity(data)
-    plot_benchmark_comparison(data)
-    plot_subject_distribution(data)
+    Args:
+        name: Key of PLOTS
+        data: Dictionary from prepare_visualization_data
+        formats: Output formats
+        dpi: Resolution
+    
+    Returns:
+        Hex SHA-256 digest of the plot's data entries and render settings
+    """
+    inputs = {key: data.get(key) for key in PLOTS[name][1]}
+    payload = json.dumps([name, inputs, sorted(formats), dpi], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def figure_files(name: str, output_dir: str, formats: Sequence[str]) -> List[str]:
+    """Get the files written for one figure."""
+    if name == 'subject_distribution':
+        return [os.path.join(output_dir, f'{name}.html')]
+    return [os.path.join(output_dir, f'{name}.{fmt}') for fmt in formats]
+
+def _render(name: str, data: Dict[str, Any], output_dir: str, formats: Sequence[str], dpi: int) -> str:
+    # Runs in a worker process; Agg needs no display
+    matplotlib.use('Agg')
+    PLOTS[name][0](data, output_dir=output_dir, formats=formats, dpi=dpi, show=False)
+    return name
+
+def render_figures(data: Dict[str, Any], names: Sequence[str] = DEFAULT_PLOTS, output_dir: str = 'output',
+                   formats: Sequence[str] = ('png',), dpi: int = 300, workers: Optional[int] = None,
+                   force: bool = False) -> List[str]:
+    """
+    Render figures headlessly in a process pool.
     
-    print("All visualizations have been generated and saved.")
+    A figure is skipped when the hash of its inputs matches the one recorded at its
+    last render and all of its files still exist.
+    
+    Args:
+        data: Dictionary from prepare_visualization_data
+        names: Keys of PLOTS to render
+        output_dir: Directory to save the figures in
+        formats: File formats, e.g. ('png', 'pdf')
+        dpi: Resolution of raster formats
+        workers: Number of rendering processes (default: one per CPU)
+        force: Render every figure even if its inputs are unchanged
+    
+    Returns:
+        Names of the figures that were rendered
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    hashes_path = os.path.join(output_dir, RENDER_HASHES_FILE)
+    hashes = {}
+    if os.path.exists(hashes_path):
+        with open(hashes_path, encoding='utf-8') as f:
+            hashes = json.load(f)
+    
+    pending = {}
+    for name in names:
+        digest = figure_hash(name, data, formats, dpi)
+        files_exist = all(os.path.exists(path) for path in figure_files(name, output_dir, formats))
+        if force or hashes.get(name) != digest or not files_exist:
+            pending[name] = digest
+    
+    rendered = []
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_render, name, data, output_dir, formats, dpi) for name in pending]
+            for future in futures:
+                name = future.result()
+                hashes[name] = pending[name]
+                rendered.append(name)
+        tmp_path = f'{hashes_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(hashes, f, indent=2)
+        os.replace(tmp_path, hashes_path)
+    return rendered
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plot IRLBench results.")
+    parser.add_argument("--judge-model", default=None, help="Judge model whose verdicts are plotted")
+    parser.add_argument("--models", default=None, help="Comma-separated student models (default: all judged)")
+    parser.add_argument("--warehouse", default=None, help="Results database (default: cache/results.sqlite)")
+    parser.add_argument("--judgements-dir", default="judgements", help="Directory containing judgements")
+    parser.add_argument("--responses-dir", default="responses", help="Directory containing responses")
+    parser.add_argument("--output-dir", default="output", help="Directory to save figures")
+    parser.add_argument("--plots", default=",".join(DEFAULT_PLOTS), help=f"Comma-separated figures to draw, from: {', '.join(PLOTS)}")
+    parser.add_argument("--formats", default="png", help="Comma-separated output formats, e.g. png,pdf,svg")
+    parser.add_argument("--dpi", type=int, default=300, help="Resolution of raster formats")
+    parser.add_argument("--headless", action="store_true", help="Render with the Agg backend in parallel, without showing figures")
+    parser.add_argument("--workers", type=int, default=None, help="Rendering processes in headless mode (default: one per CPU)")
+    parser.add_argument("--force", action="store_true", help="Redraw figures whose inputs are unchanged")
+    args = parser.parse_args()
+    names = args.plots.split(',')
+    formats = args.formats.split(',')
+
+    # Get data for visualization
+    data = prepare_visualization_data(
+        judge_model=args.judge_model,
+        models=args.models.split(',') if args.models else None,
+        warehouse_path=args.warehouse,
+        judgements_dir=args.judgements_dir,
+        responses_dir=args.responses_dir
+    )
+    if 'benchmark_comparison' in names and not data['benchmark_models']:
+        parser.error("benchmark_comparison needs BENCHMARK_MODELS and BENCHMARK_DATA in get_results.py")
+    if 'subject_distribution' in names and not data['subject_count']:
+        parser.error("subject_distribution needs SUBJECT_COUNT in get_results.py")
+
+    if args.headless:
+        matplotlib.use('Agg')
+        rendered = render_figures(data, names, args.output_dir, formats, args.dpi, args.workers, args.force)
+        print(f"Rendered {len(rendered)} of {len(names)} figures ({len(names) - len(rendered)} unchanged)")
+    else:
+        # Generate all plots
+        for name in names:
+            PLOTS[name][0](data, output_dir=args.output_dir, formats=formats, dpi=args.dpi)